@@ -0,0 +1,6 @@
+
+import sys
+import src.batch
+
+if __name__ == '__main__':
+   sys.exit(src.batch.main(sys.argv[1:]))
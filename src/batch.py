@@ -0,0 +1,142 @@
+
+import argparse, glob, multiprocessing, os, sys, time, traceback
+
+try:
+   get_time = time.perf_counter
+except AttributeError:
+   get_time = time.clock
+
+from src.model import *
+
+BATCH_ACTIONS = ('btree', 'save', 'check')
+
+OUTPUT_SUFFIXES = {
+   'btree': '.btree.json',
+   'save':  '.json'}
+
+#===============================================================================
+# Non-interactive conversion of many model files. Each file is processed by
+# one of the worker processes: 'btree' exports the model to binary tree format,
+# 'save' saves it again in the editor's format (binary if the output suffix is
+# .m2d), 'check' only loads and saves it in memory to validate it. Input files
+# can be in either format.
+#===============================================================================
+
+def process_file(job):
+   action, input_path, output_path, options = job
+   start = get_time()
+   error = None
+   try:
+      model = Model()
+      model.load_model(load_model_file(input_path))
+      if (action == 'save') and (output_path is not None) and is_binary_model_path(output_path):
+         write_binary_model(output_path, model, options['float_type'])
+      else:
+         data = model.export_btree(options['split'], options['layout']) if (action == 'btree') else model.save_model()
+         if output_path is None:
+            dump_json(data, options['indent'], options['precision'])
+         else:
+            with open(output_path, 'w') as f:
+               write_json(f, data, options['indent'], options['precision'])
+   except Exception as e:
+      error = traceback.format_exception_only(type(e), e)[-1].strip()
+   return (input_path, output_path, get_time() - start, error)
+
+def expand_inputs(patterns):
+   # Returns paths of all the files matched by the patterns in the given order, and the patterns matching nothing.
+   paths = []
+   unmatched = []
+   for pattern in patterns:
+      matches = sorted(path for path in glob.glob(pattern, recursive = True) if os.path.isfile(path))
+      if not matches:
+         unmatched.append(pattern)
+      paths.extend(path for path in matches if path not in paths)
+   return (paths, unmatched)
+
+def get_output_path(input_path, output_dir, suffix):
+   if suffix is None:
+      return None
+   name = os.path.splitext(os.path.basename(input_path))[0] + suffix
+   return os.path.join(output_dir if output_dir else os.path.dirname(input_path), name)
+
+def get_path_key(path):
+   # Paths referring to the same file compare equal, unless they go through links.
+   return os.path.normcase(os.path.abspath(path))
+
+def is_up_to_date(input_path, output_path):
+   return (output_path is not None) and (output_path != input_path) and os.path.isfile(output_path) and \
+      (os.path.getmtime(output_path) >= os.path.getmtime(input_path))
+
+def parse_args(args):
+   parser = argparse.ArgumentParser(description = 'Converts or validates model files without opening the editor.')
+   parser.add_argument('inputs', nargs = '+', metavar = 'input', help = 'model file or glob pattern (** matches subdirectories)')
+   parser.add_argument('-a', '--action', choices = BATCH_ACTIONS, default = 'btree', help = 'export to binary tree format (default), save again, or only validate')
+   parser.add_argument('-o', '--output-dir', help = 'directory for output files, next to the input files by default')
+   parser.add_argument('-s', '--suffix', help = 'replaces the extension of input file names in output file names')
+   parser.add_argument('-j', '--jobs', type = int, default = multiprocessing.cpu_count(), help = 'number of worker processes (default: number of CPUs)')
+   parser.add_argument('-l', '--layout', choices = BTREE_LAYOUTS, default = 'nested', help = 'write binary tree as nested objects (default) or flat arrays of nodes')
+   parser.add_argument('-t', '--split', choices = BTREE_SPLITS, default = 'sah', help = 'divide binary tree nodes by surface area heuristic (default) or at the median')
+   parser.add_argument('-f', '--float-type', choices = sorted(BINARY_FLOAT_TYPES), default = 'float64', help = 'store numbers in binary files as float64 (default) or float32')
+   parser.add_argument('-c', '--compact', action = 'store_true', help = 'write JSON files without any whitespace')
+   parser.add_argument('-p', '--precision', type = int, help = 'round numbers in JSON files to this many decimal places')
+   parser.add_argument('-i', '--incremental', action = 'store_true', help = 'skip input files whose output files are newer')
+   parser.add_argument('-w', '--overwrite', action = 'store_true', help = 'allow output files to replace their input files')
+   return parser.parse_args(args)
+
+def main(args):
+   args = parse_args(args)
+   # Files are only validated if there is no suffix for output files.
+   if args.action == 'check':
+      suffix = None
+   else:
+      suffix = OUTPUT_SUFFIXES[args.action] if (args.suffix is None) else args.suffix
+   paths, unmatched = expand_inputs(args.inputs)
+   for pattern in unmatched:
+      sys.stderr.write('No files matching {}\n'.format(pattern))
+   if args.output_dir and (suffix is not None) and not os.path.isdir(args.output_dir):
+      os.makedirs(args.output_dir)
+   options = {
+      'indent':     None if args.compact else 1,
+      'precision':  args.precision,
+      'split':      args.split,
+      'layout':     args.layout,
+      'float_type': args.float_type}
+   jobs = []
+   skipped = 0
+   rejected = 0
+   output_paths = {}
+   for path in paths:
+      output_path = get_output_path(path, args.output_dir, suffix)
+      if output_path is not None:
+         # Two inputs writing to the same file would overwrite each other, or both write it at once.
+         key = get_path_key(output_path)
+         if key in output_paths:
+            sys.stderr.write('Both {} and {} would be written to {}\n'.format(output_paths[key], path, output_path))
+            return 1
+         output_paths[key] = path
+      if (output_path is not None) and (get_path_key(output_path) == get_path_key(path)) and not args.overwrite:
+         sys.stderr.write('Skipping {}: output would replace the input file, use --overwrite to allow it\n'.format(path))
+         rejected += 1
+      elif args.incremental and is_up_to_date(path, output_path):
+         skipped += 1
+      else:
+         jobs.append((args.action, path, output_path, options))
+   start = get_time()
+   if (args.jobs > 1) and (len(jobs) > 1):
+      pool = multiprocessing.Pool(min(args.jobs, len(jobs)))
+      results = pool.imap_unordered(process_file, jobs)
+   else:
+      pool = None
+      results = map(process_file, jobs)
+   failed = 0
+   for input_path, output_path, seconds, error in results:
+      if error is None:
+         sys.stdout.write('{:8.3f} s  {}{}\n'.format(seconds, input_path, (' -> ' + output_path) if output_path else ''))
+      else:
+         failed += 1
+         sys.stderr.write('{:8.3f} s  {}  FAILED: {}\n'.format(seconds, input_path, error))
+   if pool is not None:
+      pool.close()
+      pool.join()
+   sys.stdout.write('{} processed, {} failed, {} skipped in {:.3f} s\n'.format(len(jobs) - failed, failed, skipped + rejected, get_time() - start))
+   return 1 if (failed or unmatched or rejected) else 0
@@ -0,0 +1,136 @@
+
+import gc, json, mmap, os, struct, weakref
+import numpy as np
+
+BINARY_EXTENSION = '.m2d'
+BINARY_MAGIC     = b'M2D\0'
+BINARY_VERSION   = 1
+BINARY_ALIGNMENT = 8
+
+BINARY_FLOAT_TYPES = {
+   'float64': '<f8',
+   'float32': '<f4'}
+
+#===============================================================================
+# Binary model format. The file starts with a header, made of the magic bytes,
+# the format version and the size of the table of contents, all little-endian
+# uint32. Table of contents follows, which is a JSON object describing where
+# the arrays are and holding entities, since they are few and have names. The
+# arrays are stored after that, each one aligned to 8 bytes, with offsets
+# relative to the end of the table of contents:
+#
+#  vertices          float64 or float32 (N, 2) for each frame of each animation
+#  colors            float64 or float32 (N, 4)
+#  texcoords         float64 or float32 (N, 2)
+#  polygon_indices   uint32, vertex indices of all polygons concatenated
+#  polygon_lengths   uint32, number of indices of each polygon
+#
+# Arrays are loaded as read-only views of a memory-mapped file, so frames are
+# used without being copied, until they are modified. Frames stored as float32
+# are converted to float64 when loaded, which takes half the space in the file,
+# but is not free of copying. A file which is still mapped cannot be replaced
+# on Windows, so frames mapped from the file being saved are copied first.
+#===============================================================================
+
+_HEADER = struct.Struct('<4sII')
+
+# Maps opened for each file, as weak references, so that it is known when none of them is in use anymore.
+_mapped_files = {}
+
+def _normalize_path(path):
+   return os.path.normcase(os.path.realpath(path))
+
+def _align(size):
+   return (size + BINARY_ALIGNMENT - 1) // BINARY_ALIGNMENT * BINARY_ALIGNMENT
+
+def is_binary_model_path(path):
+   return os.path.splitext(path)[1].lower() == BINARY_EXTENSION
+
+def is_mapped_from(array, path):
+   # Memory map is at the end of the chain of bases, the file name is on the arrays in between.
+   filename = None
+   while isinstance(array, np.ndarray):
+      filename = getattr(array, 'filename', None) or filename
+      array = array.base
+   return isinstance(array, mmap.mmap) and (filename is not None) and (_normalize_path(filename) == _normalize_path(path))
+
+def is_file_mapped(path):
+   gc.collect()
+   refs = [ref for ref in _mapped_files.get(_normalize_path(path), []) if ref() is not None]
+   _mapped_files[_normalize_path(path)] = refs
+   return len(refs) > 0
+
+def write_binary_model(path, model, float_type = 'float64'):
+   float_type = BINARY_FLOAT_TYPES[float_type]
+   arrays = []
+   frame_ids = {}
+
+   def add_array(array, dtype):
+      arrays.append(np.ascontiguousarray(array, dtype = dtype))
+      return len(arrays) - 1
+
+   def add_frame(frame):
+      # Frames shared between animations are stored once, and loaded as the same array.
+      if id(frame) not in frame_ids:
+         frame_ids[id(frame)] = add_array(frame, float_type)
+      return frame_ids[id(frame)]
+
+   polygons = model.get_complete_polygons()
+   toc = {
+      'vertices':        {name: [add_frame(frame) for frame in frames] for name, frames in model.vertices_anim.items()},
+      'colors':          add_array(np.array(model.colors, dtype = np.float64).reshape((-1, 4)), float_type),
+      'texcoords':       add_array(np.array(model.texcoords, dtype = np.float64).reshape((-1, 2)), float_type),
+      'polygon_indices': add_array([ix for poly in polygons for ix in poly], '<u4'),
+      'polygon_lengths': add_array([len(poly) for poly in polygons], '<u4'),
+      'entities':        model.save_entities(model.get_complete_entities()),
+      'arrays':          []}
+   offset = 0
+   for array in arrays:
+      toc['arrays'].append({'dtype': array.dtype.str, 'shape': array.shape, 'offset': offset})
+      offset = _align(offset + array.nbytes)
+   toc = json.dumps(toc, separators = (',', ':'), sort_keys = True).encode('utf-8')
+   toc += b' ' * (_align(_HEADER.size + len(toc)) - _HEADER.size - len(toc))
+   # Written to a temporary file first, since the data being written may come from the file being replaced.
+   temp_path = path + '.tmp'
+   try:
+      with open(temp_path, 'wb') as f:
+         f.write(_HEADER.pack(BINARY_MAGIC, BINARY_VERSION, len(toc)))
+         f.write(toc)
+         for array in arrays:
+            f.write(array.tobytes())
+            f.write(b'\0' * (_align(array.nbytes) - array.nbytes))
+      # Model and the arrays written may still hold views of the file being replaced.
+      del arrays[:]
+      model.copy_mapped_frames(path)
+      if is_file_mapped(path):
+         raise IOError('File is in use and cannot be replaced: {}'.format(path))
+      os.replace(temp_path, path)
+   except:
+      if os.path.exists(temp_path):
+         os.remove(temp_path)
+      raise
+
+def read_binary_model(path):
+   # Returns the same data as parsed from a model file in JSON format, except for frames being arrays.
+   with open(path, 'rb') as f:
+      magic, version, toc_size = _HEADER.unpack(f.read(_HEADER.size))
+      if (magic != BINARY_MAGIC) or (version != BINARY_VERSION):
+         raise ValueError('Not a binary model file, or unsupported version')
+      toc = json.loads(f.read(toc_size).decode('utf-8'))
+   start = _HEADER.size + toc_size
+   buf = np.memmap(path, dtype = np.uint8, mode = 'r')
+   _mapped_files.setdefault(_normalize_path(path), []).append(weakref.ref(buf.base))
+   arrays = []
+   for info in toc['arrays']:
+      dtype = np.dtype(str(info['dtype']))
+      shape = tuple(info['shape'])
+      begin = start + info['offset']
+      arrays.append(buf[begin:begin + dtype.itemsize * int(np.prod(shape))].view(dtype).reshape(shape))
+   indices = arrays[toc['polygon_indices']].tolist()
+   ends = np.cumsum(arrays[toc['polygon_lengths']]).tolist()
+   return {
+      'polygons':  [indices[begin:end] for begin, end in zip([0] + ends[:-1], ends)],
+      'entities':  toc['entities'],
+      'colors':    arrays[toc['colors']].tolist(),
+      'texcoords': arrays[toc['texcoords']].tolist(),
+      'vertices':  {name: [arrays[ix] for ix in frames] for name, frames in toc['vertices'].items()}}
@@ -8,7 +8,7 @@ from ctypes import POINTER, Structure, Union
 
 _libraries = {}
 
-def _load(lib_name, fun_name, res_type, arg_types):
+def _load(lib_name, fun_name, res_type, arg_types, optional = False):
    import ctypes, ctypes.util, os, sys
    if lib_name not in _libraries:
       is_win = sys.platform.startswith('win')
@@ -22,9 +22,11 @@ def _load(lib_name, fun_name, res_type, arg_types):
    fun = None
    lib = _libraries[lib_name]
    if lib is not None:
-      fun = getattr(lib, fun_name)
-      fun.argtypes = arg_types
-      fun.restype = res_type
+      # Optional functions are set to None if they cannot be found, required ones fail to load.
+      fun = getattr(lib, fun_name, None) if optional else getattr(lib, fun_name)
+      if fun is not None:
+         fun.argtypes = arg_types
+         fun.restype = res_type
    globals()[fun_name] = fun
 
 #===============================================================================
@@ -146,20 +148,22 @@ class SDL_Event(Union):
       ('wheel',   SDL_MouseWheelEvent),
       ('padding', c_ubyte * 56)]
 
-_load('SDL2', 'SDL_CreateRGBSurface', POINTER(SDL_Surface), [c_uint, c_int, c_int, c_int, c_uint, c_uint, c_uint, c_uint])
-_load('SDL2', 'SDL_CreateWindow',     c_void_p, [c_char_p, c_int, c_int, c_int, c_int, c_uint])
-_load('SDL2', 'SDL_GL_CreateContext', c_void_p, [c_void_p])
-_load('SDL2', 'SDL_GL_DeleteContext', None,     [c_void_p])
-_load('SDL2', 'SDL_GL_SwapWindow',    None,     [c_void_p])
-_load('SDL2', 'SDL_DestroyWindow',    None,     [c_void_p])
-_load('SDL2', 'SDL_FreeSurface',      None,     [POINTER(SDL_Surface)])
-_load('SDL2', 'SDL_Init',             c_int,    [c_uint])
-_load('SDL2', 'SDL_PollEvent',        c_int,    [POINTER(SDL_Event)])
-_load('SDL2', 'SDL_Quit',             None,     [])
-_load('SDL2', 'SDL_RaiseWindow',      None,     [c_void_p])
-_load('SDL2', 'SDL_SetWindowIcon',    None,     [c_void_p, POINTER(SDL_Surface)])
-_load('SDL2', 'SDL_UpperBlit',        c_int,    [POINTER(SDL_Surface), POINTER(SDL_Rect), POINTER(SDL_Surface), POINTER(SDL_Rect)])
-_load('SDL2', 'SDL_WaitEvent',        c_int,    [POINTER(SDL_Event)])
+_load('SDL2', 'SDL_CreateRGBSurface',   POINTER(SDL_Surface), [c_uint, c_int, c_int, c_int, c_uint, c_uint, c_uint, c_uint])
+_load('SDL2', 'SDL_CreateWindow',       c_void_p, [c_char_p, c_int, c_int, c_int, c_int, c_uint])
+_load('SDL2', 'SDL_GL_CreateContext',   c_void_p, [c_void_p])
+_load('SDL2', 'SDL_GL_DeleteContext',   None,     [c_void_p])
+_load('SDL2', 'SDL_GL_SetSwapInterval', c_int,    [c_int])
+_load('SDL2', 'SDL_GL_SwapWindow',      None,     [c_void_p])
+_load('SDL2', 'SDL_DestroyWindow',      None,     [c_void_p])
+_load('SDL2', 'SDL_FreeSurface',        None,     [POINTER(SDL_Surface)])
+_load('SDL2', 'SDL_Init',               c_int,    [c_uint])
+_load('SDL2', 'SDL_PollEvent',          c_int,    [POINTER(SDL_Event)])
+_load('SDL2', 'SDL_Quit',               None,     [])
+_load('SDL2', 'SDL_RaiseWindow',        None,     [c_void_p])
+_load('SDL2', 'SDL_SetWindowIcon',      None,     [c_void_p, POINTER(SDL_Surface)])
+_load('SDL2', 'SDL_UpperBlit',          c_int,    [POINTER(SDL_Surface), POINTER(SDL_Rect), POINTER(SDL_Surface), POINTER(SDL_Rect)])
+_load('SDL2', 'SDL_WaitEvent',          c_int,    [POINTER(SDL_Event)])
+_load('SDL2', 'SDL_WaitEventTimeout',   c_int,    [POINTER(SDL_Event), c_int])
 
 _load('SDL2_image', 'IMG_Init', c_int,                [c_int])
 _load('SDL2_image', 'IMG_Load', POINTER(SDL_Surface), [c_char_p])
@@ -232,15 +236,29 @@ _load('GL', 'glGenTextures',    None, [c_int, POINTER(c_uint)])
 _load('GL', 'glLoadIdentity',   None, [])
 _load('GL', 'glMatrixMode',     None, [c_int])
 _load('GL', 'glOrtho',          None, [c_double, c_double, c_double, c_double, c_double, c_double])
+_load('GL', 'glScaled',         None, [c_double, c_double, c_double])
 _load('GL', 'glTexCoord2d',     None, [c_double, c_double])
 _load('GL', 'glTexEnvi',        None, [c_int, c_int, c_int])
 _load('GL', 'glTexImage2D',     None, [c_int, c_int, c_int, c_int, c_int, c_int, c_int, c_int, c_void_p])
 _load('GL', 'glTexParameteri',  None, [c_int, c_int, c_int])
+_load('GL', 'glTranslated',     None, [c_double, c_double, c_double])
 _load('GL', 'glVertex2d',       None, [c_double, c_double])
 _load('GL', 'glViewport',       None, [c_int, c_int, c_int, c_int])
 
+# Vertex arrays, available since OpenGL 1.1. Functions which cannot be found are set to None,
+# in which case the editor falls back to immediate mode.
+_load('GL', 'glColorPointer',       None, [c_int, c_int, c_int, c_void_p], True)
+_load('GL', 'glDisableClientState', None, [c_int], True)
+_load('GL', 'glDrawArrays',         None, [c_int, c_int, c_int], True)
+_load('GL', 'glDrawElements',       None, [c_int, c_int, c_int, c_void_p], True)
+_load('GL', 'glEnableClientState',  None, [c_int], True)
+_load('GL', 'glTexCoordPointer',    None, [c_int, c_int, c_int, c_void_p], True)
+_load('GL', 'glVertexPointer',      None, [c_int, c_int, c_int, c_void_p], True)
+
 GL_BLEND               = 0x0BE2
+GL_COLOR_ARRAY         = 0x8076
 GL_COLOR_BUFFER_BIT    = 0x4000
+GL_DOUBLE              = 0x140A
 GL_LINE_LOOP           = 0x0002
 GL_LINES               = 0x0001
 GL_LINEAR              = 0x2601
@@ -257,6 +275,7 @@ GL_RGBA                = 0x1908
 GL_RGBA8               = 0x8058
 GL_SRC_ALPHA           = 0x0302
 GL_TEXTURE_2D          = 0x0DE1
+GL_TEXTURE_COORD_ARRAY = 0x8078
 GL_TEXTURE_ENV         = 0x2300
 GL_TEXTURE_ENV_MODE    = 0x2200
 GL_TEXTURE_MAG_FILTER  = 0x2800
@@ -265,4 +284,6 @@ GL_TEXTURE_WRAP_S      = 0x2802
 GL_TEXTURE_WRAP_T      = 0x2803
 GL_TRIANGLES           = 0x0004
 GL_UNSIGNED_BYTE       = 0x1401
+GL_UNSIGNED_INT        = 0x1405
+GL_VERTEX_ARRAY        = 0x8074
 GL_ZERO                = 0x0000
@@ -1,103 +1,227 @@
 
-def _get_bbox(vertices):
-   left   = min(vertices, key = lambda v: v[0])[0]
-   right  = max(vertices, key = lambda v: v[0])[0]
-   bottom = min(vertices, key = lambda v: v[1])[1]
-   top    = max(vertices, key = lambda v: v[1])[1]
-   return (left, right, bottom, top)
-
-def _get_bbox_union(bboxes):
-   left   = min(bboxes, key = lambda b: b[0])[0]
-   right  = max(bboxes, key = lambda b: b[1])[1]
-   bottom = min(bboxes, key = lambda b: b[2])[2]
-   top    = max(bboxes, key = lambda b: b[3])[3]
-   return (left, right, bottom, top)
-
-def _get_bbox_intersection(bbox1, bbox2):
-   left   = max(bbox1[0], bbox2[0])
-   right  = min(bbox1[1], bbox2[1])
-   bottom = max(bbox1[2], bbox2[2])
-   top    = min(bbox1[3], bbox2[3])
-   if (left < right) and (bottom < top):
-      return (left, right, bottom, top)
-   else:
-      return (0, 0, 0, 0)
+import itertools
+import numpy as np
+
+BTREE_SPLITS    = ('sah', 'median')
+BTREE_LAYOUTS   = ('nested', 'flat')
+BTREE_SAH_DEPTH = 48
+
+#===============================================================================
+# Binary tree of bounding boxes. Leaves are sorted by centers of their bounding
+# boxes along both axes, and the tree is built one level at a time, dividing all
+# the nodes of a level at once. Each node is a segment of both sorted orders, so
+# bounding boxes of all possible divisions of a node are found by sweeping over
+# its leaves from both ends, for all the segments at once.
+#
+# A node is divided where the surface area heuristic is the lowest, which is
+# the number of leaves on each side weighted by the perimeter of their bounding
+# box (the 2D equivalent of surface area). The median division, selecting the
+# one with the smallest intersection of the two halves, is kept as an option.
+# Nodes deeper than BTREE_SAH_DEPTH are always divided at the median, so that
+# the depth of the tree stays bounded.
+#===============================================================================
+
+def _get_bboxes(groups, vertices):
+   # Returns bounding boxes of the groups of vertices as (left, right, bottom, top) tuples.
+   lengths = np.fromiter((len(group) for group in groups), dtype = np.intp, count = len(groups))
+   if len(lengths) == 0:
+      return []
+   indices = np.fromiter(itertools.chain.from_iterable(groups), dtype = np.intp, count = int(lengths.sum()))
+   coords = np.asarray(vertices, dtype = np.float64).reshape((-1, 2))[indices]
+   starts = np.cumsum(lengths) - lengths
+   return list(zip(
+      np.minimum.reduceat(coords[:,0], starts).tolist(),
+      np.maximum.reduceat(coords[:,0], starts).tolist(),
+      np.minimum.reduceat(coords[:,1], starts).tolist(),
+      np.maximum.reduceat(coords[:,1], starts).tolist()))
+
+def _get_segment_bboxes(bboxes, starts):
+   # Returns bounding boxes of consecutive segments of leaves, each one from the given start to the next one.
+   return np.stack((
+      np.minimum.reduceat(bboxes[0], starts),
+      np.maximum.reduceat(bboxes[1], starts),
+      np.minimum.reduceat(bboxes[2], starts),
+      np.maximum.reduceat(bboxes[3], starts)))
+
+def _sweep_bboxes(bboxes, offsets, reverse):
+   # Bounding boxes of the leaves swept so far within each segment, from the start or from the end of segments.
+   # Coordinates of each segment are offset below or above those of the previous segments, so that a single
+   # running minimum or maximum restarts at each segment. This makes the boxes inexact by a few ulps of the
+   # offset, which is fine for comparing costs.
+   if reverse:
+      bboxes = bboxes[:,::-1]
+      offsets = offsets[-1] - offsets[::-1]
+   bbox = [
+      np.minimum.accumulate(bboxes[0] - offsets) + offsets,
+      np.maximum.accumulate(bboxes[1] + offsets) - offsets,
+      np.minimum.accumulate(bboxes[2] - offsets) + offsets,
+      np.maximum.accumulate(bboxes[3] + offsets) - offsets]
+   return [b[::-1] for b in bbox] if reverse else bbox
 
-def _get_bbox_area(bbox):
-   left, right, bottom, top = bbox
-   return ((right - left) * (top - bottom))
+def _determine_sah_divisions(bboxes, offsets, starts, seg, nleaves, nbefore):
+   # Returns the lowest cost of dividing each segment, and the number of leaves before the division.
+   # Division after a leaf puts this leaf and the previous ones before it, the following ones after it.
+   left1, right1, bottom1, top1 = [b[:-1] for b in _sweep_bboxes(bboxes, offsets, False)]
+   left2, right2, bottom2, top2 = [b[1:]  for b in _sweep_bboxes(bboxes, offsets, True)]
+   nleaves = nleaves[:-1]
+   nbefore = nbefore[:-1]
+   cost = ((right1 - left1) + (top1 - bottom1)) * nbefore + ((right2 - left2) + (top2 - bottom2)) * (nleaves - nbefore)
+   cost[nbefore == nleaves] = np.inf
+   cost = np.append(cost, np.inf)
+   best = np.minimum.reduceat(cost, starts)
+   index = np.minimum.reduceat(np.where(cost == best[seg], np.arange(len(cost)), len(cost)), starts)
+   return (best, index - starts + 1)
 
-def _determine_division_axis_and_index(leaves_sorted):
-   best_area  = None
-   best_axis  = None
+def _determine_median_divisions(bboxes, starts, sizes):
+   # Returns the smallest intersection of the two halves of each segment, and the number of leaves
+   # before the division. For odd number of leaves, tries both groups having one leaf more.
+   best_area = None
    best_index = None
-   # Try both axes. For odd number of leaves, try both groups having one leaf more.
-   # Select the division in which the intersection of two groups is the smallest.
-   for axis in (0, 1):
-      i1 = (len(leaves_sorted[axis]))   // 2
-      i2 = (len(leaves_sorted[axis])+1) // 2
-      for index in (i1,i2) if (i1 != i2) else (i1,):
-         bbox1 = _get_bbox_union([leaf['bbox'] for leaf in leaves_sorted[axis][:index]])
-         bbox2 = _get_bbox_union([leaf['bbox'] for leaf in leaves_sorted[axis][index:]])
-         area = _get_bbox_area(_get_bbox_intersection(bbox1, bbox2))
-         if (best_area is None) or (best_area > area):
-            best_area = area
-            best_axis = axis
-            best_index = index
-   return (best_axis, best_index)
-
-def _create_btree_node(leaves_sorted):
-   leaves = leaves_sorted[0]
-   if len(leaves) > 1:
-      axis, index = _determine_division_axis_and_index(leaves_sorted)
-      l1 = [None, None]
-      l2 = [None, None]
-      # Divide leaves into two groups as per the determined axis and index.
-      l1[axis] = leaves_sorted[axis][:index]
-      l2[axis] = leaves_sorted[axis][index:]
-      # For sort order based on the other axis, add special attribute to quickly
-      # filter out the redundant leaves. Remove the attribute immediately after.
-      for leaf in l1[axis]:
-         leaf['[1]'] = True
-      l1[axis^1] = [leaf for leaf in leaves_sorted[axis^1] if ('[1]' in leaf)]
-      l2[axis^1] = [leaf for leaf in leaves_sorted[axis^1] if ('[1]' not in leaf)]
-      for leaf in l1[axis]:
-         del leaf['[1]']
-      # Create a branch node with two children.
-      return {
-         'bbox': _get_bbox_union([leaf['bbox'] for leaf in leaves]),
+   for index in (sizes // 2, (sizes + 1) // 2):
+      halves = _get_segment_bboxes(bboxes, np.stack((starts, starts + index), axis = 1).reshape(-1))
+      bbox1 = halves[:,0::2]
+      bbox2 = halves[:,1::2]
+      width  = np.maximum(np.minimum(bbox1[1], bbox2[1]) - np.maximum(bbox1[0], bbox2[0]), 0)
+      height = np.maximum(np.minimum(bbox1[3], bbox2[3]) - np.maximum(bbox1[2], bbox2[2]), 0)
+      area = width * height
+      if best_area is None:
+         best_area, best_index = area, index
+      else:
+         better = area < best_area
+         best_area = np.where(better, area, best_area)
+         best_index = np.where(better, index, best_index)
+   return (best_area, best_index)
+
+def _divide_segments(order, marked, starts, seg, pos, nbefore):
+   # Moves the marked leaves to the start of each segment, keeping the order of leaves on both sides.
+   counts = np.cumsum(marked) - marked
+   nmarked = counts - counts[starts][seg]
+   new_order = np.empty_like(order)
+   new_order[starts[seg] + np.where(marked, nmarked, nbefore[seg] + pos - nmarked)] = order
+   return new_order
+
+def create_btree(leaves, split = 'sah'):
+   if len(leaves) == 0:
+      return None
+   # Bounding boxes are stored by coordinate, one row of left, right, bottom and top for all leaves.
+   bboxes = np.ascontiguousarray(np.array([leaf['bbox'] for leaf in leaves], dtype = np.float64).reshape((-1, 4)).T)
+   # Offset between segments, larger than the extent of all the leaves.
+   offset = 2.0 * (bboxes.max() - bboxes.min()) + 1.0
+   orders = [
+      np.argsort((bboxes[0] + bboxes[1]) / 2.0, kind = 'stable'), # (left+right)/2
+      np.argsort((bboxes[2] + bboxes[3]) / 2.0, kind = 'stable')] # (bottom+top)/2
+   sizes = np.array([len(leaves)])
+   levels = []
+   while len(sizes) > 0:
+      starts = np.cumsum(sizes) - sizes
+      level = (sizes, orders[0][starts])
+      # Only segments with more than one leaf are divided further.
+      divided = sizes > 1
+      orders = [order[np.repeat(divided, sizes)] for order in orders]
+      sizes = sizes[divided]
+      if len(sizes) == 0:
+         levels.append(level + ([],))
+         break
+      starts = np.cumsum(sizes) - sizes
+      seg = np.repeat(np.arange(len(sizes)), sizes)
+      pos = np.arange(len(seg)) - starts[seg]
+      sorted_bboxes = [np.take(bboxes, order, axis = 1) for order in orders]
+      levels.append(level + (list(zip(*[b.tolist() for b in _get_segment_bboxes(sorted_bboxes[0], starts)])),))
+      if (split == 'median') or (len(levels) > BTREE_SAH_DEPTH):
+         cost_x, nbefore_x = _determine_median_divisions(sorted_bboxes[0], starts, sizes)
+         cost_y, nbefore_y = _determine_median_divisions(sorted_bboxes[1], starts, sizes)
+      else:
+         args = (seg * offset, starts, seg, sizes[seg], pos + 1)
+         cost_x, nbefore_x = _determine_sah_divisions(sorted_bboxes[0], *args)
+         cost_y, nbefore_y = _determine_sah_divisions(sorted_bboxes[1], *args)
+      # Division along X axis is preferred, if the costs are the same. Leaves before the division are
+      # marked in the order of the selected axis, and moved to the start of segments in both orders.
+      axis_y = cost_y < cost_x
+      nbefore = np.where(axis_y, nbefore_y, nbefore_x)
+      marked = np.zeros(len(leaves), dtype = bool)
+      marked[orders[0][~axis_y[seg] & (pos < nbefore[seg])]] = True
+      marked[orders[1][ axis_y[seg] & (pos < nbefore[seg])]] = True
+      orders = [_divide_segments(order, marked[order], starts, seg, pos, nbefore) for order in orders]
+      sizes = np.stack((nbefore, sizes - nbefore), axis = 1).reshape(-1)
+   # Nodes are created from the deepest level up, each branch taking the next two nodes of the level below.
+   nodes = []
+   for sizes, first, bboxes in reversed(levels):
+      branches = iter([{
+         'bbox': bbox,
          'kind': 'branch',
-         'sub1': _create_btree_node(l1),
-         'sub2': _create_btree_node(l2)}
-   else:
-      return leaves[0]
+         'sub1': sub1,
+         'sub2': sub2} for (bbox, sub1, sub2) in zip(bboxes, nodes[0::2], nodes[1::2])])
+      nodes = [next(branches) if (size > 1) else leaves[leaf_ix] for (size, leaf_ix) in zip(sizes.tolist(), first.tolist())]
+   return nodes[0]
 
 def create_btree_leaves_from_polygons(polygons, vertices):
    return [{
-      'bbox': _get_bbox([vertices[i] for i in poly]),
+      'bbox': bbox,
       'kind': 'polygon',
       'order': poly_ix,
       'value': tuple(poly)
-      } for (poly_ix, poly) in enumerate(polygons)]
+      } for (poly_ix, (poly, bbox)) in enumerate(zip(polygons, _get_bboxes(polygons, vertices)))]
 
 def create_btree_leaves_from_entities(entities, vertices):
    return [{
-      'bbox': _get_bbox([vertices[i] for i in ent[2:]]),
+      'bbox': bbox,
       'kind': ent[0],
       'name': ent[1],
       'value': tuple(ent[2:]) if (len(ent) > 3) else ent[2]
-      } for ent in entities]
-
-def create_btree(leaves):
-   if len(leaves) > 0:
-      leaves_sorted = [leaves[:], leaves[:]]
-      leaves_sorted[0].sort(key = lambda leaf: (leaf['bbox'][0] + leaf['bbox'][1]) / 2.0) # (left+right)/2
-      leaves_sorted[1].sort(key = lambda leaf: (leaf['bbox'][2] + leaf['bbox'][3]) / 2.0) # (bottom+top)/2
-      return _create_btree_node(leaves_sorted)
-   else:
+      } for (ent, bbox) in zip(entities, _get_bboxes([ent[2:] for ent in entities], vertices))]
+
+#===============================================================================
+# Flat layout of the tree, as parallel arrays of nodes in depth-first order, so
+# that each subtree is a contiguous range of nodes, and the first child of a
+# branch is the node right after it:
+#
+#  bbox    (left, right, bottom, top) of each node, 4 numbers per node
+#  skip    index of the node following the subtree of each node, which is the
+#          second child of a branch, or where to continue if a node is missed
+#  first   index of the first primitive in the subtree of each node
+#  count   number of primitives in the subtree of each node, 1 for leaves
+#
+# Primitives are stored in the same order as leaves appear in the tree, so the
+# subtree of each node covers a contiguous range of them. Each field of leaves
+# is stored as an array with one item per primitive.
+#===============================================================================
+
+def flatten_btree(root, fields):
+   if root is None:
       return None
+   bboxes = []
+   skips  = []
+   firsts = []
+   counts = []
+   leaves = []
+
+   def traverse_tree(node):
+      node_ix = len(skips)
+      bboxes.extend(node['bbox'])
+      skips.append(None)
+      firsts.append(len(leaves))
+      counts.append(None)
+      if node['kind'] == 'branch':
+         traverse_tree(node['sub1'])
+         traverse_tree(node['sub2'])
+      else:
+         leaves.append(node)
+      skips[node_ix] = len(skips)
+      counts[node_ix] = len(leaves) - firsts[node_ix]
+
+   traverse_tree(root)
+   flat = {
+      'bbox':  tuple(bboxes),
+      'skip':  tuple(skips),
+      'first': tuple(firsts),
+      'count': tuple(counts)}
+   for field in fields:
+      flat[field] = [leaf[field] for leaf in leaves]
+   return flat
 
 def get_polygons_from_btree(root):
+   if 'skip' in root:
+      return [list(value) for (order, value) in sorted(zip(root['order'], root['value']))]
    polygons = []
 
    def traverse_tree(node):
@@ -127,5 +251,8 @@ def get_entities_from_btree(root):
       except TypeError:
          return [ent['kind'], ent['name'], ent['value']]
 
-   traverse_tree(root)
+   if 'skip' in root:
+      entities = [{'kind': kind, 'name': name, 'value': value} for (kind, name, value) in zip(root['kind'], root['name'], root['value'])]
+   else:
+      traverse_tree(root)
    return [get_entity(ent) for ent in entities]
@@ -82,13 +82,13 @@ Quit the editor.
 Create a new model.
 
 `open <file_path>`
-Open model.
+Open model. Files with the .m2d extension are in binary format.
 
-`save <file_path>`
-Save model.
+`save <file_path> (<float64|float32>)`
+Save model. Files with the .m2d extension are in binary format, with numbers stored as float64 (default) or float32, which halves the size of the file, but makes loading slower.
 
-`btree <file_path>`
-Export model to binary tree format.
+`btree <file_path> (<sah|median>) (<nested|flat>)`
+Export model to binary tree format. Nodes are divided where the surface area heuristic is the lowest (default), or at the median. The tree is written as nested objects (default), or as flat arrays of nodes in depth-first order.
 
 `image <file_path>`
 Load image.
@@ -122,6 +122,12 @@ Select the specified frame for edit.
 
 `copyfrom <frame_num> (<animation_name>)`
 Copy positions of the selected vertices from the specified frame to the current frame.
+
+`interp <linear|spline>`
+Select interpolation between frames in play mode. Spline interpolation moves vertices along smooth curves through their positions in consecutive frames.
+
+`json <indented|compact> (<precision>)`
+Select formatting of saved and exported JSON files, either indented (default) or compact without any whitespace. Numbers are rounded to the specified number of decimal places, or written exactly if none is specified.
 '''
 
 MODEL_INFO_TEMPLATE = '''
@@ -138,9 +144,10 @@ Circles: {circles}
 '''
 
 INIT_WINDOW_SIZE = (800, 600)
-INIT_COLOR       = (1.0, 1.0, 1.0, 1.0)
 INIT_BG_COLOR    = (0.5, 0.5, 0.5, 1.0)
 INIT_FPS         = 1.0
+INIT_INTERP      = 'linear'
+INIT_JSON_INDENT = 1
 
 TEXT_COLOR   = (1.0, 1.0, 1.0, 1.0)
 ENTITY_COLOR = (1.0, 0.25, 0.0, 1.0)
@@ -151,15 +158,13 @@ POINT_RADIUS  = 5
 POINT_NVERTS  = 8
 CIRCLE_NVERTS = 32
 SELECT_DIST   = 10
-UNDO_LEVELS   = 10
+TEXT_MESHES   = 256
+PLAY_MAX_FPS  = 60
+PROGRESS_SECS = 0.1
 
 MODE_INSERT   = 'INSERT mode'
 MODE_EDIT     = 'EDIT mode'
 MODE_PLAY     = 'PLAY mode'
-ENTITY_POINT  = 'point'
-ENTITY_EDGE   = 'edge'
-ENTITY_RECT   = 'rectangle'
-ENTITY_CIRCLE = 'circle'
 KEY_CTRL      = 'CTRL'
 KEY_SHIFT     = 'SHIFT'
 CMD_PREFIX    = '>>> '
@@ -169,7 +174,9 @@ VMODE_OUTLINE = 0x2
 VMODE_TEXTURE = 0x4
 VMODE_TEX_OUT = (VMODE_TEXTURE | VMODE_OUTLINE)
 
-import copy, json, math, os, re, sys, time, traceback
+import itertools, math, os, re, sys, time, traceback
+from collections import OrderedDict
+import numpy as np
 
 try:
    import tkinter              as tk
@@ -191,6 +198,9 @@ except AttributeError:
 
 from src.bindings import *
 from src.btree import *
+from src.frames import *
+from src.model import *
+from src.spatial import *
 
 #===============================================================================
 
@@ -222,23 +232,6 @@ def show_message(title, message):
    text.config(state = tk.DISABLED)
    top.wait_window()
 
-def stringify_tuples(obj):
-   if isinstance(obj, tuple):
-      return repr(obj)
-   elif isinstance(obj, dict):
-      return {key: stringify_tuples(val) for key, val in obj.items()}
-   elif isinstance(obj, list):
-      return [stringify_tuples(val) for val in obj]
-   else:
-      return obj
-
-def dump_json(obj):
-   obj = stringify_tuples(obj)
-   s = json.dumps(obj, indent = 1, separators = (',', ': '), sort_keys = True)
-   s = s.replace('"(', '[')
-   s = s.replace(')"', ']')
-   return s
-
 def get_typed_char(char, shift, capslock):
    s1 = r"`1234567890-=[]\;',./"
    s2 = r'~!@#$%^&*()_+{}|:"<>?'
@@ -253,18 +246,6 @@ def get_typed_char(char, shift, capslock):
          char = s2[ix]
    return char
 
-def rotate_vertex(vertex, origin, angle):
-   sina = math.sin(angle)
-   cosa = math.cos(angle)
-   x, y = (vertex[0] - origin[0], vertex[1] - origin[1])
-   x, y = (x*cosa - y*sina, x*sina + y*cosa)
-   return (origin[0] + x, origin[1] + y)
-
-def scale_vertex(vertex, origin, factor):
-   x, y = (vertex[0] - origin[0], vertex[1] - origin[1])
-   x, y = (x*factor, y*factor)
-   return (origin[0] + x, origin[1] + y)
-
 def load_texture(path):
    colormask = {
       'big'   : (0xFF000000, 0x00FF0000, 0x0000FF00, 0x000000FF),
@@ -331,6 +312,50 @@ def draw_polygon(outline_color, vertices, colors, texcoords):
          glVertex2d(x,y)
       glEnd()
 
+def set_vertex_arrays(color, vertices, colors, texcoords):
+   # Arrays have to be contiguous, with 2 components per vertex and texcoord, and 4 per color.
+   glEnableClientState(GL_VERTEX_ARRAY)
+   glVertexPointer(2, GL_DOUBLE, 0, vertices.ctypes.data)
+   if colors is None:
+      glColor4d(*color)
+   else:
+      glEnableClientState(GL_COLOR_ARRAY)
+      glColorPointer(4, GL_DOUBLE, 0, colors.ctypes.data)
+   if texcoords is not None:
+      glEnableClientState(GL_TEXTURE_COORD_ARRAY)
+      glTexCoordPointer(2, GL_DOUBLE, 0, texcoords.ctypes.data)
+
+def unset_vertex_arrays():
+   glDisableClientState(GL_TEXTURE_COORD_ARRAY)
+   glDisableClientState(GL_COLOR_ARRAY)
+   glDisableClientState(GL_VERTEX_ARRAY)
+
+def draw_arrays(mode, color, vertices, colors, texcoords):
+   set_vertex_arrays(color, vertices, colors, texcoords)
+   glDrawArrays(mode, 0, len(vertices))
+   unset_vertex_arrays()
+
+def draw_elements(mode, color, vertices, colors, texcoords, indices):
+   set_vertex_arrays(color, vertices, colors, texcoords)
+   glDrawElements(mode, len(indices), GL_UNSIGNED_INT, indices.ctypes.data)
+   unset_vertex_arrays()
+
+def get_polygon_edges(triangles, triangle_counts):
+   # Edges of the triangles of each polygon, with those shared by two triangles of the same polygon
+   # listed only once. Returns the edges in polygon order, and their number per polygon.
+   edges = triangles.reshape((-1, 3))[:, (0, 1, 1, 2, 2, 0)].reshape((-1, 2))
+   polygon_ids = np.repeat(np.arange(len(triangle_counts)), triangle_counts * 3)
+   lo = edges.min(axis = 1)
+   hi = edges.max(axis = 1)
+   order = np.lexsort((hi, lo, polygon_ids)) # Stable, so the first occurrence of an edge comes first.
+   first = np.ones(len(order), dtype = bool)
+   first[1:] = (np.diff(polygon_ids[order]) != 0) | (np.diff(lo[order]) != 0) | (np.diff(hi[order]) != 0)
+   unique = np.sort(order[first])
+   return (edges[unique], np.bincount(polygon_ids[unique], minlength = len(triangle_counts)))
+
+def vertex_arrays_supported():
+   return None not in (glColorPointer, glDisableClientState, glDrawArrays, glDrawElements, glEnableClientState, glTexCoordPointer, glVertexPointer)
+
 def draw_rect(color, outline_color, x1, y1, x2, y2):
 
    def put_vertices():
@@ -382,6 +407,25 @@ def draw_circle(color, x, y, radius, num_vertices):
 def draw_point_circle(color, x, y):
    draw_circle(color, x, y, POINT_RADIUS, POINT_NVERTS)
 
+def create_marker_template(corners):
+   # Outline of a marker around (0,0) as pairs of line vertices, so that many markers can be drawn
+   # with a single call.
+   corners = create_frame(corners)
+   return np.stack((corners, np.roll(corners, -1, axis = 0)), axis = 1).reshape((-1, 2))
+
+def create_circle_marker_template(radius, num_vertices):
+   # Same vertices as drawn by draw_circle.
+   angles = np.arange(num_vertices) * ((2.0 * math.pi) / num_vertices)
+   return create_marker_template(np.stack((radius * np.sin(angles), -radius * np.cos(angles)), axis = 1))
+
+CIRCLE_MARKER = create_circle_marker_template(POINT_RADIUS, POINT_NVERTS)
+SQUARE_MARKER = create_marker_template(((-POINT_RADIUS, -POINT_RADIUS), (-POINT_RADIUS, POINT_RADIUS), (POINT_RADIUS, POINT_RADIUS), (POINT_RADIUS, -POINT_RADIUS)))
+
+def draw_markers(color, template, points):
+   if len(points) > 0:
+      vertices = (points[:,None,:] + template).reshape((-1, 2))
+      draw_arrays(GL_LINES, color, vertices, None, None)
+
 def draw_text(color, x, y, char_width, char_height, string):
    glColor4d(*color)
    glBegin(GL_QUADS)
@@ -410,6 +454,53 @@ def draw_text(color, x, y, char_width, char_height, string):
          x = x_
    glEnd()
 
+def create_text_mesh(char_width, char_height, string):
+   # Same quads as drawn by draw_text, relative to the position of the text.
+   vertices = []
+   texcoords = []
+   x, y = 0, 0
+   for c in string:
+      i = ord(c)
+      if 32 <= i < 128:
+         u = ((i - 32) % 16) / 16.0
+         v = ((i - 32) // 16) / 6.0
+         u_ = u + (1.0 / 16.0)
+         v_ = v + (1.0 / 6.0)
+         x_ = x + char_width
+         y_ = y + char_height
+         texcoords += [(u, v), (u, v_), (u_, v_), (u_, v)]
+         vertices += [(x, y), (x, y_), (x_, y_), (x_, y)]
+         x = x_
+      elif c == '\n':
+         x = 0
+         y += char_height
+   return (create_frame(vertices), create_frame(texcoords))
+
+def draw_text_meshes(color, meshes):
+   # Meshes are (x, y, mesh) tuples, drawn with a single call.
+   vertices = np.concatenate([mesh[0] + (x, y) for x, y, mesh in meshes])
+   texcoords = np.concatenate([mesh[1] for x, y, mesh in meshes])
+   if len(vertices) > 0:
+      draw_arrays(GL_QUADS, color, vertices, None, texcoords)
+
+#===============================================================================
+
+class TextMeshCache:
+
+   def __init__(self, maxlen):
+      self.maxlen = maxlen
+      self.meshes = OrderedDict()
+
+   def get(self, char_width, char_height, string):
+      key = (string, char_width, char_height)
+      mesh = self.meshes.pop(key, None)
+      if mesh is None:
+         mesh = create_text_mesh(char_width, char_height, string)
+         if len(self.meshes) >= self.maxlen:
+            self.meshes.popitem(last = False)
+      self.meshes[key] = mesh
+      return mesh
+
 #===============================================================================
 
 class CommandHistory:
@@ -435,56 +526,83 @@ class CommandHistory:
       return self.data[self.ix]
 
 #===============================================================================
+# Arrays for batched rendering, kept until the model changes. Polygons and
+# entities are also put in bounding volume hierarchies, which are refitted
+# after vertices move, so that only the visible ones need to be drawn.
+#===============================================================================
 
-class SnapshotHistory:
-
-   def __init__(self, maxlen):
-      self.maxlen = maxlen
-      self.reset()
-
-   def add(self, snapshot):
-      self.history.append(snapshot)
-      self.now_and_future = []
-      if len(self.history) > self.maxlen:
-         self.history = self.history[1:]
-
-   def getprev(self, save_snapshot_fun):
-      snapshot = None
-      if self.history:
-         snapshot = self.history[-1]
-         if self.now_and_future:
-            self.now_and_future = [snapshot] + self.now_and_future
-         else:
-            self.now_and_future = [snapshot, save_snapshot_fun()]
-         self.history = self.history[:-1]
-      return snapshot
-
-   def getnext(self):
-      snapshot = None
-      if self.now_and_future:
-         snapshot = self.now_and_future[1]
-         self.history.append(self.now_and_future[0])
-         if len(self.now_and_future) > 2:
-            self.now_and_future = self.now_and_future[1:]
-         else:
-            self.now_and_future = []
-      return snapshot
-
-   def reset(self):
-      self.history = []
-      self.now_and_future = []
+class RenderGeometry:
+
+   def __init__(self, polygons, entities, colors, texcoords):
+      polygons = [poly[:len(poly) - (len(poly) % 3)] for poly in polygons if (poly and len(poly) >= 3)]
+      self.poly_lengths = np.fromiter(map(len, polygons), dtype = np.intp, count = len(polygons))
+      self.poly_starts = np.cumsum(self.poly_lengths) - self.poly_lengths
+      self.triangles = np.fromiter(itertools.chain.from_iterable(polygons), dtype = np.uint32, count = int(self.poly_lengths.sum()))
+      self.edges, self.edge_lengths = get_polygon_edges(self.triangles, self.poly_lengths // 3)
+      self.edge_starts = np.cumsum(self.edge_lengths) - self.edge_lengths
+      self.colors = np.array(colors, dtype = np.float64).reshape((-1, 4))
+      self.texcoords = np.array(texcoords, dtype = np.float64).reshape((-1, 2))
+      # Points and incomplete entities have only one vertex, which is then used twice.
+      self.entities = [ent for ent in entities if (ent and len(ent) >= 3)]
+      self.entity_vertices = np.array([(ent[2], ent[min(len(ent), 4) - 1]) for ent in self.entities], dtype = np.intp).reshape((-1, 2))
+      self.entity_circles = np.array([(ent[0] == ENTITY_CIRCLE) for ent in self.entities], dtype = bool)
+      self.polygon_tree = None
+      self.entity_tree = None
+      self.vertices = None
+
+   def update(self, vertices, indices):
+      if (vertices is self.vertices) and (len(indices) > 0):
+         self.vertices = None # Trees get refitted when queried next time.
+
+   def fit(self, vertices):
+      if vertices is self.vertices:
+         return
+      self.vertices = vertices
+      if len(self.poly_starts) > 0:
+         points = vertices[self.triangles]
+         poly_mins = np.minimum.reduceat(points, self.poly_starts, axis = 0)
+         poly_maxs = np.maximum.reduceat(points, self.poly_starts, axis = 0)
+      else:
+         poly_mins = poly_maxs = np.zeros((0, 2))
+      first = vertices[self.entity_vertices[:,0]]
+      second = vertices[self.entity_vertices[:,1]]
+      radius = np.sqrt(((second - first) ** 2).sum(axis = 1))[:,None]
+      circles = self.entity_circles[:,None]
+      ent_mins = np.where(circles, first - radius, np.minimum(first, second))
+      ent_maxs = np.where(circles, first + radius, np.maximum(first, second))
+      if self.polygon_tree is None:
+         self.polygon_tree = BoxTree()
+         self.polygon_tree.rebuild(poly_mins, poly_maxs)
+         self.entity_tree = BoxTree()
+         self.entity_tree.rebuild(ent_mins, ent_maxs)
+      else:
+         self.polygon_tree.refit(poly_mins, poly_maxs)
+         self.entity_tree.refit(ent_mins, ent_maxs)
+
+   def get_visible_triangles(self, vertices, rect):
+      self.fit(vertices)
+      visible = self.polygon_tree.find_overlapping(*rect)
+      if len(visible) == len(self.poly_starts):
+         return (self.triangles, self.edges.ravel())
+      triangles = gather_ranges(self.triangles, self.poly_starts[visible], self.poly_lengths[visible])
+      edges = gather_ranges(self.edges, self.edge_starts[visible], self.edge_lengths[visible])
+      return (triangles, edges.ravel())
+
+   def get_visible_entities(self, vertices, rect):
+      self.fit(vertices)
+      return [self.entities[ix] for ix in self.entity_tree.find_overlapping(*rect).tolist()]
 
 #===============================================================================
 
-class RecoverableError(Exception):
-   pass
-
 class Application:
 
    def __init__(self):
       self.tk = tk.Tk()
       self.tk.withdraw() # Make the main Tkinter window hidden.
-      self.reset_variables()
+      self.model = Model()
+      self.model_revision = self.model.revision
+      self.geometry = None
+      self.frame_player = None
       self.exit = False
       self.mode = MODE_INSERT
       self.viewmode = VMODE_COLOR
@@ -496,9 +614,15 @@ class Application:
       self.mouse_pos_click = None
       self.frame_time = 0
       self.play_fps = INIT_FPS
+      self.interp = INIT_INTERP
+      self.json_indent = INIT_JSON_INDENT
+      self.json_precision = None
+      self.loading_status = None
+      self.progress_time = 0
       self.keys_pressed = set()
       self.font_tex = None
       self.font_glyph_size = (10,10)
+      self.text_meshes = TextMeshCache(TEXT_MESHES)
       self.img_tex = None
       self.img_coords = None
       self.nearpoint_ix = -1
@@ -506,8 +630,8 @@ class Application:
       self.select_rect = False
       self.cmd_line = ''
       self.cmd_history = CommandHistory()
-      self.snapshot_history = SnapshotHistory(UNDO_LEVELS)
-      self.snapshot_saved = False
+      self.dragged_indices = None
+      self.redraw = True
 
    def run(self):
       self.image_formats_supported = IMG_Init(IMG_INIT_JPG | IMG_INIT_PNG | IMG_INIT_TIF)
@@ -518,26 +642,33 @@ class Application:
       SDL_SetWindowIcon(self.wnd, icon)
       SDL_FreeSurface(icon)
       self.ctx = SDL_GL_CreateContext(self.wnd)
+      SDL_GL_SetSwapInterval(1) # Vertical sync, if supported.
       self.font_tex = load_texture(os.path.join('gfx', 'font.tga'))
       if self.font_tex is not None:
          self.font_glyph_size = (self.font_tex[1] / 16.0, self.font_tex[2] / 6.0)
+      next_frame_time = 0
       while not self.exit:
-         if self.mode == MODE_PLAY:
-            self.interpolate_vertices()
-         self.render()
-         evt = SDL_Event()
-         try:
-            if self.mode != MODE_PLAY:
-               if SDL_WaitEvent(evt) > 0:
-                  self.evt_main(evt)
-            while SDL_PollEvent(evt) > 0:
+         # Window is redrawn only when something visible has changed, or when the next frame is due in play mode.
+         if self.mode == MODE_PLAY and get_time() >= next_frame_time:
+            next_frame_time = get_time() + (1.0 / PLAY_MAX_FPS)
+            if self.interpolate_vertices():
+               self.redraw = True
+         if self.redraw:
+            self.redraw = False
+            self.render()
+         # Animation with a single frame does not need any more frames played, until it changes.
+         timeout = None
+         if self.mode == MODE_PLAY and len(self.model.vertices_anim[self.model.anim_name]) > 1:
+            timeout = int(max(next_frame_time - get_time(), 0) * 1000)
+         for evt in self.wait_events(timeout):
+            try:
                self.evt_main(evt)
-         except RecoverableError as e:
-            tkmessagebox.showerror('Runtime Error', str(e))
-            self.back_from_other_window()
-         except:
-            tkmessagebox.showerror('Exception', traceback.format_exc())
-            self.back_from_other_window()
+            except RecoverableError as e:
+               tkmessagebox.showerror('Runtime Error', str(e))
+               self.back_from_other_window()
+            except:
+               tkmessagebox.showerror('Exception', traceback.format_exc())
+               self.back_from_other_window()
       free_texture(self.font_tex)
       free_texture(self.img_tex)
       SDL_GL_DeleteContext(self.ctx)
@@ -545,25 +676,50 @@ class Application:
       SDL_Quit()
       IMG_Quit()
 
+   def wait_events(self, timeout):
+      # Returns all pending events, waiting for the first one up to the timeout, or indefinitely.
+      # Consecutive mouse motion events with the same button state are merged into the last one,
+      # since the handlers compute the movement from positions. This way dragging is processed
+      # once per rendered frame, no matter how many events the mouse generates.
+      events = []
+      evt = SDL_Event()
+      received = SDL_WaitEvent(evt) if (timeout is None) else SDL_WaitEventTimeout(evt, timeout)
+      while received > 0:
+         prev = events[-1] if events else None
+         if (prev is not None) and (prev.type == evt.type == SDL_MOUSEMOTION) and (prev.motion.state == evt.motion.state):
+            events[-1] = evt
+         else:
+            events.append(evt)
+         evt = SDL_Event()
+         received = SDL_PollEvent(evt)
+      return events
+
    #============================================================================
    # Auxiliary functions.
    #============================================================================
 
+   def show_loading_progress(self, nread, size):
+      # Called while a model file is being loaded, to keep the window responsive. Escape cancels loading.
+      # Other events are dropped, except key releases, so that no key is left pressed afterwards.
+      if get_time() < self.progress_time:
+         return
+      self.progress_time = get_time() + PROGRESS_SECS
+      evt = SDL_Event()
+      while SDL_PollEvent(evt) > 0:
+         if evt.type == SDL_QUIT:
+            self.exit = True
+            raise RecoverableError('Loading cancelled')
+         elif (evt.type == SDL_KEYDOWN) and (evt.key.keysym.sym == SDLK_ESCAPE):
+            raise RecoverableError('Loading cancelled')
+         elif evt.type in (SDL_WINDOWEVENT, SDL_KEYUP):
+            self.evt_main(evt)
+      self.loading_status = 'Loading: {}%, press Escape to cancel'.format(100 * nread // max(size, 1))
+      self.render()
+
    def back_from_other_window(self):
       self.keys_pressed -= set((KEY_CTRL, KEY_SHIFT)) # New window can steal CTRL/SHIFT key release.
       SDL_RaiseWindow(self.wnd)
-
-   def reset_variables(self):
-      self.selected = []
-      self.selection_groups = [[] for ix in range(10)]
-      self.anim_name = ''
-      self.cur_frame = 0
-      self.entities = [None]
-      self.polygons = [None]
-      self.colors = []
-      self.texcoords = []
-      self.vertices_anim = {self.anim_name: [[]]}
-      self.vertices = self.vertices_anim[self.anim_name][self.cur_frame]
+      self.redraw = True
 
    def setup_view(self, x, y, width, height):
       scale = min(self.window_size[0] / width, self.window_size[1] / height)
@@ -573,141 +729,12 @@ class Application:
       self.origin = (org_x, org_y)
 
    def reset_view(self):
-      if len(self.vertices) > 0:
-         left   = min(self.vertices, key = lambda v: v[0])[0]
-         right  = max(self.vertices, key = lambda v: v[0])[0]
-         bottom = min(self.vertices, key = lambda v: v[1])[1]
-         top    = max(self.vertices, key = lambda v: v[1])[1]
+      if len(self.model.vertices) > 0:
+         left, right, bottom, top = get_frame_bbox(self.model.vertices)
          self.setup_view((left+right)/2, (bottom+top)/2, right-left, top-bottom)
       else:
          self.setup_view(0.0, 0.0, 2.0, 2.0)
 
-   def load_model(self, data):
-
-      def get_entity(ent):
-         try:
-            return [ent['kind'], ent['name']] + list(ent['value'])
-         except TypeError:
-            return [ent['kind'], ent['name'], ent['value']]
-
-      self.reset_variables()
-      if 'polygons' in data:
-         if isinstance(data['polygons'], dict):
-            self.polygons = get_polygons_from_btree(data['polygons']) + self.polygons
-         elif isinstance(data['polygons'], list):
-            self.polygons = [list(poly) for poly in data['polygons']] + self.polygons
-      if 'entities' in data:
-         if isinstance(data['entities'], dict):
-            self.entities = get_entities_from_btree(data['entities']) + self.entities
-         elif isinstance(data['entities'], list):
-            self.entities = [get_entity(ent) for ent in data['entities']] + self.entities
-      if '!entities' in data:
-         self.entities = [get_entity(ent) for ent in data['!entities']] + self.entities
-      if 'vertices' in data:
-         if isinstance(data['vertices'], dict):
-            self.vertices_anim = data['vertices']
-            for frames in self.vertices_anim.values():
-               for ix in range(len(frames)):
-                  frames[ix] = [tuple(v) for v in frames[ix]]
-            self.anim_name = sorted(self.vertices_anim.keys())[0]
-            self.vertices = self.vertices_anim[self.anim_name][self.cur_frame]
-         elif isinstance(data['vertices'], list):
-            self.vertices += [tuple(v) for v in data['vertices']]
-      if 'colors' in data:
-         self.colors = [tuple(c) for c in data['colors']]
-      else:
-         self.colors = [INIT_COLOR for v in self.vertices]
-      if 'texcoords' in data:
-         self.texcoords = [tuple(t) for t in data['texcoords']]
-      else:
-         self.texcoords = [(0,0) for v in self.vertices]
-
-   def get_complete_polygons(self):
-      return [poly for poly in self.polygons if (poly and len(poly)>=3)]
- 
-   def get_complete_entities(self):
-      return [ent for ent in self.entities if (ent and len(ent)>=3 and (ent[0]==ENTITY_POINT or len(ent)>=4))]
-
-   def save_entities(self, entities):
-      return [{
-         'kind': ent[0],
-         'name': ent[1],
-         'value': tuple(ent[2:]) if (len(ent) > 3) else ent[2]
-         } for ent in entities]
-
-   def save_cleanup(self, data):
-      if data['polygons'] is None or len(data['polygons']) == 0:
-         del data['polygons']
-      if data['entities'] is None or len(data['entities']) == 0:
-         del data['entities']
-      if '!entities' in data and len(data['!entities']) == 0:
-         del data['!entities']
-      if data['colors'].count(INIT_COLOR) == len(data['colors']):
-         del data['colors']
-      if data['texcoords'].count((0,0)) == len(data['texcoords']):
-         del data['texcoords']
-      if len(data['vertices']) == 0:
-         del data['vertices']
-      return data
-
-   def save_model(self):
-      return self.save_cleanup({
-         'polygons':  [tuple(poly) for poly in self.get_complete_polygons()],
-         'entities':  self.save_entities(self.get_complete_entities()),
-         'colors':    self.colors,
-         'texcoords': self.texcoords,
-         'vertices':  self.vertices_anim})
-
-   def export_btree(self):
-      # Entities with names starting with '!' are not put into the tree, but are kept in a flat array.
-      entities_all  = self.get_complete_entities()
-      entities_tree = [ent for ent in entities_all if not ent[1].startswith('!')]
-      entities_flat = [ent for ent in entities_all if     ent[1].startswith('!')]
-      return self.save_cleanup({
-         'polygons':  create_btree(create_btree_leaves_from_polygons(self.get_complete_polygons(), self.vertices)),
-         'entities':  create_btree(create_btree_leaves_from_entities(entities_tree, self.vertices)),
-         '!entities': self.save_entities(entities_flat),
-         'colors':    self.colors,
-         'texcoords': self.texcoords,
-         'vertices':  self.vertices})
-
-   def load_snapshot(self, data):
-      self.selected = copy.deepcopy(data['selected'])
-      self.selection_groups = copy.deepcopy(data['selection_groups'])
-      self.anim_name = data['anim_name']
-      self.cur_frame = data['cur_frame']
-      self.entities = copy.deepcopy(data['entities'])
-      self.polygons = copy.deepcopy(data['polygons'])
-      self.colors = copy.deepcopy(data['colors'])
-      self.texcoords = copy.deepcopy(data['texcoords'])
-      self.vertices_anim = copy.deepcopy(data['vertices_anim'])
-      self.vertices = self.vertices_anim[self.anim_name][self.cur_frame]
-
-   def save_snapshot(self):
-      data = {
-         'selected': copy.deepcopy(self.selected),
-         'selection_groups': copy.deepcopy(self.selection_groups),
-         'anim_name': self.anim_name,
-         'cur_frame': self.cur_frame,
-         'entities': copy.deepcopy(self.entities),
-         'polygons': copy.deepcopy(self.polygons),
-         'colors': copy.deepcopy(self.colors),
-         'texcoords': copy.deepcopy(self.texcoords),
-         'vertices_anim': copy.deepcopy(self.vertices_anim)}
-      return data
-
-   def restore_point(self):
-      self.snapshot_history.add(self.save_snapshot())
-
-   def undo_or_redo(self, shift_pressed):
-      data = None
-      if shift_pressed:
-         data = self.snapshot_history.getnext()
-      else:
-         data = self.snapshot_history.getprev(self.save_snapshot)
-      if data:
-         self.load_snapshot(data)
-
    def transform_from_screen_coords(self, x, y):
       return ((x - self.origin[0]) / self.scale[0], (y - self.origin[1]) / self.scale[1])
 
@@ -715,311 +742,83 @@ class Application:
       return (self.origin[0] + (x * self.scale[0]), self.origin[1] + (y * self.scale[1]))
 
    def vertex_to_screen_coords(self, ix):
-      return self.transform_to_screen_coords(*self.vertices[ix])
+      return self.transform_to_screen_coords(*self.model.vertices[ix])
+
+   def vertices_to_screen_coords(self, indices):
+      return (self.model.vertices[indices] * self.scale) + self.origin
+
+   def update_vertex_caches(self, vertices, indices):
+      # Called after the vertices have been moved in place.
+      self.model.update_vertex_caches(vertices, indices)
+      if self.geometry is not None:
+         self.geometry.update(vertices, indices)
+
+   def check_model_revision(self):
+      # Cached geometry and frames are dropped once the model has changed.
+      if self.model_revision != self.model.revision:
+         self.model_revision = self.model.revision
+         self.geometry = None
+         self.frame_player = None
 
    def find_nearby_vertex(self, x, y):
-      result = (-1, 0, 0, 99999)
-      for ix in range(len(self.vertices)):
-         x_, y_ = self.vertex_to_screen_coords(ix)
-         dx, dy = (x-x_, y-y_)
-         dist_squared = dx*dx + dy*dy
-         if dist_squared <= (SELECT_DIST * SELECT_DIST) and dist_squared < result[3]:
-            result = (ix, int(x_), int(y_), dist_squared)
-      return result[:3]
-
-   def polygon_selected(self, poly):
-
-      def all_vertices_selected(poly):
-         for vix in poly:
-            if vix not in self.selected:
-               return False
-         return True
-
-      return (poly and all_vertices_selected(poly))
-
-   def vertex_unused(self, index):
-      for ent in self.entities:
-         if ent and index in ent[2:]:
-            return False
-      for poly in self.polygons:
-         if poly and index in poly:
-            return False
-      return True
-
-   def reset_entity_or_polygon_creation(self):
-
-      def delete_vertex(vertex_table, index2delete):
-         del vertex_table[index2delete]
-
-      if self.entities[-1]:
-         indices = self.entities[-1][2:]
-         self.entities[-1] = None
-         for ix in reversed(indices):
-            if self.vertex_unused(ix):
-               self.foreach_vertex_table(delete_vertex, ix) # Guaranteed to be the last vertex.
-               del self.colors[ix]
-               del self.texcoords[ix]
-      if self.polygons[-1]:
-         indices = self.polygons[-1]
-         if len(indices) < 3:
-            self.polygons[-1] = None
-            for ix in reversed(indices):
-               if self.vertex_unused(ix):
-                  self.foreach_vertex_table(delete_vertex, ix) # Guaranteed to be the last vertex.
-                  del self.colors[ix]
-                  del self.texcoords[ix]
-         else:
-            self.polygons.append(None)
-
-   def new_selected(self, vertex_ix, invert):
-      for ix, vix in enumerate(self.selected):
-         if vix == vertex_ix:
-            if invert:
-               del self.selected[ix]
-            return
-      self.selected.append(vertex_ix)
-
-   def foreach_vertex_table(self, fun, arg):
-      for frame_table in self.vertices_anim.values():
-         for vertex_table in frame_table:
-            fun(vertex_table, arg)
-
-   def delete_selected(self, whole_polygons_only):
-
-      def delete_vertices(vertex_table, indices2delete):
-         # Indices must be sorted in descending order here!
-         for ix in indices2delete:
-            del vertex_table[ix]
-
-      def delete_colors_and_texcoords(indices2delete):
-         # Indices must be sorted in descending order here!
-         for ix in indices2delete:
-            del self.colors[ix]
-            del self.texcoords[ix]
-
-      def create_index_map(indices2delete, nvertices):
-         # Indices must be sorted in ascending order here!
-         index_map = {}
-         ix, di = 0,0
-         while ix < nvertices:
-            if ix in indices2delete:
-               di -= 1
-            else:
-               index_map[ix] = ix + di
-            ix += 1
-         return index_map
-
-      def update_selection_groups(index_map):
-         for selection_group in self.selection_groups:
-            ix = 0
-            while ix < len(selection_group):
-               vertex_ix = selection_group[ix]
-               if selection_group[ix] in index_map:
-                  selection_group[ix] = index_map[selection_group[ix]]
-               else:
-                  del selection_group[ix]
-                  ix -= 1
-               ix += 1
-
-      def update_entities(index_map):
-         indices2delete = set()
-         ix = 0
-         while ix < len(self.entities):
-            ent = self.entities[ix]
-            if ent:
-               indices_old = ent[2:]
-               indices_new = []
-               for i in indices_old:
-                  if i in index_map:
-                     indices_new.append(index_map[i])
-               if len(indices_new) == len(indices_old):
-                  self.entities[ix] = ent[:2] + indices_new
-               else:
-                  if ix == len(self.entities)-1:
-                     self.entities[ix] = None
-                  else:
-                     del self.entities[ix]
-                     ix -= 1
-                  for i in indices_new:
-                     indices2delete.add(i)
-            ix += 1
-         return indices2delete
-
-      def break_into_triples(poly):
-         triples = []
-         ix = 0
-         while ix < len(poly):
-            triples.append(poly[ix:ix+3])
-            ix += 3
-         return triples
-
-      def update_polygons(index_map):
-         indices2delete = set()
-         ix = 0
-         while ix < len(self.polygons):
-            poly = self.polygons[ix]
-            if poly:
-               indices_old = break_into_triples(poly)
-               indices_new = []
-               for triple in indices_old:
-                  if (len(triple) == 3) and (triple[0] in index_map) and (triple[1] in index_map) and (triple[2] in index_map):
-                     for i in triple:
-                        indices_new.append(index_map[i])
-                  else:
-                     for i in triple:
-                        if i in index_map:
-                           indices2delete.add(index_map[i])
-               if len(indices_new) > 0:
-                  self.polygons[ix] = indices_new
-               else:
-                  if ix == len(self.polygons)-1:
-                     self.polygons[ix] = None
-                  else:
-                     del self.polygons[ix]
-                     ix -= 1
-            ix += 1
-         return indices2delete
-
-      def delete_selected_polygons():
-         indices2delete = set()
-         ix = 0
-         while ix < len(self.polygons):
-            poly = self.polygons[ix]
-            if self.polygon_selected(poly):
-               for i in poly:
-                  indices2delete.add(i)
-               del self.polygons[ix]
-               ix -= 1
-            ix += 1
-         return [i for i in list(indices2delete) if self.vertex_unused(i)]
-
-      indices = delete_selected_polygons() if whole_polygons_only else self.selected
-      self.selected = []
-      while indices:
-         indices.sort()
-         index_map = create_index_map(indices, len(self.vertices))
-         indices.reverse()
-         self.foreach_vertex_table(delete_vertices, indices)
-         delete_colors_and_texcoords(indices)
-         update_selection_groups(index_map)
-         indices = list(update_entities(index_map) | update_polygons(index_map))
-         indices = [i for i in indices if self.vertex_unused(i)]
+      x, y = self.transform_from_screen_coords(x, y)
+      radius = SELECT_DIST / abs(self.scale[0])
+      if self.mode == MODE_PLAY:
+         # Vertices change every frame, keeping the grid up to date would not pay off.
+         ix = find_nearest_vertex(self.model.vertices, None, x, y, radius)
+      else:
+         ix = self.model.get_vertex_grid().find_nearest(x, y, radius)
+      if ix < 0:
+         return (-1, 0, 0)
+      x_, y_ = self.vertex_to_screen_coords(ix)
+      return (ix, int(x_), int(y_))
 
    def new_entity(self, ent_type, ent_name):
-      if self.entities[-1] is None:
-         self.restore_point()
-         self.entities[-1] = [ent_type, ent_name]
-         self.set_mode(MODE_INSERT)
-
-   def num_triangles(self):
-      cnt = 0
-      for poly in self.polygons:
-         if poly:
-            cnt += (len(poly) // 3)
-      return cnt
-
-   def num_polygons(self):
-      cnt = len(self.polygons)
-      return ((cnt-1) if (self.polygons[-1] is None) else cnt)
-
-   def iterate_over_polygons(self):
-      if self.num_polygons() > 0:
-         selected_polygon_indices = [ix for ix, poly in enumerate(self.polygons) if self.polygon_selected(poly)]
-         poly_ix = ((selected_polygon_indices[-1] + 1) % self.num_polygons()) if selected_polygon_indices else 0
-         self.selected = []
-         for ix in self.polygons[poly_ix]:
-            self.new_selected(ix, False)
+      self.model.new_entity(ent_type, ent_name)
+      self.set_mode(MODE_INSERT)
 
    def set_texcoords(self):
       x1,y1,x2,y2 = self.img_coords
-      for vix in self.selected:
+      texcoords = []
+      for vix in self.model.selected:
          x,y = self.vertex_to_screen_coords(vix)
          u = float(x-x1) / float(x2-x1)
          v = float(y-y1) / float(y2-y1)
-         self.texcoords[vix] = (u,v)
+         texcoords.append((u,v))
+      self.model.set_selected_texcoords(texcoords)
       self.viewmode = VMODE_TEX_OUT
 
    def gather_color(self):
-      if len(self.selected) > 0:
-         self.cur_color = self.colors[self.selected[-1]]
-
-   def duplicate_polygons(self):
-      polygons = [poly for poly in self.polygons if self.polygon_selected(poly)]
-      if polygons:
-         dx = 10.0 / self.scale[0]
-         dy = 10.0 / self.scale[1]
-         index_map = {}
-         for poly in polygons:
-            for ix in poly:
-               if ix not in index_map:
-                  index_map[ix] = len(self.vertices)
-                  x, y = self.vertices[ix]
-                  self.foreach_vertex_table(lambda vtable, v: vtable.append(v), (x+dx, y+dy))
-                  rgba = self.colors[ix]
-                  self.colors.append(rgba)
-                  uv = self.texcoords[ix]
-                  self.texcoords.append(uv)
-         for poly in polygons:
-            new_poly = [index_map[ix] for ix in poly]
-            self.polygons = self.polygons[:-1] + [new_poly] + self.polygons[-1:]
-         self.selected = []
-         for ix in index_map.values():
-            self.new_selected(ix, False)
-
-   def raise_selected_polygons(self):
-      new_polygons = [[],[]]
-      for poly in self.polygons:
-         if self.polygon_selected(poly) or (poly is None):
-            new_polygons[1].append(poly)
-         else:
-            new_polygons[0].append(poly)
-      self.polygons = new_polygons[0] + new_polygons[1]
-
-   def lower_selected_polygons(self):
-      new_polygons = [[],[]]
-      for poly in self.polygons:
-         if self.polygon_selected(poly):
-            new_polygons[0].append(poly)
-         else:
-            new_polygons[1].append(poly)
-      self.polygons = new_polygons[0] + new_polygons[1]
-
-   def flipx_selected_vertices(self):
-      x_coords = [self.vertices[vix][0] for vix in self.selected]
-      x_origin = (min(x_coords) + max(x_coords)) * 0.5
-      for vix in self.selected:
-         x, y = self.vertices[vix]
-         self.vertices[vix] = (2.0 * x_origin - x, y)
-
-   def flipy_selected_vertices(self):
-      y_coords = [self.vertices[vix][1] for vix in self.selected]
-      y_origin = (min(y_coords) + max(y_coords)) * 0.5
-      for vix in self.selected:
-         x, y = self.vertices[vix]
-         self.vertices[vix] = (x, 2.0 * y_origin - y)
-
-   def define_or_select_group(self, group_ix, define_group):
-      if define_group:
-         self.selection_groups[group_ix] = self.selected[:]
-      else:
-         self.selected = []
-         for ix in self.selection_groups[group_ix]:
-            self.new_selected(ix, False)
+      if len(self.model.selected) > 0:
+         self.cur_color = self.model.colors[self.model.selected.last()]
 
    def interpolate_vertices(self):
-      frames = self.vertices_anim[self.anim_name]
+      # Returns True if the vertices have changed, either moving to another position, or to a new frame player.
+      frames = self.model.vertices_anim[self.model.anim_name]
       t = get_time()
+      changed = False
       if len(frames) > 1:
+         position = self.model.cur_frame
          if self.frame_time > 0:
             dt = t - self.frame_time
-            self.cur_frame += (dt * self.play_fps)
-            if self.cur_frame > len(frames)-1:
-               self.cur_frame = 0
-         ix1 = int(self.cur_frame)
-         ix2 = (ix1 + 1) % len(frames)
-         delta = self.cur_frame - ix1
-         self.vertices = [(x1+delta*(x2-x1), y1+delta*(y2-y1)) for (x1,y1),(x2,y2) in zip(frames[ix1], frames[ix2])]
+            self.model.cur_frame += (dt * self.play_fps)
+            if self.model.cur_frame > len(frames)-1:
+               self.model.cur_frame = 0
+         player = self.get_frame_player()
+         if (self.model.cur_frame != position) or (self.model.vertices is not player.output):
+            self.model.vertices = player.play(self.model.cur_frame)
+            self.update_vertex_caches(self.model.vertices, np.arange(len(self.model.vertices)))
+            changed = True
       self.frame_time = t
+      return changed
+
+   def get_frame_player(self):
+      self.check_model_revision()
+      frames = self.model.vertices_anim[self.model.anim_name]
+      spline = (self.interp == 'spline')
+      if (self.frame_player is None) or not self.frame_player.plays(frames, spline):
+         self.frame_player = FramePlayer(frames, spline)
+      return self.frame_player
 
    def get_info(self):
 
@@ -1028,15 +827,15 @@ class Application:
          return ', '.join(lst) if lst else '-'
 
       def entities_list(ent_type):
-         lst = list(set([ent[1] for ent in self.entities if (ent and ent[1] and ent[0] == ent_type)]))
+         lst = list(set([ent[1] for ent in self.model.entities if (ent and ent[1] and ent[0] == ent_type)]))
          return list2string(lst)
 
       return MODEL_INFO_TEMPLATE.format(
-         ntriangles = self.num_triangles(),
-         npolygons  = self.num_polygons(),
-         nvertices  = len(self.vertices),
-         nframes    = sum([len(frames) for frames in self.vertices_anim.values()]),
-         animations = list2string(['{} ({})'.format(name, len(frames)) for name, frames in self.vertices_anim.items() if name]),
+         ntriangles = self.model.num_triangles(),
+         npolygons  = self.model.num_polygons(),
+         nvertices  = len(self.model.vertices),
+         nframes    = sum([len(frames) for frames in self.model.vertices_anim.values()]),
+         animations = list2string(['{} ({})'.format(name, len(frames)) for name, frames in self.model.vertices_anim.items() if name]),
          points     = entities_list(ENTITY_POINT),
          edges      = entities_list(ENTITY_EDGE),
          rectangles = entities_list(ENTITY_RECT),
@@ -1046,19 +845,19 @@ class Application:
       items = [self.mode]
       if self.mode == MODE_INSERT:
          msg = ''
-         ent = self.entities[-1]
+         ent = self.model.entities[-1]
          if ent:
             if len(ent) == 2:
                msg = ' ({})'.format(ent[0])
             else:
                msg = ' (continue {})'.format(ent[0])
-         elif self.polygons[-1]:
+         elif self.model.polygons[-1]:
             msg = ' (continue)'
          items[0] = items[0] + msg
-      if self.anim_name:
-         items.append('animation: ' + self.anim_name)
-      frame = self.cur_frame + 1
-      nframes = len(self.vertices_anim[self.anim_name])
+      if self.model.anim_name:
+         items.append('animation: ' + self.model.anim_name)
+      frame = self.model.cur_frame + 1
+      nframes = len(self.model.vertices_anim[self.model.anim_name])
       if nframes > 1:
          if self.mode == MODE_PLAY:
             items.append('frame: %.3f/%d' % (frame, nframes))
@@ -1068,6 +867,8 @@ class Application:
       return ', '.join(items)
 
    def get_status_line_2(self):
+      if self.loading_status is not None:
+         return self.loading_status
       descr = {
          VMODE_COLOR:   'Colored',
          VMODE_OUTLINE: 'Outline only',
@@ -1078,7 +879,7 @@ class Application:
    def get_position_line(self):
       x,y = (0,0)
       if self.nearpoint_ix >= 0:
-         x,y = self.vertices[self.nearpoint_ix]
+         x,y = self.model.vertices[self.nearpoint_ix]
       else:
          x,y = self.transform_from_screen_coords(*self.mouse_pos)
       return ('X: %.5f, Y: %.5f' % (x,y))
@@ -1086,12 +887,12 @@ class Application:
    def set_mode(self, mode):
       if self.mode != mode:
          if self.mode == MODE_INSERT:
-            self.reset_entity_or_polygon_creation()
+            self.model.reset_entity_or_polygon_creation()
          if self.mode == MODE_PLAY:
-            self.cur_frame = int(self.cur_frame)
-            self.vertices = self.vertices_anim[self.anim_name][self.cur_frame]
+            self.model.goto_frame(int(self.model.cur_frame), self.model.anim_name)
          self.mode = mode
          self.frame_time = 0
+         self.frame_player = None
 
    def next_mode(self):
       change_table = {
@@ -1117,20 +918,6 @@ class Application:
             VMODE_TEXTURE: VMODE_COLOR}
          self.viewmode = change_table[self.viewmode]
 
-   def prev_anim(self, anim_name):
-      anim_names = sorted(self.vertices_anim.keys())
-      for n in reversed(anim_names):
-         if n < anim_name:
-            return n
-      return anim_names[-1]
-
-   def next_anim(self, anim_name):
-      anim_names = sorted(self.vertices_anim.keys())
-      for n in anim_names:
-         if n > anim_name:
-            return n
-      return anim_names[0]
-
    def execute_command(self, cmd):
       if cmd:
          self.cmd_line = ''
@@ -1186,12 +973,19 @@ class Application:
       glLoadIdentity()
       glOrtho(0, self.window_size[0], self.window_size[1], 0, -1, 1)
       glMatrixMode(GL_MODELVIEW)
-      glLoadIdentity()
+      self.set_world_transform(False)
       glClearColor(*self.bg_color)
       glClear(GL_COLOR_BUFFER_BIT)
       glBlendFunc(GL_ONE, GL_ONE_MINUS_SRC_ALPHA)
       glEnable(GL_BLEND)
 
+   def set_world_transform(self, enabled):
+      # Model geometry is drawn in world coordinates, everything else in screen coordinates.
+      glLoadIdentity()
+      if enabled:
+         glTranslated(self.origin[0], self.origin[1], 0)
+         glScaled(self.scale[0], self.scale[1], 1)
+
    def post_render(self):
       SDL_GL_SwapWindow(self.wnd)
 
@@ -1212,69 +1006,126 @@ class Application:
          (x <= 0) or (x >= self.window_size[0]) or
          (y <= 0) or (y >= self.window_size[1]))
 
+   def get_geometry(self):
+      self.check_model_revision()
+      if self.geometry is None:
+         self.geometry = RenderGeometry(self.model.polygons, self.model.entities, self.model.colors, self.model.texcoords)
+      return self.geometry
+
+   def get_visible_rect(self, margin = 0):
+      # Visible area in world coordinates, extended by the margin given in pixels.
+      x1, y1 = self.transform_from_screen_coords(-margin, -margin)
+      x2, y2 = self.transform_from_screen_coords(self.window_size[0] + margin, self.window_size[1] + margin)
+      return (min(x1, x2), max(x1, x2), min(y1, y2), max(y1, y2))
+
    def render_polygons(self):
+      if vertex_arrays_supported():
+         self.render_polygons_batched()
+      else:
+         self.render_polygons_immediate()
+      if self.model.polygons[-1]:
+         self.render_markers(VERTEX_COLOR, CIRCLE_MARKER, self.vertices_to_screen_coords(self.model.polygons[-1][-2:]))
+
+   def render_polygons_batched(self):
+      # Each pass is drawn with a single call. Vertex positions are used as they are, since
+      # the camera is applied by OpenGL.
+      geometry = self.get_geometry()
+      triangles, edges = geometry.get_visible_triangles(self.model.vertices, self.get_visible_rect())
+      if len(triangles) == 0:
+         return
+      self.set_world_transform(True)
+      if (self.viewmode & VMODE_COLOR) != 0:
+         draw_elements(GL_TRIANGLES, None, self.model.vertices, geometry.colors, None, triangles)
+      if (self.viewmode & VMODE_TEXTURE) != 0:
+         set_texture(self.img_tex)
+         draw_elements(GL_TRIANGLES, None, self.model.vertices, geometry.colors, geometry.texcoords, triangles)
+         set_texture(None)
+      if (self.viewmode & VMODE_OUTLINE) != 0:
+         draw_elements(GL_LINES, VERTEX_COLOR, self.model.vertices, None, None, edges)
+      self.set_world_transform(False)
+
+   def render_polygons_immediate(self):
       if (self.viewmode & VMODE_COLOR) != 0:
-         for poly in self.polygons:
+         for poly in self.model.polygons:
             if poly and len(poly) >= 3:
                vertices = [self.vertex_to_screen_coords(ix) for ix in poly]
                if not self.is_outofview(vertices):
-                  colors = [self.colors[ix] for ix in poly]
+                  colors = [self.model.colors[ix] for ix in poly]
                   draw_polygon(None, vertices, colors, None)
       if (self.viewmode & VMODE_TEXTURE) != 0:
          set_texture(self.img_tex)
-         for poly in self.polygons:
+         for poly in self.model.polygons:
             if poly and len(poly) >= 3:
                vertices = [self.vertex_to_screen_coords(ix) for ix in poly]
                if not self.is_outofview(vertices):
-                  colors = [self.colors[ix] for ix in poly]
-                  texcoords = [self.texcoords[ix] for ix in poly]
+                  colors = [self.model.colors[ix] for ix in poly]
+                  texcoords = [self.model.texcoords[ix] for ix in poly]
                   draw_polygon(None, vertices, colors, texcoords)
          set_texture(None)
       if (self.viewmode & VMODE_OUTLINE) != 0:
-         for poly in self.polygons:
+         for poly in self.model.polygons:
             if poly and len(poly) >= 3:
                vertices = [self.vertex_to_screen_coords(ix) for ix in poly]
                if not self.is_outofview(vertices):
                   draw_polygon(VERTEX_COLOR, vertices, None, None)
-      if self.polygons[-1]:
-         poly = self.polygons[-1]
-         vertices = [self.vertex_to_screen_coords(ix) for ix in poly[-2:]]
-         for x,y in vertices:
-            if not self.is_outofview1(x, y):
-               draw_point_circle(VERTEX_COLOR, x, y)
 
    def render_entities(self):
-      for ent in self.entities:
-         if ent and len(ent) >= 3:
-            x1,y1 = self.vertex_to_screen_coords(ent[2])
-            hidden = True
-            if len(ent) == 3: # Point or incomplete edge/rectangle/circle.
-               if not self.is_outofview1(x1, y1):
-                  hidden = False
-                  if ent[0] == ENTITY_RECT:
-                     draw_point_square(ENTITY_COLOR, x1, y1)
-                  else:
-                     draw_point_circle(ENTITY_COLOR, x1, y1)
-            elif ent[0] == ENTITY_CIRCLE:
-               x2,y2 = self.vertex_to_screen_coords(ent[3])
-               radius = math.sqrt((x1-x2)**2 + (y1-y2)**2)
-               if not self.is_outofview2(x1-radius, y1-radius, x1+radius, y1+radius):
-                  hidden = False
-                  draw_circle(ENTITY_COLOR, x1, y1, radius, CIRCLE_NVERTS)
+      labels = []
+      circles = []
+      squares = []
+      # Entities are culled with the tree first, and then more precisely in screen coordinates.
+      for ent in self.get_geometry().get_visible_entities(self.model.vertices, self.get_visible_rect(POINT_RADIUS)):
+         x1,y1 = self.vertex_to_screen_coords(ent[2])
+         hidden = True
+         if len(ent) == 3: # Point or incomplete edge/rectangle/circle.
+            if not self.is_outofview1(x1, y1):
+               hidden = False
+               if ent[0] == ENTITY_RECT:
+                  squares.append((x1, y1))
+               else:
+                  circles.append((x1, y1))
+         elif ent[0] == ENTITY_CIRCLE:
+            x2,y2 = self.vertex_to_screen_coords(ent[3])
+            radius = math.sqrt((x1-x2)**2 + (y1-y2)**2)
+            if not self.is_outofview2(x1-radius, y1-radius, x1+radius, y1+radius):
+               hidden = False
+               draw_circle(ENTITY_COLOR, x1, y1, radius, CIRCLE_NVERTS)
+               draw_line(ENTITY_COLOR, x1, y1, x2, y2)
+         else:
+            x2,y2 = self.vertex_to_screen_coords(ent[3])
+            if not self.is_outofview2(x1, y1, x2, y2):
+               hidden = False
+               if ent[0] == ENTITY_EDGE:
                   draw_line(ENTITY_COLOR, x1, y1, x2, y2)
-            else:
-               x2,y2 = self.vertex_to_screen_coords(ent[3])
-               if not self.is_outofview2(x1, y1, x2, y2):
-                  hidden = False
-                  if ent[0] == ENTITY_EDGE:
-                     draw_line(ENTITY_COLOR, x1, y1, x2, y2)
-                  elif ent[0] == ENTITY_RECT:
-                     draw_rect(None, ENTITY_COLOR, x1, y1, x2, y2)
-            if not hidden and ent[1]:
-               set_texture(self.font_tex)
-               ch_w, ch_h = self.font_glyph_size
-               draw_text(ENTITY_COLOR, x1, y1, ch_w, ch_h, ent[1])
-               set_texture(None)
+               elif ent[0] == ENTITY_RECT:
+                  draw_rect(None, ENTITY_COLOR, x1, y1, x2, y2)
+         if not hidden and ent[1]:
+            labels.append((x1, y1, ent[1]))
+      self.render_markers(ENTITY_COLOR, CIRCLE_MARKER, create_frame(circles))
+      self.render_markers(ENTITY_COLOR, SQUARE_MARKER, create_frame(squares))
+      self.render_texts(ENTITY_COLOR, labels)
+
+   def render_markers(self, color, template, points):
+      # Points are in screen coordinates, markers out of view are skipped.
+      points = points[(points[:,0] > 0) & (points[:,0] < self.window_size[0]) & (points[:,1] > 0) & (points[:,1] < self.window_size[1])]
+      if vertex_arrays_supported():
+         draw_markers(color, template, points)
+      else:
+         draw_point = draw_point_square if (template is SQUARE_MARKER) else draw_point_circle
+         for x,y in points.tolist():
+            draw_point(color, x, y)
+
+   def render_texts(self, color, texts):
+      # Texts are (x, y, string) tuples, drawn in a single batch when vertex arrays are supported.
+      if texts:
+         set_texture(self.font_tex)
+         ch_w, ch_h = self.font_glyph_size
+         if vertex_arrays_supported():
+            draw_text_meshes(color, [(x, y, self.text_meshes.get(ch_w, ch_h, string)) for x, y, string in texts])
+         else:
+            for x, y, string in texts:
+               draw_text(color, x, y, ch_w, ch_h, string)
+         set_texture(None)
 
    def render(self):
       self.pre_render()
@@ -1285,26 +1136,22 @@ class Application:
       set_texture(None)
       self.render_polygons()
       self.render_entities()
-      for vix in self.selected:
-         x,y = self.vertex_to_screen_coords(vix)
-         if not self.is_outofview1(x, y):
-            draw_point_circle(SELECT_COLOR, x, y)
+      self.render_markers(SELECT_COLOR, CIRCLE_MARKER, self.vertices_to_screen_coords(self.model.selected.indices()))
       if self.select_rect:
          x,y = self.mouse_pos
          draw_rect(None, SELECT_COLOR, x, y, *self.mouse_pos_click)
       if self.mouse_pos is not None:
          self.nearpoint_ix, x, y = self.find_nearby_vertex(*self.mouse_pos)
          if self.nearpoint_ix >= 0:
-            draw_point_circle(VERTEX_COLOR, x, y)
+            self.render_markers(VERTEX_COLOR, CIRCLE_MARKER, create_frame([(x, y)]))
       draw_rect(self.cur_color, TEXT_COLOR, 5, 5, 45, 45)
-      set_texture(self.font_tex)
       ch_w, ch_h = self.font_glyph_size
-      draw_text(TEXT_COLOR, 50, 5,      ch_w, ch_h, self.get_status_line_1())
-      draw_text(TEXT_COLOR, 50, 5+ch_h, ch_w, ch_h, self.get_status_line_2())
+      texts = [(50, 5, self.get_status_line_1()), (50, 5+ch_h, self.get_status_line_2())]
       if self.mouse_pos is not None:
-         draw_text(TEXT_COLOR, 50, 5+2*ch_h, ch_w, ch_h, self.get_position_line())
+         texts.append((50, 5+2*ch_h, self.get_position_line()))
       if self.cmd_line:
-         draw_text(TEXT_COLOR, 0, self.window_size[1]-ch_h, ch_w, ch_h, self.cmd_line)
+         texts.append((0, self.window_size[1]-ch_h, self.cmd_line))
+      self.render_texts(TEXT_COLOR, texts)
       self.post_render()
 
    #============================================================================
@@ -1312,6 +1159,9 @@ class Application:
    #============================================================================
 
    def evt_main(self, event):
+      # Key releases and events not handled below change nothing visible.
+      if event.type in (SDL_WINDOWEVENT, SDL_KEYDOWN, SDL_MOUSEBUTTONDOWN, SDL_MOUSEBUTTONUP, SDL_MOUSEMOTION, SDL_MOUSEWHEEL):
+         self.redraw = True
       if event.type == SDL_QUIT:
          self.exit = True
       elif event.type == SDL_WINDOWEVENT:
@@ -1378,21 +1228,20 @@ class Application:
       elif sym == SDLK_INSERT:
          self.cmd_frame()
       elif sym == SDLK_DELETE:
-         self.restore_point()
-         self.delete_selected(shift)
+         self.model.delete_selected(shift)
       elif sym == SDLK_HOME:
-         if len(self.vertices_anim) > 1:
-            self.cmd_goto(1, self.prev_anim(self.anim_name))
+         if len(self.model.vertices_anim) > 1:
+            self.cmd_goto(1, self.model.prev_anim(self.model.anim_name))
       elif sym == SDLK_END:
-         if len(self.vertices_anim) > 1:
-            self.cmd_goto(1, self.next_anim(self.anim_name))
+         if len(self.model.vertices_anim) > 1:
+            self.cmd_goto(1, self.model.next_anim(self.model.anim_name))
       elif sym == SDLK_PAGEUP:
-         self.cmd_goto(((self.cur_frame-1) % len(self.vertices_anim[self.anim_name])) + 1)
+         self.cmd_goto(((self.model.cur_frame-1) % len(self.model.vertices_anim[self.model.anim_name])) + 1)
       elif sym == SDLK_PAGEDOWN:
-         self.cmd_goto(((self.cur_frame+1) % len(self.vertices_anim[self.anim_name])) + 1)
+         self.cmd_goto(((self.model.cur_frame+1) % len(self.model.vertices_anim[self.model.anim_name])) + 1)
       elif sym == SDLK_ESCAPE:
-         self.selected = []
-         self.reset_entity_or_polygon_creation()
+         self.model.selected.clear()
+         self.model.reset_entity_or_polygon_creation()
       elif ctrl and char == 'Q':
          if tkmessagebox.askyesno('Confirmation', 'Do you really want to quit?'):
             self.cmd_quit()
@@ -1402,12 +1251,12 @@ class Application:
             self.cmd_new()
          self.back_from_other_window()
       elif ctrl and char == 'O':
-         path = tkfiledialog.askopenfilename(title = 'Open', defaultextension = '.json', filetypes = (('Json files', '.json'), ('All files', '.*')))
+         path = tkfiledialog.askopenfilename(title = 'Open', defaultextension = '.json', filetypes = (('Json files', '.json'), ('Binary files', BINARY_EXTENSION), ('All files', '.*')))
          self.back_from_other_window()
          if path:
             self.cmd_open(path)
       elif ctrl and char == 'S':
-         path = tkfiledialog.asksaveasfilename(title = 'Save', defaultextension = '.json', filetypes = (('Json files', '.json'), ('All files', '.*')))
+         path = tkfiledialog.asksaveasfilename(title = 'Save', defaultextension = '.json', filetypes = (('Json files', '.json'), ('Binary files', BINARY_EXTENSION), ('All files', '.*')))
          self.back_from_other_window()
          if path:
             self.cmd_save(path)
@@ -1418,7 +1267,7 @@ class Application:
             self.cmd_btree(path)
       elif ctrl and char == 'I':
          if shift:
-            self.iterate_over_polygons()
+            self.model.iterate_over_polygons()
          else:
             path = self.evt_get_image_path()
             if path:
@@ -1440,24 +1289,19 @@ class Application:
             else:
                self.cmd_setcolor(*triple)
       elif ctrl and char == 'Z':
-         self.undo_or_redo(shift)
+         self.model.undo_or_redo(shift)
       elif ctrl and char == 'D':
-         self.restore_point()
-         self.duplicate_polygons()
+         self.model.duplicate_polygons(10.0 / self.scale[0], 10.0 / self.scale[1])
       elif ctrl and char == 'R':
-         self.restore_point()
-         self.raise_selected_polygons()
+         self.model.raise_selected_polygons()
       elif ctrl and char == 'L':
-         self.restore_point()
-         self.lower_selected_polygons()
+         self.model.lower_selected_polygons()
       elif ctrl and char == 'X':
-         self.restore_point()
-         self.flipx_selected_vertices()
+         self.model.flipx_selected_vertices()
       elif ctrl and char == 'Y':
-         self.restore_point()
-         self.flipy_selected_vertices()
+         self.model.flipy_selected_vertices()
       elif ctrl and char is not None and char.isdigit():
-         self.define_or_select_group(int(char), shift)
+         self.model.define_or_select_group(int(char), shift)
       elif self.cmd_line == '':
          if char in ('`','~'):
             self.cmd_line = CMD_PREFIX
@@ -1498,47 +1342,21 @@ class Application:
          self.keys_pressed.remove(char)
 
    def evt_b1(self, event):
-      self.snapshot_saved = False
+      self.dragged_indices = None
       self.selected_ix = -1
       self.mouse_pos_click = (event.x, event.y)
       if self.mode == MODE_INSERT:
-         self.restore_point()
-         vertex_ix = self.nearpoint_ix
-         if vertex_ix < 0:
-            vertex_ix = len(self.vertices)
-            vertex = self.transform_from_screen_coords(event.x, event.y)
-            self.foreach_vertex_table(lambda vtable, v: vtable.append(v), vertex)
-            self.colors.append(self.cur_color)
-            self.texcoords.append((0,0))
-         ent = self.entities[-1]
-         if ent and ent[0] == ENTITY_POINT and len(ent) < 3:
-            ent.append(vertex_ix)
-            self.entities.append(None)
-            self.new_entity(ent[0], ent[1])
-         elif ent and ent[0] in (ENTITY_EDGE, ENTITY_RECT, ENTITY_CIRCLE) and len(ent) < 4:
-            ent.append(vertex_ix)
-            if len(ent) == 4:
-               self.entities.append(None)
-               self.new_entity(ent[0], ent[1])
-         elif self.polygons[-1]:
-            poly = self.polygons[-1]
-            if len(poly) >= 3:
-               poly += poly[-2:]
-            poly.append(vertex_ix)
-         else:
-            self.polygons[-1] = [vertex_ix]
+         self.model.insert_vertex(self.nearpoint_ix, self.transform_from_screen_coords(event.x, event.y), self.cur_color)
       elif self.mode == MODE_EDIT and self.nearpoint_ix >= 0:
          self.selected_ix = self.nearpoint_ix
          if KEY_SHIFT in self.keys_pressed:
-            for poly in self.polygons:
-               if poly and self.selected_ix in poly:
-                  for ix in poly:
-                     self.new_selected(ix, (KEY_CTRL in self.keys_pressed))
+            for poly in self.model.adjacency.polygons_with_vertex(self.selected_ix):
+               self.model.new_selected(poly, (KEY_CTRL in self.keys_pressed))
          elif KEY_CTRL in self.keys_pressed:
-            self.new_selected(self.selected_ix, True)
+            self.model.new_selected([self.selected_ix], True)
 
    def evt_b1_release(self, event):
-      self.snapshot_saved = False
+      self.dragged_indices = None
       self.selected_ix = -1
       if self.select_rect:
          self.select_rect = False
@@ -1547,9 +1365,8 @@ class Application:
             x2, y2 = self.transform_from_screen_coords(event.x, event.y)
             left, right = (x1, x2) if (x1 < x2) else (x2, x1)
             bottom, top = (y1, y2) if (y1 < y2) else (y2, y1)
-            for ix, (x, y) in enumerate(self.vertices):
-               if x >= left and x <= right and y >= bottom and y <= top:
-                  self.new_selected(ix, (KEY_CTRL in self.keys_pressed))
+            indices = self.model.get_vertex_grid().find_in_rect(left, right, bottom, top)
+            self.model.new_selected(indices.tolist(), (KEY_CTRL in self.keys_pressed))
 
    def evt_motion(self, event):
       self.mouse_pos = (event.x, event.y)
@@ -1560,47 +1377,40 @@ class Application:
          f = 4.0 * (float(dx + dy) / sum(self.window_size))
          return (0.25*f*f + 0.75*f + 1.0) # [-1..0..1] => [0.5..1..2]
 
-      def possible_restore_point():
-         if self.snapshot_saved == False:
-            self.snapshot_saved = True
-            self.restore_point()
+      def possible_restore_point(indices):
+         # Selection or the kind of transform can change during a drag, so each motion saves the vertices not saved yet.
+         self.dragged_indices = self.model.save_dragged_vertices(indices, self.dragged_indices)
 
       dx = (event.x - self.mouse_pos[0]) * math.copysign(1.0, self.scale[0])
       dy = (event.y - self.mouse_pos[1]) * math.copysign(1.0, self.scale[1])
       self.mouse_pos = (event.x, event.y)
       if self.mode == MODE_EDIT:
          origin = self.transform_from_screen_coords(*self.mouse_pos_click)
-         if self.selected and 'R' in self.keys_pressed:
-            possible_restore_point()
+         indices = self.model.selected.indices()
+         if self.model.selected and 'R' in self.keys_pressed:
+            possible_restore_point(indices)
             angle = 4.0 * math.pi * (float(dx + dy) / sum(self.window_size))
-            for vix in self.selected:
-               self.vertices[vix] = rotate_vertex(self.vertices[vix], origin, angle)
-         elif self.selected and 'S' in self.keys_pressed:
-            possible_restore_point()
-            for vix in self.selected:
-               self.vertices[vix] = scale_vertex(self.vertices[vix], origin, scale_factor(dx, dy))
-         elif self.selected and 'X' in self.keys_pressed:
-            possible_restore_point()
-            for vix in self.selected:
-               vertex_old = self.vertices[vix]
-               vertex_new = scale_vertex(vertex_old, origin, scale_factor(dx, dy))
-               self.vertices[vix] = (vertex_new[0], vertex_old[1])
-         elif self.selected and 'Y' in self.keys_pressed:
-            possible_restore_point()
-            for vix in self.selected:
-               vertex_old = self.vertices[vix]
-               vertex_new = scale_vertex(vertex_old, origin, scale_factor(dx, dy))
-               self.vertices[vix] = (vertex_old[0], vertex_new[1])
-         elif self.selected_ix >= 0 and self.selected_ix in self.selected:
-            possible_restore_point()
-            for vix in self.selected:
-               x, y = self.vertices[vix]
-               self.vertices[vix] = (x + dx / abs(self.scale[0]), y + dy / abs(self.scale[1]))
+            rotate_vertices(self.model.vertices, indices, origin, angle)
+         elif self.model.selected and 'S' in self.keys_pressed:
+            possible_restore_point(indices)
+            scale_vertices(self.model.vertices, indices, origin, scale_factor(dx, dy))
+         elif self.model.selected and 'X' in self.keys_pressed:
+            possible_restore_point(indices)
+            scale_vertices(self.model.vertices, indices, origin, scale_factor(dx, dy), 0)
+         elif self.model.selected and 'Y' in self.keys_pressed:
+            possible_restore_point(indices)
+            scale_vertices(self.model.vertices, indices, origin, scale_factor(dx, dy), 1)
+         elif self.selected_ix >= 0 and self.selected_ix in self.model.selected:
+            possible_restore_point(indices)
+            move_vertices(self.model.vertices, indices, dx / abs(self.scale[0]), dy / abs(self.scale[1]))
          elif self.selected_ix >= 0:
-            possible_restore_point()
-            self.vertices[self.selected_ix] = self.transform_from_screen_coords(event.x, event.y)
+            indices = [self.selected_ix]
+            possible_restore_point(indices)
+            self.model.vertices[self.selected_ix] = self.transform_from_screen_coords(event.x, event.y)
          else:
             self.select_rect = True
+            indices = []
+         self.update_vertex_caches(self.model.vertices, indices)
 
    def evt_motion_b2_b3(self, event):
       dx = event.x - self.mouse_pos[0]
@@ -1619,23 +1429,28 @@ class Application:
       self.exit = True
 
    def cmd_new(self, *args):
-      self.snapshot_history.reset()
-      self.reset_variables()
+      self.model.reset()
       self.reset_view()
       self.set_mode(MODE_INSERT)
 
    def cmd_open(self, *args):
       if len(args) < 1:
          raise RecoverableError('Syntax: open <file_path>')
-      self.snapshot_history.reset()
       data = None
+      # Progress is shown only if loading takes a while.
+      self.progress_time = get_time() + PROGRESS_SECS
       try:
-         with open(args[0], 'r') as f:
-            data = json.load(f)
+         data = load_model_file(args[0], self.show_loading_progress)
+      except RecoverableError:
+         raise
       except:
          raise RecoverableError('Read failure')
+      finally:
+         self.loading_status = None
+      # Undo history is kept if loading fails or gets cancelled.
+      self.model.undo_journal.reset()
       try:
-         self.load_model(data)
+         self.model.load_model(data)
          self.reset_view()
       except:
          self.cmd_new()
@@ -1643,21 +1458,35 @@ class Application:
 
    def cmd_save(self, *args):
       if len(args) < 1:
-         raise RecoverableError('Syntax: save <file_path>')
-      data = dump_json(self.save_model())
+         raise RecoverableError('Syntax: save <file_path> (<float64|float32>)')
+      if is_binary_model_path(args[0]):
+         float_type = args[1] if (len(args) > 1) else 'float64'
+         if float_type not in BINARY_FLOAT_TYPES:
+            raise RecoverableError('Syntax: save <file_path> (<float64|float32>)')
+         # Frame player holds frames, which may be mapped from the file being replaced.
+         self.frame_player = None
+         try:
+            write_binary_model(args[0], self.model, float_type)
+         except Exception as e:
+            raise RecoverableError('Write failure: {}'.format(e))
+         return
+      data = self.model.save_model()
       try:
          with open(args[0], 'w') as f:
-            f.write(data)
+            write_json(f, data, self.json_indent, self.json_precision)
       except:
          raise RecoverableError('Write failure')
 
    def cmd_btree(self, *args):
-      if len(args) < 1:
-         raise RecoverableError('Syntax: btree <file_path>')
-      data = dump_json(self.export_btree())
+      options = args[1:]
+      if (len(args) < 1) or any((opt not in BTREE_SPLITS) and (opt not in BTREE_LAYOUTS) for opt in options):
+         raise RecoverableError('Syntax: btree <file_path> (<sah|median>) (<nested|flat>)')
+      split  = ([opt for opt in options if opt in BTREE_SPLITS]  + ['sah'])[0]
+      layout = ([opt for opt in options if opt in BTREE_LAYOUTS] + ['nested'])[0]
+      data = self.model.export_btree(split, layout)
       try:
          with open(args[0], 'w') as f:
-            f.write(data)
+            write_json(f, data, self.json_indent, self.json_precision)
       except:
          raise RecoverableError('Write failure')
 
@@ -1688,12 +1517,7 @@ class Application:
       except:
          raise RecoverableError('Invalid value')
       self.cur_color = (r, g, b, a)
-      snapshot_saved = False
-      for ix in self.selected:
-         if snapshot_saved == False:
-            snapshot_saved = True
-            self.restore_point()
-         self.colors[ix] = self.cur_color
+      self.model.set_selected_color(self.cur_color)
 
    def cmd_setbgcolor(self, *args):
       if len(args) < 3:
@@ -1708,93 +1532,51 @@ class Application:
       self.bg_color = (r, g, b, 1.0)
 
    def cmd_point(self, *args):
-      self.reset_entity_or_polygon_creation()
+      self.model.reset_entity_or_polygon_creation()
       self.new_entity(ENTITY_POINT, (args[0] if (len(args) > 0) else ''))
 
    def cmd_edge(self, *args):
-      self.reset_entity_or_polygon_creation()
+      self.model.reset_entity_or_polygon_creation()
       self.new_entity(ENTITY_EDGE, (args[0] if (len(args) > 0) else ''))
 
    def cmd_rect(self, *args):
-      self.reset_entity_or_polygon_creation()
+      self.model.reset_entity_or_polygon_creation()
       self.new_entity(ENTITY_RECT, (args[0] if (len(args) > 0) else ''))
 
    def cmd_circle(self, *args):
-      self.reset_entity_or_polygon_creation()
+      self.model.reset_entity_or_polygon_creation()
       self.new_entity(ENTITY_CIRCLE, (args[0] if (len(args) > 0) else ''))
 
    def cmd_anim(self, *args):
       self.set_mode(MODE_EDIT)
-      anim_name = args[0] if (len(args) >= 1) else ''
-      if anim_name != self.anim_name:
-         if anim_name not in self.vertices_anim:
-            self.restore_point()
-         self.anim_name = anim_name
-         self.cur_frame = 0
-         if self.anim_name not in self.vertices_anim:
-            self.vertices = self.vertices[:]
-            self.vertices_anim[self.anim_name] = [self.vertices]
-         else:
-            self.vertices = self.vertices_anim[self.anim_name][self.cur_frame]
+      self.model.select_anim(args[0] if (len(args) >= 1) else '')
 
    def cmd_delanim(self, *args):
-      anim_name = args[0] if (len(args) >= 1) else self.anim_name
-      if anim_name not in self.vertices_anim:
-         raise RecoverableError('No animation')
-      if len(self.vertices_anim) == 1:
-         raise RecoverableError('Invalid operation')
-      self.restore_point()
-      del self.vertices_anim[anim_name]
-      if self.anim_name == anim_name:
-         self.cmd_goto(1, self.next_anim(anim_name))
+      self.model.delete_anim(args[0] if (len(args) >= 1) else self.model.anim_name)
 
    def cmd_frame(self, *args):
       if self.mode == MODE_PLAY:
          raise RecoverableError('Invalid mode')
-      frame_ix  = int(args[0])-1 if (len(args) >= 1) else self.cur_frame
-      anim_name =     args[1]    if (len(args) >= 2) else self.anim_name
-      if anim_name not in self.vertices_anim:
-         raise RecoverableError('No animation')
-      if (frame_ix < 0) or (frame_ix >= len(self.vertices_anim[anim_name])):
-         raise RecoverableError('No frame')
-      self.restore_point()
-      self.vertices = self.vertices_anim[anim_name][frame_ix][:]
-      self.cur_frame += 1
-      allframes = self.vertices_anim[self.anim_name]
-      self.vertices_anim[self.anim_name] = allframes[:self.cur_frame] + [self.vertices] + allframes[self.cur_frame:]
+      frame_ix  = int(args[0])-1 if (len(args) >= 1) else self.model.cur_frame
+      anim_name =     args[1]    if (len(args) >= 2) else self.model.anim_name
+      self.model.duplicate_frame(frame_ix, anim_name)
 
    def cmd_delframe(self, *args):
       if self.mode == MODE_PLAY:
          raise RecoverableError('Invalid mode')
-      frame_ix  = int(args[0])-1 if (len(args) >= 1) else self.cur_frame
-      anim_name =     args[1]    if (len(args) >= 2) else self.anim_name
-      if anim_name not in self.vertices_anim:
-         raise RecoverableError('No animation')
-      if (frame_ix < 0) or (frame_ix >= len(self.vertices_anim[anim_name])):
-         raise RecoverableError('No frame')
-      if len(self.vertices_anim[anim_name]) == 1:
-         self.cmd_delanim(anim_name)
-      else:
-         self.restore_point()
-         del self.vertices_anim[anim_name][frame_ix]
-         if self.anim_name == anim_name:
-            self.cur_frame = min(self.cur_frame, len(self.vertices_anim[self.anim_name])-1)
-            self.vertices = self.vertices_anim[self.anim_name][self.cur_frame]
+      frame_ix  = int(args[0])-1 if (len(args) >= 1) else self.model.cur_frame
+      anim_name =     args[1]    if (len(args) >= 2) else self.model.anim_name
+      self.model.delete_frame(frame_ix, anim_name)
 
    def cmd_goto(self, *args):
       if len(args) < 1:
          raise RecoverableError('Syntax: goto <frame_num> (<animation_name>)')
       frame_ix = int(args[0])-1
-      anim_name = args[1] if len(args) > 1 else self.anim_name
-      if anim_name not in self.vertices_anim:
-         raise RecoverableError('No animation')
-      if frame_ix >= len(self.vertices_anim[anim_name]):
-         raise RecoverableError('No frame')
+      anim_name = args[1] if len(args) > 1 else self.model.anim_name
+      self.model.check_frame(frame_ix, anim_name)
       # Makes no sense to change frame in play mode, unless when jumping to another animation.
-      if (self.mode != MODE_PLAY) or (self.anim_name != anim_name):
-         self.anim_name = anim_name
-         self.cur_frame = frame_ix
-         self.vertices = self.vertices_anim[self.anim_name][self.cur_frame]
+      if (self.mode != MODE_PLAY) or (self.model.anim_name != anim_name):
+         self.model.goto_frame(frame_ix, anim_name)
 
    def cmd_copyfrom(self, *args):
       if self.mode == MODE_PLAY:
@@ -1802,12 +1584,16 @@ class Application:
       if len(args) < 1:
          raise RecoverableError('Syntax: copyfrom <frame_num> (<animation_name>)')
       frame_ix = int(args[0])-1
-      anim_name = args[1] if len(args) > 1 else self.anim_name
-      if anim_name not in self.vertices_anim:
-         raise RecoverableError('No animation')
-      if frame_ix >= len(self.vertices_anim[anim_name]):
-         raise RecoverableError('No frame')
-      self.restore_point()
-      for vix in self.selected:
-         x, y = self.vertices_anim[anim_name][frame_ix][vix]
-         self.vertices[vix] = (x, y)
+      anim_name = args[1] if len(args) > 1 else self.model.anim_name
+      self.model.copy_from_frame(frame_ix, anim_name)
+
+   def cmd_interp(self, *args):
+      if (len(args) < 1) or (args[0] not in ('linear', 'spline')):
+         raise RecoverableError('Syntax: interp <linear|spline>')
+      self.interp = args[0]
+
+   def cmd_json(self, *args):
+      if (len(args) < 1) or (args[0] not in ('indented', 'compact')):
+         raise RecoverableError('Syntax: json <indented|compact> (<precision>)')
+      self.json_indent = INIT_JSON_INDENT if (args[0] == 'indented') else None
+      self.json_precision = int(args[1]) if len(args) > 1 else None
@@ -0,0 +1,106 @@
+
+import math
+import numpy as np
+
+#===============================================================================
+# Vertex frames are stored as contiguous float64 arrays of shape (N, 2).
+#===============================================================================
+
+def create_frame(vertices = ()):
+   return np.asarray(vertices, dtype = np.float64).reshape((-1, 2))
+
+def append_to_frame(frame, vertices):
+   return np.concatenate((frame, create_frame(vertices)))
+
+def delete_from_frame(frame, indices):
+   return np.delete(frame, indices, axis = 0)
+
+def frame_to_tuples(frame):
+   return [tuple(v) for v in frame.tolist()]
+
+def get_frame_bbox(frame):
+   (left, bottom), (right, top) = (frame.min(axis = 0).tolist(), frame.max(axis = 0).tolist())
+   return (left, right, bottom, top)
+
+def index_array(indices):
+   return np.fromiter(indices, dtype = np.intp, count = len(indices))
+
+def gather_ranges(array, starts, lengths):
+   # Same as concatenating array[start:start+length] for all the ranges.
+   ends = np.cumsum(lengths)
+   return array[np.repeat(starts - ends + lengths, lengths) + np.arange(ends[-1] if (len(ends) > 0) else 0)]
+
+# Frames duplicated from another one share its vertex table, which is made read-only.
+# Whichever of them gets modified first is copied at that point.
+
+def share_frame(frame):
+   frame.flags.writeable = False
+   return frame
+
+def get_writable_frame(frame_table, ix):
+   if not frame_table[ix].flags.writeable:
+      frame_table[ix] = frame_table[ix].copy()
+   return frame_table[ix]
+
+#===============================================================================
+# Playback of an animation. Frames are stacked into a single array, together with
+# the differences between consecutive frames, so each played frame is a weighted
+# sum of precomputed terms, calculated by one call into a buffer that is reused.
+# Spline interpolation goes through Catmull-Rom curves, whose polynomial
+# coefficients are precomputed the same way. Animations loop, so the last frame
+# is followed by the first one.
+#===============================================================================
+
+class FramePlayer:
+
+   def __init__(self, frames, spline):
+      self.frames = list(frames)
+      self.spline = spline
+      p1 = np.stack(self.frames).reshape((len(self.frames), -1))
+      p2 = np.roll(p1, -1, axis = 0)
+      if spline:
+         p0 = np.roll(p1,  1, axis = 0)
+         p3 = np.roll(p1, -2, axis = 0)
+         terms = (p1, 0.5 * (p2 - p0), p0 - 2.5 * p1 + 2.0 * p2 - 0.5 * p3, 0.5 * (p3 - p0) + 1.5 * (p1 - p2))
+      else:
+         terms = (p1, p2 - p1)
+      self.terms = np.stack(terms, axis = 1)
+      self.output = np.empty(self.frames[0].shape)
+
+   def plays(self, frames, spline):
+      return (spline == self.spline) and (len(frames) == len(self.frames)) and all([f1 is f2 for f1, f2 in zip(frames, self.frames)])
+
+   def play(self, position):
+      ix = int(position)
+      t = position - ix
+      weights = (1.0, t, t*t, t*t*t)[:self.terms.shape[1]]
+      np.dot(weights, self.terms[ix], out = self.output.reshape(-1))
+      return self.output
+
+#===============================================================================
+# Vectorized transformations of the vertices selected by an index array.
+#===============================================================================
+
+def move_vertices(frame, indices, dx, dy):
+   frame[indices] += (dx, dy)
+
+def rotate_vertices(frame, indices, origin, angle):
+   sina = math.sin(angle)
+   cosa = math.cos(angle)
+   rotation = np.array(((cosa, sina), (-sina, cosa)))
+   frame[indices] = origin + (frame[indices] - origin).dot(rotation)
+
+def scale_vertices(frame, indices, origin, factor, axis = None):
+   if axis is None:
+      frame[indices] = origin + (frame[indices] - origin) * factor
+   else:
+      frame[indices, axis] = origin[axis] + (frame[indices, axis] - origin[axis]) * factor
+
+def flip_vertices(frame, indices, axis):
+   if len(indices) > 0:
+      coords = frame[indices, axis]
+      center = (coords.min() + coords.max()) * 0.5
+      frame[indices, axis] = 2.0 * center - coords
+
+def copy_vertices(frame, source_frame, indices):
+   frame[indices] = source_frame[indices]
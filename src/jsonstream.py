@@ -0,0 +1,157 @@
+
+import codecs, json, os, re
+import numpy as np
+
+from src.frames import *
+
+CHUNK_SIZE = 1 << 20
+
+_WHITESPACE  = re.compile(r'\s*')
+_END_OF_ROWS = re.compile(r'\]\s*\]')
+
+#===============================================================================
+# Incremental reading of model files in JSON format. The file is read in chunks
+# and large arrays are parsed a chunk at a time, straight into their final form,
+# so that neither the whole file, nor the whole parsed document is in memory at
+# once. The progress callback is called after every chunk with the number of
+# bytes read and the file size, and it can raise an exception to cancel loading.
+#===============================================================================
+
+class JsonStream:
+
+   def __init__(self, f, size, progress = None):
+      self.f = f
+      self.size = size
+      self.progress = progress
+      self.decoder = codecs.getincrementaldecoder('utf-8')()
+      self.raw_decode = json.JSONDecoder().raw_decode
+      self.buf = ''
+      self.pos = 0
+      self.nread = 0
+      self.eof = False
+
+   def fill(self, size = 0):
+      # Appends the next chunk of the file to the unparsed part of the buffer. Returns False at the end of file.
+      if self.eof:
+         return False
+      data = self.f.read(max(size, CHUNK_SIZE))
+      self.nread += len(data)
+      self.eof = not data
+      self.buf = self.buf[self.pos:] + self.decoder.decode(data, final = self.eof)
+      self.pos = 0
+      if self.progress is not None:
+         self.progress(self.nread, self.size)
+      return True
+
+   def peek(self):
+      # Returns the next character which is not whitespace, without consuming it.
+      while True:
+         self.pos = _WHITESPACE.match(self.buf, self.pos).end()
+         if self.pos < len(self.buf):
+            return self.buf[self.pos]
+         if not self.fill():
+            raise ValueError('Unexpected end of file')
+
+   def expect(self, char):
+      if self.peek() != char:
+         raise ValueError('Expected {} at byte {}'.format(char, self.nread))
+      self.pos += 1
+
+   def next_item(self, end):
+      # Consumes the separator after an item of an array or object, returns False if it was the last item.
+      char = self.peek()
+      if char not in (',', end):
+         raise ValueError('Expected , or {} at byte {}'.format(end, self.nread))
+      self.pos += 1
+      return char == ','
+
+   def read_value(self):
+      # Value has to be in the buffer entirely, and followed by something, since a number at the end of
+      # the buffer may continue in the next chunk. Buffer grows exponentially for values spanning many chunks.
+      self.peek()
+      while True:
+         try:
+            value, end = self.raw_decode(self.buf, self.pos)
+         except ValueError:
+            end = None
+         if ((end is not None) and (end < len(self.buf))) or not self.fill(len(self.buf)):
+            break
+      if end is None:
+         raise ValueError('Invalid value at byte {}'.format(self.nread))
+      self.pos = end
+      return value
+
+   def read_array(self, read_item):
+      self.expect('[')
+      if self.peek() == ']':
+         self.pos += 1
+         return
+      read_item()
+      while self.next_item(']'):
+         read_item()
+
+   def read_object(self, read_member):
+      self.expect('{')
+      if self.peek() == '}':
+         self.pos += 1
+         return
+      while True:
+         key = self.read_value()
+         self.expect(':')
+         read_member(key)
+         if not self.next_item('}'):
+            break
+
+   def read_rows(self, add_rows):
+      # Reads an array of arrays of numbers. All the complete rows in the buffer are parsed at once by
+      # json.loads, and passed to the callback, which stores them.
+      self.expect('[')
+      if self.peek() == ']':
+         self.pos += 1
+         return
+      while True:
+         match = _END_OF_ROWS.search(self.buf, self.pos)
+         end = (match.start() if match else self.buf.rfind(']', self.pos)) + 1
+         if end > self.pos:
+            add_rows(json.loads('[' + self.buf[self.pos:end] + ']'))
+            self.pos = end
+            if not self.next_item(']'):
+               return
+         elif not self.fill():
+            raise ValueError('Unexpected end of file')
+
+#===============================================================================
+
+def read_json_model(path, progress = None):
+   # Returns the same data as json.load, except for frames being arrays, and colors and texcoords tuples.
+   data = {}
+
+   def read_frame():
+      chunks = []
+      stream.read_rows(lambda rows: chunks.append(create_frame(rows)))
+      return np.concatenate(chunks) if chunks else create_frame()
+
+   def read_anim(name):
+      frames = data['vertices'][name] = []
+      stream.read_array(lambda: frames.append(read_frame()))
+
+   def read_member(key):
+      char = stream.peek()
+      if key == 'vertices' and char == '{':
+         data[key] = {}
+         stream.read_object(read_anim)
+      elif key == 'vertices' and char == '[':
+         data[key] = read_frame()
+      elif key in ('colors', 'texcoords') and char == '[':
+         table = data[key] = []
+         stream.read_rows(lambda rows: table.extend(tuple(row) for row in rows))
+      elif key == 'polygons' and char == '[':
+         table = data[key] = []
+         stream.read_rows(table.extend)
+      else:
+         data[key] = stream.read_value()
+
+   with open(path, 'rb') as f:
+      stream = JsonStream(f, os.path.getsize(path), progress)
+      stream.read_object(read_member)
+   return data
@@ -0,0 +1,957 @@
+
+import bisect, io, itertools, json
+from collections import OrderedDict
+import numpy as np
+
+from src.binary import *
+from src.btree import *
+from src.frames import *
+from src.jsonstream import *
+from src.spatial import *
+
+INIT_COLOR  = (1.0, 1.0, 1.0, 1.0)
+UNDO_MEMORY = 64 * 1024 * 1024
+
+ENTITY_POINT  = 'point'
+ENTITY_EDGE   = 'edge'
+ENTITY_RECT   = 'rectangle'
+ENTITY_CIRCLE = 'circle'
+
+#===============================================================================
+
+class RecoverableError(Exception):
+   pass
+
+def write_json(f, obj, indent = 1, precision = None):
+   # Writes the object straight into the file, with keys sorted, and tuples as arrays on a single line.
+   # Indented output is the same as from json.dumps, no indent means compact output without any whitespace.
+   # Floats are rounded to the given number of decimal places, if any.
+   write = f.write
+   step = None if (indent is None) else ' ' * indent
+   key_sep, tuple_sep = (':', ',') if (step is None) else (': ', ', ')
+
+   def format_inline(val):
+      if isinstance(val, float):
+         return repr(val if (precision is None) else round(val, precision))
+      elif isinstance(val, tuple):
+         return '[' + tuple_sep.join(format_inline(v) for v in val) + ']'
+      elif isinstance(val, int) and not isinstance(val, bool):
+         return repr(val)
+      else:
+         return json.dumps(val)
+
+   def write_value(val, newline):
+      if isinstance(val, (dict, list)) and val:
+         inner = newline if (step is None) else newline + step
+         if isinstance(val, dict):
+            write('{')
+            for ix, key in enumerate(sorted(val)):
+               write((',' if ix else '') + inner + json.dumps(key if isinstance(key, str) else str(key)) + key_sep)
+               write_value(val[key], inner)
+            write(newline + '}')
+         else:
+            write('[')
+            for ix, item in enumerate(val):
+               write(',' + inner if ix else inner)
+               write_value(item, inner)
+            write(newline + ']')
+      elif isinstance(val, dict):
+         write('{}')
+      elif isinstance(val, list):
+         write('[]')
+      else:
+         write(format_inline(val))
+
+   write_value(obj, '' if (step is None) else '\n')
+
+def dump_json(obj, indent = 1, precision = None):
+   f = io.StringIO()
+   write_json(f, obj, indent, precision)
+   return f.getvalue()
+
+def load_model_file(path, progress = None):
+   if is_binary_model_path(path):
+      return read_binary_model(path)
+   return read_json_model(path, progress)
+
+#===============================================================================
+
+class Selection:
+
+   def __init__(self, indices = ()):
+      self.items = OrderedDict.fromkeys(indices)
+      self.array = None
+
+   def __len__(self):
+      return len(self.items)
+
+   def __iter__(self):
+      return iter(self.items)
+
+   def __contains__(self, index):
+      return (index in self.items)
+
+   def last(self):
+      return next(reversed(self.items))
+
+   def indices(self):
+      # Index array for vectorized operations, kept until the selection changes.
+      if self.array is None:
+         self.array = index_array(self.items)
+      return self.array
+
+   def clear(self):
+      self.items.clear()
+      self.array = None
+
+   def add(self, indices):
+      self.items.update(OrderedDict.fromkeys(indices))
+      self.array = None
+
+   def toggle(self, indices):
+      indices = OrderedDict.fromkeys(indices)
+      for index in [index for index in indices if index in self.items]:
+         del self.items[index]
+         del indices[index]
+      self.items.update(indices)
+      self.array = None
+
+#===============================================================================
+
+class VertexAdjacency:
+
+   def __init__(self):
+      self.polygons = {} # Vertex index => polygons referencing the vertex, by identity.
+      self.entities = {} # Vertex index => number of references from entities.
+
+   def rebuild(self, polygons, entities):
+      self.polygons = {}
+      self.entities = {}
+      for poly in polygons:
+         if poly:
+            self.add_polygon_vertices(poly, poly)
+      for ent in entities:
+         if ent:
+            self.add_entity_vertices(ent[2:])
+
+   def add_polygon_vertices(self, poly, indices):
+      for index in indices:
+         self.polygons.setdefault(index, OrderedDict())[id(poly)] = poly
+
+   def remove_polygon(self, poly):
+      for index in set(poly):
+         refs = self.polygons[index]
+         del refs[id(poly)]
+         if not refs:
+            del self.polygons[index]
+
+   def add_entity_vertices(self, indices):
+      for index in indices:
+         self.entities[index] = self.entities.get(index, 0) + 1
+
+   def remove_entity_vertices(self, indices):
+      for index in indices:
+         self.entities[index] -= 1
+         if self.entities[index] == 0:
+            del self.entities[index]
+
+   def polygons_with_vertex(self, index):
+      return list(self.polygons.get(index, {}).values())
+
+   def vertex_unused(self, index):
+      return (index not in self.polygons) and (index not in self.entities)
+
+#===============================================================================
+
+def estimate_size(obj):
+   if isinstance(obj, np.ndarray):
+      return obj.nbytes
+   elif isinstance(obj, dict):
+      return sum(estimate_size(value) for value in obj.values())
+   elif isinstance(obj, (list, tuple)):
+      return 8 * len(obj) + sum(estimate_size(item) for item in obj if isinstance(item, (np.ndarray, dict, list, tuple)))
+   else:
+      return 0
+
+#===============================================================================
+# Undo history made of transactions, each one being a list of changes recorded
+# after a restore point. Undoing a transaction reverts its changes, which gives
+# the changes needed to redo it. Oldest transactions are dropped once the
+# history takes more memory than allowed.
+#===============================================================================
+
+class UndoTransaction:
+
+   def __init__(self, state, changes):
+      self.state = state
+      self.changes = changes
+      self.size = sum(estimate_size(change) for change in changes)
+
+class UndoJournal:
+
+   def __init__(self, max_size):
+      self.max_size = max_size
+      self.reset()
+
+   def add(self, state):
+      self.discard_future()
+      self.history.append(UndoTransaction(state, []))
+
+   def record(self, change):
+      # Changes made before the first restore point cannot be undone.
+      self.discard_future()
+      if self.history:
+         size = estimate_size(change)
+         self.history[-1].changes.append(change)
+         self.history[-1].size += size
+         self.total_size += size
+         self.trim()
+
+   def trim(self):
+      while self.total_size > self.max_size and len(self.history) > 1:
+         self.total_size -= self.history.pop(0).size
+
+   def move(self, source, target, revert_change_fun, state):
+      if not source:
+         return None
+      transaction = source.pop()
+      inverse = UndoTransaction(state, [revert_change_fun(change) for change in reversed(transaction.changes)])
+      target.append(inverse)
+      self.total_size += (inverse.size - transaction.size)
+      self.trim()
+      return transaction.state
+
+   def undo(self, revert_change_fun, state):
+      return self.move(self.history, self.future, revert_change_fun, state)
+
+   def redo(self, revert_change_fun, state):
+      return self.move(self.future, self.history, revert_change_fun, state)
+
+   def discard_future(self):
+      self.total_size -= sum(transaction.size for transaction in self.future)
+      self.future = []
+
+   def reset(self):
+      self.history = []
+      self.future = []
+      self.total_size = 0
+
+#===============================================================================
+# Model tables and edit operations, independent of any user interface. Vertex
+# tables of the current frame are also kept as vertices. The last polygon and
+# entity are the ones being created, or None. Each edit operation sets a restore
+# point first, so that it can be undone as a whole. Revision is incremented on
+# every change, so that views can tell when their cached data is out of date.
+#===============================================================================
+
+class Model:
+
+   def __init__(self):
+      self.undo_journal = UndoJournal(UNDO_MEMORY)
+      self.vertex_grid = VertexGrid()
+      self.revision = 0
+      self.reset()
+
+   def reset(self):
+      self.undo_journal.reset()
+      self.selected = Selection()
+      self.selection_groups = [[] for ix in range(10)]
+      self.anim_name = ''
+      self.cur_frame = 0
+      self.entities = [None]
+      self.polygons = [None]
+      self.colors = []
+      self.texcoords = []
+      self.adjacency = VertexAdjacency()
+      self.vertices_anim = {self.anim_name: [create_frame()]}
+      self.vertices = self.vertices_anim[self.anim_name][self.cur_frame]
+      self.revision += 1
+
+   #============================================================================
+   # Loading and saving.
+   #============================================================================
+
+   def load_model(self, data):
+
+      def get_entity(ent):
+         try:
+            return [ent['kind'], ent['name']] + list(ent['value'])
+         except TypeError:
+            return [ent['kind'], ent['name'], ent['value']]
+
+      self.reset()
+      if 'polygons' in data:
+         if isinstance(data['polygons'], dict):
+            self.polygons = get_polygons_from_btree(data['polygons']) + self.polygons
+         elif isinstance(data['polygons'], list):
+            self.polygons = [list(poly) for poly in data['polygons']] + self.polygons
+      if 'entities' in data:
+         if isinstance(data['entities'], dict):
+            self.entities = get_entities_from_btree(data['entities']) + self.entities
+         elif isinstance(data['entities'], list):
+            self.entities = [get_entity(ent) for ent in data['entities']] + self.entities
+      if '!entities' in data:
+         self.entities = [get_entity(ent) for ent in data['!entities']] + self.entities
+      if 'vertices' in data:
+         if isinstance(data['vertices'], dict):
+            self.vertices_anim = data['vertices']
+            for frames in self.vertices_anim.values():
+               for ix in range(len(frames)):
+                  frames[ix] = create_frame(frames[ix])
+            self.anim_name = sorted(self.vertices_anim.keys())[0]
+            self.vertices = self.vertices_anim[self.anim_name][self.cur_frame]
+         elif isinstance(data['vertices'], (list, np.ndarray)):
+            self.vertices = create_frame(data['vertices'])
+            self.vertices_anim[self.anim_name][self.cur_frame] = self.vertices
+      if 'colors' in data:
+         self.colors = [tuple(c) for c in data['colors']]
+      else:
+         self.colors = [INIT_COLOR] * len(self.vertices)
+      if 'texcoords' in data:
+         self.texcoords = [tuple(t) for t in data['texcoords']]
+      else:
+         self.texcoords = [(0,0)] * len(self.vertices)
+      self.adjacency.rebuild(self.polygons, self.entities)
+      self.revision += 1
+
+   def get_complete_polygons(self):
+      return [poly for poly in self.polygons if (poly and len(poly)>=3)]
+
+   def get_complete_entities(self):
+      return [ent for ent in self.entities if (ent and len(ent)>=3 and (ent[0]==ENTITY_POINT or len(ent)>=4))]
+
+   def save_entities(self, entities):
+      return [{
+         'kind': ent[0],
+         'name': ent[1],
+         'value': tuple(ent[2:]) if (len(ent) > 3) else ent[2]
+         } for ent in entities]
+
+   def save_cleanup(self, data):
+      if data['polygons'] is None or len(data['polygons']) == 0:
+         del data['polygons']
+      if data['entities'] is None or len(data['entities']) == 0:
+         del data['entities']
+      if '!entities' in data and len(data['!entities']) == 0:
+         del data['!entities']
+      if data['colors'].count(INIT_COLOR) == len(data['colors']):
+         del data['colors']
+      if data['texcoords'].count((0,0)) == len(data['texcoords']):
+         del data['texcoords']
+      if len(data['vertices']) == 0:
+         del data['vertices']
+      return data
+
+   def save_model(self):
+      return self.save_cleanup({
+         'polygons':  [tuple(poly) for poly in self.get_complete_polygons()],
+         'entities':  self.save_entities(self.get_complete_entities()),
+         'colors':    self.colors,
+         'texcoords': self.texcoords,
+         'vertices':  {name: [frame_to_tuples(frame) for frame in frames] for name, frames in self.vertices_anim.items()}})
+
+   def export_btree(self, split = 'sah', layout = 'nested'):
+      # Entities with names starting with '!' are not put into the tree, but are kept in a flat array.
+      entities_all  = self.get_complete_entities()
+      entities_tree = [ent for ent in entities_all if not ent[1].startswith('!')]
+      entities_flat = [ent for ent in entities_all if     ent[1].startswith('!')]
+      vertices = frame_to_tuples(self.vertices)
+      polygons = create_btree(create_btree_leaves_from_polygons(self.get_complete_polygons(), self.vertices), split)
+      entities = create_btree(create_btree_leaves_from_entities(entities_tree, self.vertices), split)
+      if layout == 'flat':
+         polygons = flatten_btree(polygons, ('order', 'value'))
+         entities = flatten_btree(entities, ('kind', 'name', 'value'))
+      return self.save_cleanup({
+         'polygons':  polygons,
+         'entities':  entities,
+         '!entities': self.save_entities(entities_flat),
+         'colors':    self.colors,
+         'texcoords': self.texcoords,
+         'vertices':  vertices})
+
+   def copy_mapped_frames(self, path):
+      # Frames loaded from a binary file are views of it, also when kept in the undo history. Copies stay
+      # read-only, so that frames shared between animations are still copied when modified.
+      copies = {}
+
+      def copy_frames(obj):
+         if isinstance(obj, np.ndarray):
+            if is_mapped_from(obj, path):
+               if id(obj) not in copies:
+                  copies[id(obj)] = share_frame(np.array(obj))
+               return copies[id(obj)]
+         elif isinstance(obj, list):
+            for ix, item in enumerate(obj):
+               obj[ix] = copy_frames(item)
+         elif isinstance(obj, dict):
+            for key, item in obj.items():
+               obj[key] = copy_frames(item)
+         elif isinstance(obj, tuple):
+            items = tuple(copy_frames(item) for item in obj)
+            if any((item is not old_item) for (item, old_item) in zip(items, obj)):
+               return items
+         return obj
+
+      copy_frames(self.vertices_anim)
+      self.vertices = copy_frames(self.vertices)
+      for transaction in (self.undo_journal.history + self.undo_journal.future):
+         copy_frames(transaction.changes)
+      if self.vertex_grid.vertices is not self.vertices:
+         self.vertex_grid = VertexGrid()
+      self.revision += 1
+
+   #============================================================================
+   # Undo and redo.
+   #============================================================================
+
+   def get_edit_state(self):
+      return (self.anim_name, self.cur_frame, list(self.selected))
+
+   def set_edit_state(self, state):
+      self.anim_name, self.cur_frame, selected = state
+      self.selected = Selection(selected)
+      self.vertices = self.vertices_anim[self.anim_name][int(self.cur_frame)]
+
+   def get_vertex_rows(self, selector):
+      # Selector is either a slice or a boolean mask.
+      if isinstance(selector, slice):
+         colors = self.colors[selector]
+         texcoords = self.texcoords[selector]
+      else:
+         colors = list(itertools.compress(self.colors, selector.tolist()))
+         texcoords = list(itertools.compress(self.texcoords, selector.tolist()))
+      frames = {name: [frame[selector].copy() for frame in frame_table] for name, frame_table in self.vertices_anim.items()}
+      return (frames, colors, texcoords)
+
+   def set_vertex_tail(self, start, rows):
+      frames, colors, texcoords = rows
+      for name, frame_table in self.vertices_anim.items():
+         for ix, frame in enumerate(frame_table):
+            frame_table[ix] = np.concatenate((frame[:start], frames[name][ix]))
+      self.colors[start:] = colors
+      self.texcoords[start:] = texcoords
+
+   def compact_vertex_tables(self, keep):
+      keep_list = keep.tolist()
+      self.colors = list(itertools.compress(self.colors, keep_list))
+      self.texcoords = list(itertools.compress(self.texcoords, keep_list))
+      for frame_table in self.vertices_anim.values():
+         for ix, frame in enumerate(frame_table):
+            frame_table[ix] = frame[keep]
+
+   def expand_vertex_tables(self, keep, rows):
+      frames, colors, texcoords = rows
+
+      def merge(kept, removed):
+         kept = iter(kept)
+         removed = iter(removed)
+         return [next(kept) if is_kept else next(removed) for is_kept in keep_list]
+
+      keep_list = keep.tolist()
+      self.colors = merge(self.colors, colors)
+      self.texcoords = merge(self.texcoords, texcoords)
+      for name, frame_table in self.vertices_anim.items():
+         for ix, frame in enumerate(frame_table):
+            expanded = np.empty((len(keep), 2))
+            expanded[keep] = frame
+            expanded[~keep] = frames[name][ix]
+            frame_table[ix] = expanded
+
+   # Changes are recorded before being made, so that they can be reverted. Polygons and entities
+   # are never modified in place, hence the journal only needs to keep references to them.
+
+   def record_change(self, change):
+      self.revision += 1
+      self.undo_journal.record(change)
+
+   def save_vertices(self, indices):
+      # Vertices are saved right before being modified, so this is where a shared frame gets copied.
+      frame_ix = int(self.cur_frame)
+      self.vertices = get_writable_frame(self.vertices_anim[self.anim_name], frame_ix)
+      self.record_change(('vertices', self.anim_name, frame_ix, indices, self.vertices[indices]))
+
+   def save_dragged_vertices(self, indices, saved):
+      # Saves the vertices not saved before during the same drag, starting a restore point on first call.
+      # Returns the updated set of saved vertices, to be passed to the next call.
+      if saved is None:
+         self.restore_point()
+         saved = set()
+      indices = [ix for ix in indices if ix not in saved]
+      if indices:
+         self.save_vertices(indices)
+         saved.update(indices)
+      return saved
+
+   def save_attributes(self, table_name, indices):
+      table = getattr(self, table_name)
+      self.record_change((table_name, indices, [table[ix] for ix in indices]))
+
+   def save_vertex_tail(self, start):
+      self.record_change(('vertex_tail', start, self.get_vertex_rows(slice(start, None))))
+
+   def save_primitives(self, table_name, start):
+      self.record_change((table_name, start, getattr(self, table_name)[start:]))
+
+   def revert_change(self, change):
+      self.revision += 1
+      kind = change[0]
+      if kind == 'vertices':
+         kind, anim_name, frame_ix, indices, positions = change
+         frame = get_writable_frame(self.vertices_anim[anim_name], frame_ix)
+         inverse = (kind, anim_name, frame_ix, indices, frame[indices])
+         frame[indices] = positions
+         self.update_vertex_caches(frame, indices)
+      elif kind in ('colors', 'texcoords'):
+         kind, indices, values = change
+         table = getattr(self, kind)
+         inverse = (kind, indices, [table[ix] for ix in indices])
+         for ix, value in zip(indices, values):
+            table[ix] = value
+      elif kind == 'vertex_tail':
+         kind, start, rows = change
+         inverse = (kind, start, self.get_vertex_rows(slice(start, None)))
+         self.set_vertex_tail(start, rows)
+      elif kind == 'polygons':
+         kind, start, polygons = change
+         inverse = (kind, start, self.polygons[start:])
+         for poly in inverse[2]:
+            if poly:
+               self.adjacency.remove_polygon(poly)
+         self.polygons[start:] = polygons
+         for poly in polygons:
+            if poly:
+               self.adjacency.add_polygon_vertices(poly, poly)
+      elif kind == 'entities':
+         kind, start, entities = change
+         inverse = (kind, start, self.entities[start:])
+         for ent in inverse[2]:
+            if ent:
+               self.adjacency.remove_entity_vertices(ent[2:])
+         self.entities[start:] = entities
+         for ent in entities:
+            if ent:
+               self.adjacency.add_entity_vertices(ent[2:])
+      elif kind == 'group':
+         kind, group_ix, group = change
+         inverse = (kind, group_ix, self.selection_groups[group_ix])
+         self.selection_groups[group_ix] = group
+      elif kind == 'frame':
+         # Frame is None when it has to be deleted, otherwise it has to be inserted.
+         kind, anim_name, frame_ix, frame = change
+         frame_table = self.vertices_anim[anim_name]
+         if frame is None:
+            inverse = (kind, anim_name, frame_ix, frame_table.pop(frame_ix))
+         else:
+            inverse = (kind, anim_name, frame_ix, None)
+            frame_table.insert(frame_ix, frame)
+      elif kind == 'anim':
+         # Frame table is None when the animation has to be deleted, otherwise it has to be added.
+         kind, anim_name, frame_table = change
+         if frame_table is None:
+            inverse = (kind, anim_name, self.vertices_anim.pop(anim_name))
+         else:
+            inverse = (kind, anim_name, None)
+            self.vertices_anim[anim_name] = frame_table
+      elif kind == 'compaction':
+         # Removed rows are None when the vertices have to be deleted, otherwise they have to be restored.
+         kind, keep, rows, polygons, entities, groups = change
+         if rows is None:
+            inverse = (kind, keep, self.get_vertex_rows(~keep), self.polygons, self.entities, self.selection_groups)
+            self.compact_vertex_tables(keep)
+         else:
+            inverse = (kind, keep, None, self.polygons, self.entities, self.selection_groups)
+            self.expand_vertex_tables(keep, rows)
+         self.polygons = list(polygons)
+         self.entities = list(entities)
+         self.selection_groups = list(groups)
+         self.adjacency.rebuild(self.polygons, self.entities)
+      return inverse
+
+   def restore_point(self):
+      self.undo_journal.add(self.get_edit_state())
+
+   def undo_or_redo(self, redo):
+      if redo:
+         state = self.undo_journal.redo(self.revert_change, self.get_edit_state())
+      else:
+         state = self.undo_journal.undo(self.revert_change, self.get_edit_state())
+      if state:
+         self.set_edit_state(state)
+
+   #============================================================================
+   # Auxiliary functions.
+   #============================================================================
+
+   def update_vertex_caches(self, vertices, indices):
+      # Called after the vertices have been moved in place.
+      self.vertex_grid.update(vertices, indices)
+
+   def get_vertex_grid(self):
+      if self.vertex_grid.vertices is not self.vertices:
+         self.vertex_grid.rebuild(self.vertices)
+      return self.vertex_grid
+
+   def polygon_selected(self, poly):
+
+      def all_vertices_selected(poly):
+         for vix in poly:
+            if vix not in self.selected:
+               return False
+         return True
+
+      return (poly and all_vertices_selected(poly))
+
+   def vertex_unused(self, index):
+      return self.adjacency.vertex_unused(index)
+
+   def new_selected(self, vertex_indices, invert):
+      if invert:
+         self.selected.toggle(vertex_indices)
+      else:
+         self.selected.add(vertex_indices)
+
+   def foreach_vertex_table(self, fun, arg):
+      # Vertex tables are arrays which cannot be resized in place, so each one is replaced.
+      for frame_table in self.vertices_anim.values():
+         for ix, vertex_table in enumerate(frame_table):
+            frame_table[ix] = fun(vertex_table, arg)
+      self.vertices = self.vertices_anim[self.anim_name][int(self.cur_frame)]
+
+   def num_triangles(self):
+      cnt = 0
+      for poly in self.polygons:
+         if poly:
+            cnt += (len(poly) // 3)
+      return cnt
+
+   def num_polygons(self):
+      cnt = len(self.polygons)
+      return ((cnt-1) if (self.polygons[-1] is None) else cnt)
+
+   def prev_anim(self, anim_name):
+      anim_names = sorted(self.vertices_anim.keys())
+      for n in reversed(anim_names):
+         if n < anim_name:
+            return n
+      return anim_names[-1]
+
+   def next_anim(self, anim_name):
+      anim_names = sorted(self.vertices_anim.keys())
+      for n in anim_names:
+         if n > anim_name:
+            return n
+      return anim_names[0]
+
+   #============================================================================
+   # Polygons and entities.
+   #============================================================================
+
+   def new_entity(self, ent_type, ent_name):
+      if self.entities[-1] is None:
+         self.restore_point()
+         self.save_primitives('entities', len(self.entities)-1)
+         self.entities[-1] = [ent_type, ent_name]
+
+   def insert_vertex(self, vertex_ix, position, color):
+      # Adds the vertex to the entity or polygon being created. A new vertex is created
+      # at the given position if the index is negative.
+      self.restore_point()
+      if vertex_ix < 0:
+         vertex_ix = len(self.vertices)
+         self.save_vertex_tail(vertex_ix)
+         self.foreach_vertex_table(append_to_frame, [position])
+         self.colors.append(color)
+         self.texcoords.append((0,0))
+      ent = self.entities[-1]
+      if ent and ent[0] == ENTITY_POINT and len(ent) < 3:
+         self.save_primitives('entities', len(self.entities)-1)
+         self.entities[-1] = ent = ent + [vertex_ix]
+         self.adjacency.add_entity_vertices([vertex_ix])
+         self.entities.append(None)
+         self.new_entity(ent[0], ent[1])
+      elif ent and ent[0] in (ENTITY_EDGE, ENTITY_RECT, ENTITY_CIRCLE) and len(ent) < 4:
+         self.save_primitives('entities', len(self.entities)-1)
+         self.entities[-1] = ent = ent + [vertex_ix]
+         self.adjacency.add_entity_vertices([vertex_ix])
+         if len(ent) == 4:
+            self.entities.append(None)
+            self.new_entity(ent[0], ent[1])
+      elif self.polygons[-1]:
+         poly = self.polygons[-1]
+         self.save_primitives('polygons', len(self.polygons)-1)
+         self.polygons[-1] = (poly + poly[-2:] + [vertex_ix]) if (len(poly) >= 3) else (poly + [vertex_ix])
+         self.adjacency.remove_polygon(poly)
+         self.adjacency.add_polygon_vertices(self.polygons[-1], self.polygons[-1])
+      else:
+         self.save_primitives('polygons', len(self.polygons)-1)
+         self.polygons[-1] = [vertex_ix]
+         self.adjacency.add_polygon_vertices(self.polygons[-1], [vertex_ix])
+
+   def reset_entity_or_polygon_creation(self):
+      if self.entities[-1] or self.polygons[-1]:
+         self.restore_point()
+      if self.entities[-1]:
+         indices = self.entities[-1][2:]
+         self.save_primitives('entities', len(self.entities)-1)
+         self.entities[-1] = None
+         self.adjacency.remove_entity_vertices(indices)
+         self.delete_unused_vertices(indices)
+      if self.polygons[-1]:
+         indices = self.polygons[-1]
+         self.save_primitives('polygons', len(self.polygons)-1)
+         if len(indices) < 3:
+            self.polygons[-1] = None
+            self.adjacency.remove_polygon(indices)
+            self.delete_unused_vertices(indices)
+         else:
+            self.polygons.append(None)
+
+   def delete_unused_vertices(self, indices):
+      # Vertices created for the entity or polygon being created are normally the last ones, and are cut off.
+      # Undo can bring back one being created after other vertices were added, then the tables are compacted.
+      indices = sorted(ix for ix in set(indices) if self.vertex_unused(ix))
+      if not indices:
+         return
+      if indices[0] == len(self.vertices) - len(indices):
+         self.save_vertex_tail(indices[0])
+         for ix in reversed(indices):
+            self.foreach_vertex_table(delete_from_frame, ix)
+            del self.colors[ix]
+            del self.texcoords[ix]
+      else:
+         self.delete_vertices(indices)
+      deleted = set(indices)
+      self.selected = Selection(ix - bisect.bisect_left(indices, ix) for ix in self.selected if ix not in deleted)
+
+   def delete_vertices(self, indices):
+      # Deletes the vertices along with triangles and entities using them, and then the vertices
+      # no longer used by anything. All tables are compacted in a single pass over a keep-mask.
+      keep = np.ones(len(self.vertices), dtype = bool)
+      keep[index_array(indices)] = False
+      keep_list = keep.tolist()
+      orphans = []
+
+      def filter_polygon(poly):
+         if (not poly) or ((len(poly) % 3) == 0 and all(map(keep_list.__getitem__, poly))):
+            return poly
+         indices_new = []
+         for ix in range(0, len(poly), 3):
+            triple = poly[ix:ix+3]
+            if (len(triple) == 3) and keep_list[triple[0]] and keep_list[triple[1]] and keep_list[triple[2]]:
+               indices_new += triple
+            else:
+               orphans.extend(triple)
+         return indices_new
+
+      def filter_entity(ent):
+         if (not ent) or all(map(keep_list.__getitem__, ent[2:])):
+            return ent
+         orphans.extend(ent[2:])
+         return None
+
+      # The last polygon and entity are the ones being created, they are replaced by None if deleted.
+      polygons = [poly for poly in map(filter_polygon, self.polygons[:-1]) if poly]
+      polygons.append(filter_polygon(self.polygons[-1]) or None)
+      entities = [ent for ent in map(filter_entity, self.entities[:-1]) if ent]
+      entities.append(filter_entity(self.entities[-1]))
+      if orphans:
+         used = np.zeros(len(self.vertices), dtype = bool)
+         used[np.fromiter(itertools.chain(itertools.chain.from_iterable(poly for poly in polygons if poly),
+            itertools.chain.from_iterable(ent[2:] for ent in entities if ent)), dtype = np.intp)] = True
+         orphans = index_array(orphans)
+         keep[orphans[~used[orphans]]] = False
+         keep_list = keep.tolist()
+      self.record_change(('compaction', keep, self.get_vertex_rows(~keep), self.polygons, self.entities, self.selection_groups))
+      index_map = (np.cumsum(keep) - 1).tolist()
+      self.polygons = [[index_map[ix] for ix in poly] if poly else poly for poly in polygons]
+      self.entities = [(ent[:2] + [index_map[ix] for ix in ent[2:]]) if ent else ent for ent in entities]
+      self.selection_groups = [[index_map[ix] for ix in group if keep_list[ix]] for group in self.selection_groups]
+      self.compact_vertex_tables(keep)
+      self.vertices = self.vertices_anim[self.anim_name][int(self.cur_frame)]
+      self.adjacency.rebuild(self.polygons, self.entities)
+
+   def delete_selected(self, whole_polygons_only):
+      self.restore_point()
+      if whole_polygons_only:
+         self.save_primitives('polygons', 0)
+         deleted = [bool(self.polygon_selected(poly)) for poly in self.polygons]
+         polygons_deleted = list(itertools.compress(self.polygons, deleted))
+         self.polygons = [poly for poly, is_deleted in zip(self.polygons, deleted) if not is_deleted]
+         if deleted[-1]:
+            self.polygons.append(None)
+         for poly in polygons_deleted:
+            self.adjacency.remove_polygon(poly)
+         indices = [ix for ix in set(itertools.chain.from_iterable(polygons_deleted)) if self.vertex_unused(ix)]
+      else:
+         indices = list(self.selected)
+      self.selected.clear()
+      if indices:
+         self.delete_vertices(indices)
+
+   def iterate_over_polygons(self):
+      if self.num_polygons() > 0:
+         selected_polygon_indices = [ix for ix, poly in enumerate(self.polygons) if self.polygon_selected(poly)]
+         poly_ix = ((selected_polygon_indices[-1] + 1) % self.num_polygons()) if selected_polygon_indices else 0
+         self.selected = Selection(self.polygons[poly_ix])
+
+   def duplicate_polygons(self, dx, dy):
+      self.restore_point()
+      polygons = [poly for poly in self.polygons if self.polygon_selected(poly)]
+      if polygons:
+         self.save_vertex_tail(len(self.vertices))
+         self.save_primitives('polygons', len(self.polygons)-1)
+         index_map = {}
+         source_indices = []
+         for poly in polygons:
+            for ix in poly:
+               if ix not in index_map:
+                  index_map[ix] = len(self.vertices) + len(source_indices)
+                  source_indices.append(ix)
+                  self.colors.append(self.colors[ix])
+                  self.texcoords.append(self.texcoords[ix])
+         new_vertices = self.vertices[index_array(source_indices)] + (dx, dy)
+         self.foreach_vertex_table(append_to_frame, new_vertices)
+         new_polygons = [[index_map[ix] for ix in poly] for poly in polygons]
+         self.polygons = self.polygons[:-1] + new_polygons + self.polygons[-1:]
+         for poly in new_polygons:
+            self.adjacency.add_polygon_vertices(poly, poly)
+         self.selected = Selection(index_map[ix] for ix in source_indices)
+
+   def raise_selected_polygons(self):
+      self.restore_point()
+      self.save_primitives('polygons', 0)
+      new_polygons = [[],[]]
+      for poly in self.polygons:
+         if self.polygon_selected(poly) or (poly is None):
+            new_polygons[1].append(poly)
+         else:
+            new_polygons[0].append(poly)
+      self.polygons = new_polygons[0] + new_polygons[1]
+
+   def lower_selected_polygons(self):
+      self.restore_point()
+      self.save_primitives('polygons', 0)
+      new_polygons = [[],[]]
+      for poly in self.polygons:
+         if self.polygon_selected(poly):
+            new_polygons[0].append(poly)
+         else:
+            new_polygons[1].append(poly)
+      self.polygons = new_polygons[0] + new_polygons[1]
+
+   #============================================================================
+   # Vertices.
+   #============================================================================
+
+   def flipx_selected_vertices(self):
+      self.restore_point()
+      indices = self.selected.indices()
+      self.save_vertices(indices)
+      flip_vertices(self.vertices, indices, 0)
+      self.update_vertex_caches(self.vertices, indices)
+
+   def flipy_selected_vertices(self):
+      self.restore_point()
+      indices = self.selected.indices()
+      self.save_vertices(indices)
+      flip_vertices(self.vertices, indices, 1)
+      self.update_vertex_caches(self.vertices, indices)
+
+   def set_selected_color(self, color):
+      if len(self.selected) > 0:
+         self.restore_point()
+         self.save_attributes('colors', list(self.selected))
+         for ix in self.selected:
+            self.colors[ix] = color
+
+   def set_selected_texcoords(self, texcoords):
+      # Texture coordinates are given in the order of the selection.
+      self.save_attributes('texcoords', list(self.selected))
+      for vix, uv in zip(list(self.selected), texcoords):
+         self.texcoords[vix] = uv
+
+   def define_or_select_group(self, group_ix, define_group):
+      if define_group:
+         self.restore_point()
+         self.record_change(('group', group_ix, self.selection_groups[group_ix]))
+         self.selection_groups[group_ix] = list(self.selected)
+      else:
+         self.selected = Selection(self.selection_groups[group_ix])
+
+   #============================================================================
+   # Animations and frames.
+   #============================================================================
+
+   def check_frame(self, frame_ix, anim_name):
+      if anim_name not in self.vertices_anim:
+         raise RecoverableError('No animation')
+      if frame_ix >= len(self.vertices_anim[anim_name]):
+         raise RecoverableError('No frame')
+
+   def select_anim(self, anim_name):
+      # Animation is created from the current frame if it does not exist yet.
+      if anim_name != self.anim_name:
+         if anim_name not in self.vertices_anim:
+            self.restore_point()
+         self.anim_name = anim_name
+         self.cur_frame = 0
+         if self.anim_name not in self.vertices_anim:
+            self.record_change(('anim', self.anim_name, None))
+            self.vertices = share_frame(self.vertices)
+            self.vertices_anim[self.anim_name] = [self.vertices]
+         else:
+            self.vertices = self.vertices_anim[self.anim_name][self.cur_frame]
+
+   def delete_anim(self, anim_name):
+      if anim_name not in self.vertices_anim:
+         raise RecoverableError('No animation')
+      if len(self.vertices_anim) == 1:
+         raise RecoverableError('Invalid operation')
+      self.restore_point()
+      self.record_change(('anim', anim_name, self.vertices_anim[anim_name]))
+      del self.vertices_anim[anim_name]
+      if self.anim_name == anim_name:
+         self.goto_frame(0, self.next_anim(anim_name))
+
+   def duplicate_frame(self, frame_ix, anim_name):
+      # Duplicated frame is inserted after the current frame, and selected for edit.
+      if anim_name not in self.vertices_anim:
+         raise RecoverableError('No animation')
+      if (frame_ix < 0) or (frame_ix >= len(self.vertices_anim[anim_name])):
+         raise RecoverableError('No frame')
+      self.restore_point()
+      self.vertices = share_frame(self.vertices_anim[anim_name][frame_ix])
+      self.cur_frame += 1
+      self.record_change(('frame', self.anim_name, self.cur_frame, None))
+      allframes = self.vertices_anim[self.anim_name]
+      self.vertices_anim[self.anim_name] = allframes[:self.cur_frame] + [self.vertices] + allframes[self.cur_frame:]
+
+   def delete_frame(self, frame_ix, anim_name):
+      if anim_name not in self.vertices_anim:
+         raise RecoverableError('No animation')
+      if (frame_ix < 0) or (frame_ix >= len(self.vertices_anim[anim_name])):
+         raise RecoverableError('No frame')
+      if len(self.vertices_anim[anim_name]) == 1:
+         self.delete_anim(anim_name)
+      else:
+         self.restore_point()
+         self.record_change(('frame', anim_name, frame_ix, self.vertices_anim[anim_name][frame_ix]))
+         del self.vertices_anim[anim_name][frame_ix]
+         if self.anim_name == anim_name:
+            self.cur_frame = min(self.cur_frame, len(self.vertices_anim[self.anim_name])-1)
+            self.vertices = self.vertices_anim[self.anim_name][self.cur_frame]
+
+   def goto_frame(self, frame_ix, anim_name):
+      self.check_frame(frame_ix, anim_name)
+      self.anim_name = anim_name
+      self.cur_frame = frame_ix
+      self.vertices = self.vertices_anim[self.anim_name][self.cur_frame]
+
+   def copy_from_frame(self, frame_ix, anim_name):
+      # Positions of the selected vertices are copied to the current frame.
+      self.check_frame(frame_ix, anim_name)
+      self.restore_point()
+      indices = self.selected.indices()
+      self.save_vertices(indices)
+      copy_vertices(self.vertices, self.vertices_anim[anim_name][frame_ix], indices)
+      self.update_vertex_caches(self.vertices, indices)
@@ -0,0 +1,366 @@
+
+import itertools
+import numpy as np
+
+from src.model import *
+
+#===============================================================================
+# Spatial queries over binary trees of polygons or entities, as created by
+# create_btree or loaded from an exported model, in either layout. Each query
+# has a batched variant, which takes an array of probes and traverses the tree
+# for all of them at once, one level of nodes at a time.
+#
+# Primitives are made of parts: polygons of their triangles, rectangles of two
+# triangles, edges and points of a segment, circles of a disc. Point queries
+# find the triangles and discs containing the point, rectangle queries the
+# parts overlapping the rectangle, nearest queries measure the distance to the
+# closest part (zero inside), and raycasts find where a segment enters a part
+# first (zero if it starts inside). Points are never hit by raycasts.
+#
+# Bounding boxes of nodes are computed again from the parts, since boxes in the
+# tree cover only the vertices of entities, not the whole circles. Results refer
+# to polygons by their order, and to entities by their index in the list
+# returned by get_entities_from_btree. Ties go to the lowest one.
+#===============================================================================
+
+def _cross(u, v):
+   return u[...,0] * v[...,1] - u[...,1] * v[...,0]
+
+def _get_edges(verts):
+   # Returns the starts and ends of edges of convex shapes, given as arrays of vertices (K, M, 2).
+   return (verts, np.roll(verts, -1, axis = 1))
+
+def _shape_contains(verts, points):
+   # Triangles of zero area contain no points, like segments.
+   sides = _cross(np.roll(verts, -1, axis = 1) - verts, points[:,None,:] - verts)
+   area = _cross(verts[:,1] - verts[:,0], verts[:,2] - verts[:,0])
+   return (area != 0) & ~((sides < 0).any(axis = 1) & (sides > 0).any(axis = 1))
+
+def _shape_overlaps_rect(verts, rects):
+   # Separating axis test, with the axes of the rectangle and the normals of edges of the shape.
+   left, right, bottom, top = rects.T
+   overlap = (verts[...,0].min(axis = 1) <= right) & (verts[...,0].max(axis = 1) >= left) & \
+             (verts[...,1].min(axis = 1) <= top)   & (verts[...,1].max(axis = 1) >= bottom)
+   starts, ends = _get_edges(verts)
+   normals = np.stack((starts[...,1] - ends[...,1], ends[...,0] - starts[...,0]), axis = -1)
+   proj = np.einsum('kai,kvi->kav', normals, verts)
+   center = np.stack(((left + right) / 2.0, (bottom + top) / 2.0), axis = -1)
+   half   = np.stack(((right - left) / 2.0, (top - bottom) / 2.0), axis = -1)
+   center_proj = (normals * center[:,None,:]).sum(axis = -1)
+   half_proj = (np.abs(normals) * half[:,None,:]).sum(axis = -1)
+   return overlap & ((proj.min(axis = 2) <= center_proj + half_proj) & (proj.max(axis = 2) >= center_proj - half_proj)).all(axis = 1)
+
+def _segment_distances(starts, ends, points):
+   edges = ends - starts
+   offsets = points - starts
+   length_squared = (edges * edges).sum(axis = -1)
+   t = np.divide((offsets * edges).sum(axis = -1), length_squared, out = np.zeros_like(length_squared), where = (length_squared > 0))
+   nearest = offsets - np.clip(t, 0.0, 1.0)[...,None] * edges
+   return np.hypot(nearest[...,0], nearest[...,1])
+
+def _segment_fractions(origins, deltas, starts, ends):
+   # Returns the fractions of rays where they cross the segments, or infinity. Parallel segments never cross.
+   edges = ends - starts
+   offsets = starts - origins
+   denom = _cross(deltas, edges)
+   with np.errstate(divide = 'ignore', invalid = 'ignore'):
+      t = _cross(offsets, edges) / denom
+      u = _cross(offsets, deltas) / denom
+   hit = (denom != 0) & (t >= 0) & (t <= 1) & (u >= 0) & (u <= 1)
+   return np.where(hit, t, np.inf)
+
+def _slab_fractions(origins, deltas, low, high):
+   # Returns the range of fractions of rays between the two lines along one axis.
+   with np.errstate(divide = 'ignore', invalid = 'ignore'):
+      t1 = (low  - origins) / deltas
+      t2 = (high - origins) / deltas
+   parallel = (deltas == 0)
+   inside = (origins >= low) & (origins <= high)
+   enter = np.where(parallel, np.where(inside, -np.inf, np.inf), np.minimum(t1, t2))
+   leave = np.where(parallel, np.where(inside, np.inf, -np.inf), np.maximum(t1, t2))
+   return (enter, leave)
+
+def _box_distances(bboxes, points):
+   dx = np.maximum(np.maximum(bboxes[0] - points[:,0], points[:,0] - bboxes[1]), 0.0)
+   dy = np.maximum(np.maximum(bboxes[2] - points[:,1], points[:,1] - bboxes[3]), 0.0)
+   return np.hypot(dx, dy)
+
+def _box_fractions(bboxes, segments, limits):
+   # Returns the fractions of segments where they enter the boxes, or infinity if they miss them before the limits.
+   enter_x, leave_x = _slab_fractions(segments[:,0], segments[:,2] - segments[:,0], bboxes[0], bboxes[1])
+   enter_y, leave_y = _slab_fractions(segments[:,1], segments[:,3] - segments[:,1], bboxes[2], bboxes[3])
+   enter = np.maximum(np.maximum(enter_x, enter_y), 0.0)
+   leave = np.minimum(np.minimum(leave_x, leave_y), limits)
+   return np.where(enter <= leave, enter, np.inf)
+
+#===============================================================================
+
+class Shapes:
+   # Convex parts of primitives, triangles or segments, as arrays of vertices.
+
+   def __init__(self, verts):
+      self.verts = verts
+
+   def get_bboxes(self):
+      return np.stack((self.verts[...,0].min(axis = 1), self.verts[...,0].max(axis = 1), self.verts[...,1].min(axis = 1), self.verts[...,1].max(axis = 1)))
+
+   def contains(self, parts, points):
+      if self.verts.shape[1] < 3:
+         return np.zeros(len(parts), dtype = bool)
+      return _shape_contains(self.verts[parts], points)
+
+   def overlaps_rect(self, parts, rects):
+      return _shape_overlaps_rect(self.verts[parts], rects)
+
+   def distances(self, parts, points):
+      starts, ends = _get_edges(self.verts[parts])
+      dist = _segment_distances(starts, ends, points[:,None,:]).min(axis = 1)
+      return np.where(self.contains(parts, points), 0.0, dist)
+
+   def fractions(self, parts, segments):
+      starts, ends = _get_edges(self.verts[parts])
+      origins = segments[:,0:2]
+      t = _segment_fractions(origins[:,None,:], (segments[:,2:4] - origins)[:,None,:], starts, ends).min(axis = 1)
+      return np.where(self.contains(parts, origins), 0.0, t)
+
+class Discs:
+   # Circles, as arrays of centers and radii.
+
+   def __init__(self, centers, radii):
+      self.centers = centers
+      self.radii = radii
+
+   def get_bboxes(self):
+      x, y = self.centers.T
+      return np.stack((x - self.radii, x + self.radii, y - self.radii, y + self.radii))
+
+   def center_distances(self, parts, points):
+      offsets = points - self.centers[parts]
+      return np.hypot(offsets[:,0], offsets[:,1])
+
+   def contains(self, parts, points):
+      return self.center_distances(parts, points) <= self.radii[parts]
+
+   def overlaps_rect(self, parts, rects):
+      return _box_distances(rects.T, self.centers[parts]) <= self.radii[parts]
+
+   def distances(self, parts, points):
+      return np.maximum(self.center_distances(parts, points) - self.radii[parts], 0.0)
+
+   def fractions(self, parts, segments):
+      origins = segments[:,0:2]
+      deltas = segments[:,2:4] - origins
+      offsets = origins - self.centers[parts]
+      a = (deltas * deltas).sum(axis = 1)
+      b = (offsets * deltas).sum(axis = 1)
+      c = (offsets * offsets).sum(axis = 1) - self.radii[parts] ** 2
+      disc = b * b - a * c
+      with np.errstate(divide = 'ignore', invalid = 'ignore'):
+         t = (-b - np.sqrt(disc)) / a
+      hit = (a > 0) & (disc >= 0) & (t >= 0) & (t <= 1)
+      return np.where(c <= 0, 0.0, np.where(hit, t, np.inf))
+
+class PartGroup:
+   # Parts of one type, sorted by primitive, with the range of parts of each primitive.
+
+   def __init__(self, parts, prims, nprims):
+      self.parts = parts
+      self.starts = np.searchsorted(prims, np.arange(nprims + 1))
+
+   def expand(self, probes, prims):
+      # Returns the probes and primitives repeated for each part of the primitives, and the parts.
+      counts = self.starts[prims + 1] - self.starts[prims]
+      total = int(counts.sum())
+      offsets = np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts)
+      return (np.repeat(probes, counts), np.repeat(prims, counts), np.repeat(self.starts[prims], counts) + offsets)
+
+class BTreeQuery:
+
+   def __init__(self, root, vertices):
+      vertices = np.asarray(vertices, dtype = np.float64).reshape((-1, 2))
+      if root is None:
+         root = {'bbox': (), 'skip': (), 'first': (), 'count': (), 'kind': (), 'value': ()}
+      elif 'skip' not in root:
+         node = root
+         while node['kind'] == 'branch':
+            node = node['sub1']
+         root = flatten_btree(root, ('order', 'value') if (node['kind'] == 'polygon') else ('kind', 'name', 'value'))
+      self.skips  = np.array(root['skip'],  dtype = np.intp)
+      self.firsts = np.array(root['first'], dtype = np.intp)
+      self.counts = np.array(root['count'], dtype = np.intp)
+      nprims = len(root['value'])
+      if 'order' in root:
+         self.ids = np.array(root['order'], dtype = np.intp)
+         self.groups = self.create_polygon_parts(root['value'], vertices)
+      else:
+         self.ids = np.arange(nprims)
+         self.groups = self.create_entity_parts(root['kind'], root['value'], vertices)
+      # Bounding boxes of primitives, then of the ranges of primitives covered by the nodes.
+      bboxes = np.empty((4, nprims + 1))
+      bboxes[0::2] = np.inf
+      bboxes[1::2] = -np.inf
+      for group in self.groups:
+         prims = np.repeat(np.arange(nprims), np.diff(group.starts))
+         part_bboxes = group.parts.get_bboxes()
+         for ix, fun in enumerate((np.minimum, np.maximum, np.minimum, np.maximum)):
+            fun.at(bboxes[ix], prims, part_bboxes[ix])
+      ranges = np.stack((self.firsts, self.firsts + self.counts), axis = 1).reshape(-1)
+      self.node_bboxes = np.stack([
+         fun.reduceat(bboxes[ix], ranges)[0::2] if (len(ranges) > 0) else np.zeros(0)
+         for ix, fun in enumerate((np.minimum, np.maximum, np.minimum, np.maximum))])
+
+   def create_polygon_parts(self, polygons, vertices):
+      ntriangles = np.fromiter((len(poly) // 3 for poly in polygons), dtype = np.intp, count = len(polygons))
+      indices = np.fromiter(itertools.chain.from_iterable(poly[:ntri*3] for (poly, ntri) in zip(polygons, ntriangles.tolist())),
+         dtype = np.intp, count = int(ntriangles.sum()) * 3)
+      prims = np.repeat(np.arange(len(polygons)), ntriangles)
+      return [PartGroup(Shapes(vertices[indices].reshape((-1, 3, 2))), prims, len(polygons))]
+
+   def create_entity_parts(self, kinds, values, vertices):
+      # Points are segments of zero length, rectangles are divided into two triangles.
+      segments = []
+      triangles = []
+      discs = []
+      for prim_ix, (kind, value) in enumerate(zip(kinds, values)):
+         if kind == ENTITY_POINT:
+            x1, y1 = x2, y2 = vertices[value]
+         else:
+            (x1, y1), (x2, y2) = vertices[list(value)]
+         if kind == ENTITY_RECT:
+            triangles.append((prim_ix, ((x1, y1), (x2, y1), (x2, y2))))
+            triangles.append((prim_ix, ((x1, y1), (x2, y2), (x1, y2))))
+         elif kind == ENTITY_CIRCLE:
+            discs.append((prim_ix, (x1, y1, np.hypot(x2 - x1, y2 - y1))))
+         else:
+            segments.append((prim_ix, ((x1, y1), (x2, y2))))
+
+      def create_group(parts, create):
+         prims = np.array([prim_ix for (prim_ix, part) in parts], dtype = np.intp)
+         return PartGroup(create(np.array([part for (prim_ix, part) in parts], dtype = np.float64)), prims, len(values))
+
+      return [
+         create_group(segments,  lambda parts: Shapes(parts.reshape((-1, 2, 2)))),
+         create_group(triangles, lambda parts: Shapes(parts.reshape((-1, 3, 2)))),
+         create_group(discs,     lambda parts: Discs(parts.reshape((-1, 3))[:,0:2], parts.reshape((-1, 3))[:,2]))]
+
+   def traverse(self, nprobes, visit_nodes, visit_leaves):
+      # Tests all the probes against the root, then the children of the nodes that passed the test, and so on.
+      # Nodes are filtered by visit_nodes, which returns a mask, leaves are passed to visit_leaves as primitives.
+      if len(self.counts) == 0:
+         return
+      probes = np.arange(nprobes)
+      nodes = np.zeros(nprobes, dtype = np.intp)
+      while len(probes) > 0:
+         passed = visit_nodes(probes, self.node_bboxes[:,nodes])
+         probes = probes[passed]
+         nodes = nodes[passed]
+         leaf = (self.counts[nodes] == 1)
+         visit_leaves(probes[leaf], self.firsts[nodes[leaf]])
+         probes = np.repeat(probes[~leaf], 2)
+         nodes = nodes[~leaf] + 1
+         nodes = np.stack((nodes, self.skips[nodes]), axis = 1).reshape(-1)
+
+   def find_pairs(self, nprobes, visit_nodes, test_parts):
+      # Returns the probes and the primitives passing the test for any of their parts, sorted by probe and primitive.
+      found = []
+
+      def visit_leaves(probes, prims):
+         for group in self.groups:
+            probes_rep, prims_rep, parts = group.expand(probes, prims)
+            passed = test_parts(group.parts, probes_rep, parts)
+            found.append(probes_rep[passed] * num_ids + self.ids[prims_rep[passed]])
+
+      # Pairs are combined into single numbers to remove duplicates and sort them at once.
+      num_ids = int(self.ids.max()) + 1 if (len(self.ids) > 0) else 1
+      self.traverse(nprobes, visit_nodes, visit_leaves)
+      found = np.unique(np.concatenate(found)) if found else np.zeros(0, dtype = np.intp)
+      return (found // num_ids, found % num_ids)
+
+   def descend(self, nprobes, measure_nodes):
+      # Returns the primitive reached by each probe going down the tree, always to the child measured lower.
+      prims = np.zeros(nprobes, dtype = np.intp)
+      if len(self.counts) == 0:
+         return prims
+      probes = np.arange(nprobes)
+      nodes = np.zeros(nprobes, dtype = np.intp)
+      while len(probes) > 0:
+         leaf = (self.counts[nodes] == 1)
+         prims[probes[leaf]] = self.firsts[nodes[leaf]]
+         probes = probes[~leaf]
+         sub1 = nodes[~leaf] + 1
+         sub2 = self.skips[sub1]
+         nearer = measure_nodes(probes, self.node_bboxes[:,sub1]) <= measure_nodes(probes, self.node_bboxes[:,sub2])
+         nodes = np.where(nearer, sub1, sub2)
+      return prims
+
+   def find_best(self, nprobes, limits, measure_nodes, measure_parts):
+      # Returns the primitive with the lowest measure for each probe, up to the limits, and the measure.
+      # Limits are lowered to the best measure found so far, and nodes measured beyond them are skipped.
+      # Primitives reached by descending the tree give the first limits, so that most nodes are skipped.
+      best = np.array(limits, dtype = np.float64)
+      found = []
+
+      def visit_leaves(probes, prims):
+         for group in self.groups:
+            probes_rep, prims_rep, parts = group.expand(probes, prims)
+            values = measure_parts(group.parts, probes_rep, parts)
+            np.minimum.at(best, probes_rep, values)
+            passed = (values <= best[probes_rep]) & (values < np.inf)
+            found.append((probes_rep[passed], self.ids[prims_rep[passed]], values[passed]))
+
+      if len(self.counts) > 0:
+         visit_leaves(np.arange(nprobes), self.descend(nprobes, lambda probes, bboxes: measure_nodes(probes, bboxes, best[probes])))
+      self.traverse(nprobes, lambda probes, bboxes: measure_nodes(probes, bboxes, best[probes]) <= best[probes], visit_leaves)
+      ids = np.full(nprobes, -1, dtype = np.intp)
+      values = np.full(nprobes, np.inf)
+      if found:
+         probes, prim_ids, prim_values = [np.concatenate(arrays) for arrays in zip(*found)]
+         order = np.lexsort((prim_ids, prim_values, probes))
+         probes = probes[order]
+         first = np.ones(len(probes), dtype = bool)
+         first[1:] = (probes[1:] != probes[:-1])
+         ids[probes[first]] = prim_ids[order][first]
+         values[probes[first]] = prim_values[order][first]
+      return (ids, values)
+
+   def find_at_points(self, points):
+      # Returns the indices of points and primitives containing them, as two arrays.
+      points = np.asarray(points, dtype = np.float64).reshape((-1, 2))
+      return self.find_pairs(len(points),
+         lambda probes, bboxes: _box_distances(bboxes, points[probes]) == 0,
+         lambda parts, probes, indices: parts.contains(indices, points[probes]))
+
+   def find_in_rects(self, rects):
+      # Returns the indices of rectangles (left, right, bottom, top) and primitives overlapping them, as two arrays.
+      rects = np.asarray(rects, dtype = np.float64).reshape((-1, 4))
+      return self.find_pairs(len(rects),
+         lambda probes, bboxes: (bboxes[0] <= rects[probes,1]) & (bboxes[1] >= rects[probes,0]) & (bboxes[2] <= rects[probes,3]) & (bboxes[3] >= rects[probes,2]),
+         lambda parts, probes, indices: parts.overlaps_rect(indices, rects[probes]))
+
+   def find_nearest_to_points(self, points, radius = np.inf):
+      # Returns the nearest primitive to each point within the radius, or -1, and the distance to it.
+      points = np.asarray(points, dtype = np.float64).reshape((-1, 2))
+      return self.find_best(len(points), np.full(len(points), float(radius)),
+         lambda probes, bboxes, limits: _box_distances(bboxes, points[probes]),
+         lambda parts, probes, indices: parts.distances(indices, points[probes]))
+
+   def raycast_segments(self, segments):
+      # Returns the first primitive hit by each segment (x1, y1, x2, y2), or -1, and the fraction of the segment before it.
+      segments = np.asarray(segments, dtype = np.float64).reshape((-1, 4))
+      return self.find_best(len(segments), np.ones(len(segments)),
+         lambda probes, bboxes, limits: _box_fractions(bboxes, segments[probes], limits),
+         lambda parts, probes, indices: parts.fractions(indices, segments[probes]))
+
+   def find_at_point(self, x, y):
+      return self.find_at_points([(x, y)])[1].tolist()
+
+   def find_in_rect(self, left, right, bottom, top):
+      return self.find_in_rects([(left, right, bottom, top)])[1].tolist()
+
+   def find_nearest(self, x, y, radius = np.inf):
+      ids, dist = self.find_nearest_to_points([(x, y)], radius)
+      return (int(ids[0]), float(dist[0]))
+
+   def raycast(self, x1, y1, x2, y2):
+      ids, fractions = self.raycast_segments([(x1, y1, x2, y2)])
+      return (int(ids[0]), float(fractions[0]))
@@ -0,0 +1,140 @@
+
+import math
+import numpy as np
+
+# Queries covering more grid rows than this scan all vertices instead.
+MAX_QUERY_ROWS = 64
+
+def find_nearest_vertex(vertices, indices, x, y, radius):
+   if indices is None:
+      points = vertices
+   else:
+      points = vertices[indices]
+   if len(points) == 0:
+      return -1
+   dist_squared = ((points - (x, y)) ** 2).sum(axis = 1)
+   best_dist_squared = dist_squared.min()
+   if best_dist_squared > radius * radius:
+      return -1
+   # Ties go to the lowest index, as in a linear scan.
+   best = np.flatnonzero(dist_squared == best_dist_squared)
+   return int(best.min() if (indices is None) else indices[best].min())
+
+#===============================================================================
+# Uniform grid over vertex positions in world space. Vertices moved after the
+# grid was built are tracked separately and checked by brute force, until there
+# are so many of them that the grid is rebuilt.
+#===============================================================================
+
+class VertexGrid:
+
+   def __init__(self):
+      self.vertices = None
+
+   def rebuild(self, vertices):
+      self.vertices = vertices
+      self.moved = np.zeros(len(vertices), dtype = bool)
+      self.moved_indices = np.zeros(0, dtype = np.intp)
+      if len(vertices) > 0:
+         mins = vertices.min(axis = 0)
+         width, height = (vertices.max(axis = 0) - mins).tolist()
+         extent = max(width, height)
+         area = max(width * height, extent * extent / len(vertices))
+         self.cell_size = math.sqrt(area / len(vertices)) if (extent > 0) else 1.0
+         self.origin = mins
+         self.ncols = int(width  / self.cell_size) + 1
+         self.nrows = int(height / self.cell_size) + 1
+         cols, rows = self.cell_coords(vertices)
+         keys = rows * self.ncols + cols
+         self.order = np.argsort(keys, kind = 'stable')
+         self.cell_start = np.searchsorted(keys[self.order], np.arange(self.nrows * self.ncols + 1))
+
+   def cell_coords(self, points):
+      cells = np.floor((points - self.origin) / self.cell_size).astype(np.intp)
+      cols = np.clip(cells[:,0], 0, self.ncols-1)
+      rows = np.clip(cells[:,1], 0, self.nrows-1)
+      return (cols, rows)
+
+   def update(self, vertices, indices):
+      if (vertices is not self.vertices) or (len(indices) == 0):
+         return # Grid gets rebuilt when the vertex table is queried next time.
+      self.moved[indices] = True
+      self.moved_indices = np.flatnonzero(self.moved)
+      if len(self.moved_indices) > len(self.vertices) // 4:
+         self.rebuild(self.vertices)
+
+   def query_candidates(self, left, right, bottom, top):
+      (col1, col2), (row1, row2) = self.cell_coords(np.array(((left, bottom), (right, top))))
+      if row2 - row1 >= MAX_QUERY_ROWS:
+         return None
+      # Cells of the same row are adjacent in the sorted order.
+      slices = [self.order[self.cell_start[row*self.ncols + col1]:self.cell_start[row*self.ncols + col2 + 1]] for row in range(row1, row2+1)]
+      candidates = np.concatenate(slices)
+      return np.concatenate((candidates[~self.moved[candidates]], self.moved_indices))
+
+   def find_in_rect(self, left, right, bottom, top):
+      if len(self.vertices) == 0:
+         return np.zeros(0, dtype = np.intp)
+      candidates = self.query_candidates(left, right, bottom, top)
+      points = self.vertices if (candidates is None) else self.vertices[candidates]
+      inside = ((points[:,0] >= left) & (points[:,0] <= right) & (points[:,1] >= bottom) & (points[:,1] <= top))
+      return np.flatnonzero(inside) if (candidates is None) else np.sort(candidates[inside])
+
+   def find_nearest(self, x, y, radius):
+      if len(self.vertices) == 0:
+         return -1
+      candidates = self.query_candidates(x - radius, x + radius, y - radius, y + radius)
+      return find_nearest_vertex(self.vertices, candidates, x, y, radius)
+
+#===============================================================================
+# Bounding volume hierarchy over boxes given as arrays of minimum and maximum
+# corners. Boxes are ordered along a Morton curve by their centers and paired
+# level by level, so the tree is implicit: node i of a level has children 2*i
+# and 2*i+1 on the level below. Refitting and queries then work a whole level
+# at a time.
+#===============================================================================
+
+def get_morton_codes(points):
+   mins = points.min(axis = 0)
+   extent = (points.max(axis = 0) - mins).max()
+   cells = ((points - mins) * (65535.0 / extent)).astype(np.uint32) if (extent > 0) else np.zeros(points.shape, dtype = np.uint32)
+   # Spread the 16 bits of each coordinate over the even bits, and interleave.
+   for shift, mask in ((8, 0x00FF00FF), (4, 0x0F0F0F0F), (2, 0x33333333), (1, 0x55555555)):
+      cells = (cells | (cells << shift)) & mask
+   return cells[:,0] | (cells[:,1] << 1)
+
+class BoxTree:
+
+   def __init__(self):
+      self.rebuild(np.zeros((0, 2)), np.zeros((0, 2)))
+
+   def rebuild(self, mins, maxs):
+      if len(mins) > 0:
+         self.order = np.argsort(get_morton_codes((mins + maxs) * 0.5), kind = 'stable')
+      else:
+         self.order = np.zeros(0, dtype = np.intp)
+      self.refit(mins, maxs)
+
+   def refit(self, mins, maxs):
+      # Box order stays the same, only the boxes of nodes are recalculated.
+      level_mins = mins[self.order]
+      level_maxs = maxs[self.order]
+      self.levels = [(level_mins, level_maxs)]
+      while len(level_mins) > 1:
+         if len(level_mins) % 2 != 0:
+            level_mins = np.concatenate((level_mins, level_mins[-1:]))
+            level_maxs = np.concatenate((level_maxs, level_maxs[-1:]))
+         level_mins = np.minimum(level_mins[0::2], level_mins[1::2])
+         level_maxs = np.maximum(level_maxs[0::2], level_maxs[1::2])
+         self.levels.append((level_mins, level_maxs))
+      self.levels.reverse()
+
+   def find_overlapping(self, left, right, bottom, top):
+      nodes = np.zeros(1 if (len(self.order) > 0) else 0, dtype = np.intp)
+      for depth, (mins, maxs) in enumerate(self.levels):
+         if depth > 0:
+            nodes = (nodes[:,None] * 2 + (0, 1)).ravel()
+            nodes = nodes[nodes < len(mins)]
+         overlap = (mins[nodes,0] <= right) & (maxs[nodes,0] >= left) & (mins[nodes,1] <= top) & (maxs[nodes,1] >= bottom)
+         nodes = nodes[overlap]
+      return np.sort(self.order[nodes])
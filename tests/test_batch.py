@@ -0,0 +1,49 @@
+
+import io, os, shutil, sys, tempfile, unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.batch import *
+
+MODEL_JSON = '{"polygons": [[0, 1, 2]], "colors": [[1, 0, 0, 1], [0, 1, 0, 1], [0, 0, 1, 1]], "vertices": {"idle": [[[0, 0], [1, 0], [0, 1]]]}}'
+
+class BatchTest(unittest.TestCase):
+
+   def setUp(self):
+      self.dir = tempfile.mkdtemp()
+      self.stdout, self.stderr = sys.stdout, sys.stderr
+      sys.stdout, sys.stderr = io.StringIO(), io.StringIO()
+
+   def tearDown(self):
+      sys.stdout, sys.stderr = self.stdout, self.stderr
+      shutil.rmtree(self.dir)
+
+   def write_model(self, *names):
+      path = os.path.join(self.dir, *names)
+      if not os.path.isdir(os.path.dirname(path)):
+         os.makedirs(os.path.dirname(path))
+      with open(path, 'w') as f:
+         f.write(MODEL_JSON)
+      return path
+
+   def read_file(self, path):
+      with open(path) as f:
+         return f.read()
+
+   def test_save_does_not_replace_input(self):
+      path = self.write_model('m.json')
+      self.assertEqual(main([path, '--action', 'save', '-j', '1']), 1)
+      self.assertEqual(self.read_file(path), MODEL_JSON)
+      self.assertEqual(main([path, '--action', 'save', '-j', '1', '--overwrite']), 0)
+      self.assertNotEqual(self.read_file(path), MODEL_JSON)
+
+   def test_same_output_path_is_refused(self):
+      paths = [self.write_model('a', 'm.json'), self.write_model('b', 'm.json')]
+      output_dir = os.path.join(self.dir, 'out')
+      self.assertEqual(main(paths + ['--output-dir', output_dir, '-j', '2']), 1)
+      self.assertFalse(os.path.exists(os.path.join(output_dir, 'm.btree.json')))
+      self.assertEqual(main([paths[0], '--output-dir', output_dir, '-j', '2']), 0)
+      self.assertTrue(os.path.exists(os.path.join(output_dir, 'm.btree.json')))
+
+if __name__ == '__main__':
+   unittest.main()
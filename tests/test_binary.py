@@ -0,0 +1,73 @@
+
+import os, shutil, sys, tempfile, unittest
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.model import *
+
+MODEL_DATA = {
+   'polygons':  [(0, 1, 2), (1, 3, 2)],
+   'entities':  [{'kind': 'point', 'name': 'pivot', 'value': 0}],
+   'colors':    [(1.0, 0.0, 0.0, 1.0), (0.0, 1.0, 0.0, 1.0), (0.0, 0.0, 1.0, 1.0), (1.0, 1.0, 1.0, 0.5)],
+   'texcoords': [(0.0, 0.0), (1.0, 0.0), (0.0, 1.0), (1.0, 1.0)],
+   'vertices':  {
+      'idle': [[(0.0, 0.0), (1.0, 0.0), (0.0, 1.0), (1.0, 1.0)]],
+      'walk': [[(0.0, 0.0), (1.5, 0.0), (0.0, 1.5), (1.5, 1.5)], [(0.1, 0.0), (1.1, 0.25), (0.1, 1.0), (1.1, 1.25)]]}}
+
+class BinaryFormatTest(unittest.TestCase):
+
+   def setUp(self):
+      self.dir = tempfile.mkdtemp()
+      self.path = os.path.join(self.dir, 'model.m2d')
+      model = Model()
+      model.load_model(MODEL_DATA)
+      write_binary_model(self.path, model)
+
+   def tearDown(self):
+      shutil.rmtree(self.dir)
+
+   def open_model(self):
+      model = Model()
+      model.load_model(load_model_file(self.path))
+      return model
+
+   def test_save_to_opened_file(self):
+      model = self.open_model()
+      expected = model.save_model()
+      self.assertTrue(is_file_mapped(self.path))
+      # Deleted frame is kept in the undo history, still mapped from the file.
+      model.delete_frame(1, 'walk')
+      saved = model.save_model()
+      write_binary_model(self.path, model)
+      self.assertFalse(os.path.exists(self.path + '.tmp'))
+      self.assertFalse(is_file_mapped(self.path))
+      self.assertEqual(self.open_model().save_model(), saved)
+      model.undo_or_redo(False)
+      self.assertEqual(model.save_model(), expected)
+
+   def test_save_to_file_in_use(self):
+      model = self.open_model()
+      expected = model.save_model()
+      # Frame held outside the model keeps the file mapped, so it cannot be replaced.
+      frame = model.vertices_anim['walk'][1]
+      model.delete_frame(1, 'walk')
+      model.undo_journal.reset()
+      with self.assertRaises(IOError):
+         write_binary_model(self.path, model)
+      self.assertFalse(os.path.exists(self.path + '.tmp'))
+      self.assertEqual(self.open_model().save_model(), expected)
+
+   def test_float32(self):
+      model = self.open_model()
+      size = os.path.getsize(self.path)
+      write_binary_model(self.path, model, 'float32')
+      loaded = self.open_model()
+      for name, frames in model.vertices_anim.items():
+         for frame, loaded_frame in zip(frames, loaded.vertices_anim[name]):
+            self.assertEqual(loaded_frame.dtype, np.float64)
+            np.testing.assert_allclose(loaded_frame, frame, rtol = 1e-6)
+      self.assertLess(os.path.getsize(self.path), size)
+
+if __name__ == '__main__':
+   unittest.main()
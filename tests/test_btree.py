@@ -0,0 +1,173 @@
+
+import json, os, random, sys, unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import src.btree
+from src.model import *
+
+EXAMPLE_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'example', 'girl.json')
+
+#===============================================================================
+# Recursive builder which create_btree replaced, dividing each node at the
+# median, kept to check that split='median' still builds the same trees.
+#===============================================================================
+
+def _get_bbox_union(bboxes):
+   return (min(b[0] for b in bboxes), max(b[1] for b in bboxes), min(b[2] for b in bboxes), max(b[3] for b in bboxes))
+
+def _get_bbox_intersection_area(bbox1, bbox2):
+   left, right = max(bbox1[0], bbox2[0]), min(bbox1[1], bbox2[1])
+   bottom, top = max(bbox1[2], bbox2[2]), min(bbox1[3], bbox2[3])
+   return ((right - left) * (top - bottom)) if ((left < right) and (bottom < top)) else 0
+
+def _create_median_node(leaves_sorted):
+   if len(leaves_sorted[0]) == 1:
+      return leaves_sorted[0][0]
+   best = None
+   for axis in (0, 1):
+      size = len(leaves_sorted[axis])
+      for index in sorted(set((size // 2, (size + 1) // 2))):
+         area = _get_bbox_intersection_area(
+            _get_bbox_union([leaf['bbox'] for leaf in leaves_sorted[axis][:index]]),
+            _get_bbox_union([leaf['bbox'] for leaf in leaves_sorted[axis][index:]]))
+         if (best is None) or (best[0] > area):
+            best = (area, axis, index)
+   area, axis, index = best
+   first = set(id(leaf) for leaf in leaves_sorted[axis][:index])
+   l1 = [[leaf for leaf in leaves if id(leaf) in first] for leaves in leaves_sorted]
+   l2 = [[leaf for leaf in leaves if id(leaf) not in first] for leaves in leaves_sorted]
+   return {
+      'bbox': _get_bbox_union([leaf['bbox'] for leaf in leaves_sorted[0]]),
+      'kind': 'branch',
+      'sub1': _create_median_node(l1),
+      'sub2': _create_median_node(l2)}
+
+def create_median_btree(leaves):
+   if len(leaves) == 0:
+      return None
+   return _create_median_node([
+      sorted(leaves, key = lambda leaf: (leaf['bbox'][0] + leaf['bbox'][1]) / 2.0),
+      sorted(leaves, key = lambda leaf: (leaf['bbox'][2] + leaf['bbox'][3]) / 2.0)])
+
+#===============================================================================
+
+def unflatten_btree(flat, fields, kind = None):
+   # Creates nested nodes from the flat layout. Leaves get the given kind, if it is not one of the fields.
+
+   def create_node(node_ix):
+      node = {'bbox': tuple(flat['bbox'][4*node_ix:4*node_ix+4])}
+      if flat['count'][node_ix] > 1:
+         node['kind'] = 'branch'
+         node['sub1'] = create_node(node_ix + 1)
+         node['sub2'] = create_node(flat['skip'][node_ix + 1])
+      else:
+         if kind is not None:
+            node['kind'] = kind
+         for field in fields:
+            node[field] = flat[field][flat['first'][node_ix]]
+      return node
+
+   return create_node(0)
+
+def create_random_leaves(rnd):
+   # Coordinates are quantized, so that there are many duplicate and degenerate boxes.
+   n = rnd.randint(1, 80)
+   q = rnd.choice([2, 5, 1000])
+   vertices = [(rnd.randint(0, q) / float(q), rnd.randint(0, q) / float(q)) for _ in range(n * 3)]
+   polygons = [[rnd.randrange(len(vertices)) for _ in range(rnd.randint(1, 4))] for _ in range(n)]
+   return create_btree_leaves_from_polygons(polygons, vertices)
+
+class BTreeTest(unittest.TestCase):
+
+   def setUp(self):
+      model = Model()
+      model.load_model(load_model_file(EXAMPLE_PATH))
+      self.vertices = frame_to_tuples(model.vertices)
+      self.polygons = model.get_complete_polygons()
+      self.sah_depth = src.btree.BTREE_SAH_DEPTH
+
+   def tearDown(self):
+      src.btree.BTREE_SAH_DEPTH = self.sah_depth
+
+   def check_tree(self, root, leaves):
+      found = []
+
+      def traverse_tree(node):
+         self.assertEqual(len(node['bbox']), 4)
+         if node['kind'] == 'branch':
+            for sub in (node['sub1'], node['sub2']):
+               left, right, bottom, top = sub['bbox']
+               self.assertTrue((node['bbox'][0] <= left) and (right <= node['bbox'][1]) and (node['bbox'][2] <= bottom) and (top <= node['bbox'][3]))
+               traverse_tree(sub)
+         else:
+            found.append(node)
+
+      traverse_tree(root)
+      self.assertEqual(sorted(id(leaf) for leaf in found), sorted(id(leaf) for leaf in leaves))
+
+   def test_leaf_bboxes(self):
+      for leaf, poly in zip(create_btree_leaves_from_polygons(self.polygons, self.vertices), self.polygons):
+         xs = [self.vertices[ix][0] for ix in poly]
+         ys = [self.vertices[ix][1] for ix in poly]
+         self.assertEqual(leaf['bbox'], (min(xs), max(xs), min(ys), max(ys)))
+
+   def test_leaves_and_bounds(self):
+      rnd = random.Random(1)
+      leaf_sets = [create_btree_leaves_from_polygons(self.polygons, self.vertices)] + [create_random_leaves(rnd) for _ in range(100)]
+      for leaves in leaf_sets:
+         for split in BTREE_SPLITS:
+            self.check_tree(create_btree(leaves, split), leaves)
+      self.assertIsNone(create_btree([]))
+
+   def test_depth_limit(self):
+      # Below the depth limit, nodes are divided at the median.
+      src.btree.BTREE_SAH_DEPTH = 2
+      rnd = random.Random(2)
+      for _ in range(20):
+         leaves = create_random_leaves(rnd)
+         self.check_tree(create_btree(leaves), leaves)
+
+   def test_flat_layout(self):
+      data = read_json_model(EXAMPLE_PATH)
+      data['entities'] = [
+         {'kind': ENTITY_POINT,  'name': 'a',  'value': 0},
+         {'kind': ENTITY_EDGE,   'name': 'b',  'value': [1, 5]},
+         {'kind': ENTITY_RECT,   'name': 'c',  'value': [2, 9]},
+         {'kind': ENTITY_CIRCLE, 'name': 'd',  'value': [3, 4]},
+         {'kind': ENTITY_POINT,  'name': '!e', 'value': 6}]
+      model = Model()
+      model.load_model(data)
+      for split in BTREE_SPLITS:
+         nested = model.export_btree(split, 'nested')
+         flat = model.export_btree(split, 'flat')
+         for key in nested:
+            if key not in ('polygons', 'entities'):
+               self.assertEqual(flat[key], nested[key])
+         self.assertEqual(unflatten_btree(flat['polygons'], ('order', 'value'), 'polygon'), nested['polygons'])
+         self.assertEqual(unflatten_btree(flat['entities'], ('kind', 'name', 'value')), nested['entities'])
+         self.assertEqual(get_polygons_from_btree(flat['polygons']), get_polygons_from_btree(nested['polygons']))
+         self.assertEqual(get_entities_from_btree(flat['entities']), get_entities_from_btree(nested['entities']))
+         # Each subtree covers a contiguous range of primitives, the first child starting right after its parent.
+         skips, firsts, counts = flat['polygons']['skip'], flat['polygons']['first'], flat['polygons']['count']
+         self.assertEqual(len(skips), 2 * len(flat['polygons']['value']) - 1)
+         for node_ix in range(len(skips)):
+            if counts[node_ix] > 1:
+               sub2 = skips[node_ix + 1]
+               self.assertEqual(firsts[node_ix + 1], firsts[node_ix])
+               self.assertEqual(firsts[sub2], firsts[node_ix] + counts[node_ix + 1])
+               self.assertEqual(counts[node_ix + 1] + counts[sub2], counts[node_ix])
+               self.assertEqual(skips[sub2], skips[node_ix])
+            else:
+               self.assertEqual(skips[node_ix], node_ix + 1)
+      self.assertIsNone(flatten_btree(None, ('order', 'value')))
+
+   def test_median_matches_recursive_builder(self):
+      rnd = random.Random(3)
+      leaf_sets = [create_btree_leaves_from_polygons(self.polygons, self.vertices)] + [create_random_leaves(rnd) for _ in range(100)]
+      for leaves in leaf_sets:
+         expected = json.dumps(create_median_btree(leaves), sort_keys = True)
+         self.assertEqual(json.dumps(create_btree(leaves, 'median'), sort_keys = True), expected)
+
+if __name__ == '__main__':
+   unittest.main()
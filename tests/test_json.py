@@ -0,0 +1,63 @@
+
+import io, json, os, sys, unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.model import *
+
+EXAMPLE_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'example', 'girl.json')
+
+def prepare(obj, indent, precision):
+   # Rounds floats, and with indentation turns tuples into strings, replaced with single-line arrays after dumping.
+   if isinstance(obj, float):
+      return obj if (precision is None) else round(obj, precision)
+   elif isinstance(obj, tuple):
+      obj = tuple(prepare(val, indent, precision) for val in obj)
+      return obj if (indent is None) else repr(obj)
+   elif isinstance(obj, dict):
+      return {key: prepare(val, indent, precision) for key, val in obj.items()}
+   elif isinstance(obj, list):
+      return [prepare(val, indent, precision) for val in obj]
+   else:
+      return obj
+
+def reference_dumps(obj, indent, precision):
+   obj = prepare(obj, indent, precision)
+   if indent is None:
+      return json.dumps(obj, separators = (',', ':'), sort_keys = True)
+   s = json.dumps(obj, indent = indent, separators = (',', ': '), sort_keys = True)
+   return s.replace('"(', '[').replace(')"', ']')
+
+class JsonWriterTest(unittest.TestCase):
+
+   def setUp(self):
+      model = Model()
+      model.load_model(load_model_file(EXAMPLE_PATH))
+      self.objects = [model.save_model(), model.export_btree()]
+
+   def check(self, indent, precision):
+      for obj in self.objects:
+         expected = reference_dumps(obj, indent, precision)
+         self.assertEqual(dump_json(obj, indent, precision), expected)
+         f = io.StringIO()
+         write_json(f, obj, indent, precision)
+         self.assertEqual(f.getvalue(), expected)
+
+   def test_indented(self):
+      self.check(1, None)
+      self.check(3, None)
+
+   def test_compact(self):
+      self.check(None, None)
+
+   def test_precision(self):
+      self.check(1, 3)
+      self.check(None, 0)
+
+   def test_special_values(self):
+      obj = {'b': [], 'a': {}, 'c': [True, None, 'x"y', (1, 2.5), [0.125]], 'd': {'e': (1.0, -0.0)}}
+      for indent in (1, None):
+         self.assertEqual(dump_json(obj, indent, 2), reference_dumps(obj, indent, 2))
+
+if __name__ == '__main__':
+   unittest.main()
@@ -0,0 +1,87 @@
+
+import json, os, shutil, sys, tempfile, unittest
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import src.jsonstream
+from src.model import *
+
+EXAMPLE_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'example', 'girl.json')
+
+MODEL_TEXT = '''{ "polygons" : [ [0, 1, 2] , [1,3,2] ],
+ "entities": [{"kind": "point", "name": "\\u00e9p\u00e9e \\"1\\"", "value": 0}, {"kind": "edge", "name": "e", "value": [1, 2]}],
+ "colors": [[1.0, 0.0, 0.0, 1.0], [0, 1, 0, 1], [0.0, 0.0, 1.0, 1.0], [1.0, 1.0, 1.0, 0.5]],
+ "texcoords": [], "vertices": {"idle": [[[0.0, 0.0], [1.5e-3, 0.0], [0.0, -1.0E2], [1.0, 1.0]]], "empty": []}}
+'''
+
+def normalize(obj):
+   # Turns arrays and tuples into lists, so that loaded models compare equal to json.load output.
+   if isinstance(obj, np.ndarray):
+      return obj.tolist()
+   elif isinstance(obj, (list, tuple)):
+      return [normalize(val) for val in obj]
+   elif isinstance(obj, dict):
+      return {key: normalize(val) for key, val in obj.items()}
+   else:
+      return obj
+
+class JsonStreamTest(unittest.TestCase):
+
+   def setUp(self):
+      self.dir = tempfile.mkdtemp()
+      self.chunk_size = src.jsonstream.CHUNK_SIZE
+
+   def tearDown(self):
+      src.jsonstream.CHUNK_SIZE = self.chunk_size
+      shutil.rmtree(self.dir)
+
+   def write_file(self, data):
+      path = os.path.join(self.dir, 'model.json')
+      with open(path, 'wb') as f:
+         f.write(data)
+      return path
+
+   def check_chunk_sizes(self, path):
+      with open(path, 'rb') as f:
+         expected = json.loads(f.read().decode('utf-8'))
+      for chunk_size in (1, 2, 3, 7, 64, 1000, self.chunk_size):
+         src.jsonstream.CHUNK_SIZE = chunk_size
+         progress = []
+         data = read_json_model(path, lambda nread, size: progress.append((nread, size)))
+         self.assertEqual(normalize(data), expected)
+         self.assertTrue(progress)
+         self.assertEqual(sorted(progress), progress)
+         self.assertLessEqual(progress[-1][0], progress[-1][1])
+
+   def test_example_model(self):
+      self.check_chunk_sizes(EXAMPLE_PATH)
+
+   def test_tokens_across_chunks(self):
+      self.check_chunk_sizes(self.write_file(MODEL_TEXT.encode('utf-8')))
+
+   def test_truncated_file(self):
+      text = MODEL_TEXT.encode('utf-8').rstrip()
+      for chunk_size in (1, 5, self.chunk_size):
+         src.jsonstream.CHUNK_SIZE = chunk_size
+         for end in range(len(text)):
+            path = self.write_file(text[:end])
+            with self.assertRaises(ValueError):
+               read_json_model(path)
+
+   def test_invalid_file(self):
+      for text in ('[]', '{"polygons": [[0, 1, 2] [1, 3, 2]]}', '{"polygons" [[0, 1, 2]]}', '{"colors": [[1, 0, 0, 1],]}',
+                   '{"vertices": {"idle": [[[0, 0], [1, 0]]}}', '{"name": tru}', '{"name": "x"', b'{"name": "\xff"}'):
+         path = self.write_file(text if isinstance(text, bytes) else text.encode('utf-8'))
+         with self.assertRaises(ValueError):
+            read_json_model(path)
+
+   def test_cancel(self):
+      def cancel(nread, size):
+         raise RecoverableError('Loading cancelled')
+      src.jsonstream.CHUNK_SIZE = 1000
+      with self.assertRaises(RecoverableError):
+         read_json_model(EXAMPLE_PATH, cancel)
+
+if __name__ == '__main__':
+   unittest.main()
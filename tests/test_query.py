@@ -0,0 +1,140 @@
+
+import json, math, os, random, sys, unittest
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.query import *
+
+#===============================================================================
+# Brute force versions of the queries, testing every probe against every part
+# of every primitive.
+#===============================================================================
+
+def _cross(ax, ay, bx, by):
+   return ax * by - ay * bx
+
+def triangle_contains(tri, point):
+   if _cross(tri[1][0] - tri[0][0], tri[1][1] - tri[0][1], tri[2][0] - tri[0][0], tri[2][1] - tri[0][1]) == 0:
+      return False
+   sides = [_cross(tri[(ix+1)%3][0] - tri[ix][0], tri[(ix+1)%3][1] - tri[ix][1], point[0] - tri[ix][0], point[1] - tri[ix][1]) for ix in range(3)]
+   return not (any(side < 0 for side in sides) and any(side > 0 for side in sides))
+
+def shape_overlaps_rect(verts, rect):
+   left, right, bottom, top = rect
+   xs = [v[0] for v in verts]
+   ys = [v[1] for v in verts]
+   if min(xs) > right or max(xs) < left or min(ys) > top or max(ys) < bottom:
+      return False
+   corners = [(left, bottom), (right, bottom), (right, top), (left, top)]
+   for ix in range(len(verts)):
+      v1, v2 = verts[ix], verts[(ix+1) % len(verts)]
+      normal = (v1[1] - v2[1], v2[0] - v1[0])
+      proj_shape = [normal[0] * v[0] + normal[1] * v[1] for v in verts]
+      proj_rect = [normal[0] * v[0] + normal[1] * v[1] for v in corners]
+      if min(proj_shape) > max(proj_rect) + 1e-9 or max(proj_shape) < min(proj_rect) - 1e-9:
+         return False
+   return True
+
+def get_parts(kind, value, vertices):
+   # Returns parts of the primitive as ('triangle', vertices), ('segment', vertices) or ('disc', center, radius).
+   if kind == 'polygon':
+      return [('triangle', [vertices[ix] for ix in value[k:k+3]]) for k in range(0, len(value) // 3 * 3, 3)]
+   elif kind == ENTITY_POINT:
+      return [('segment', [vertices[value], vertices[value]])]
+   (x1, y1), (x2, y2) = vertices[value[0]], vertices[value[1]]
+   if kind == ENTITY_RECT:
+      return [('triangle', [(x1, y1), (x2, y1), (x2, y2)]), ('triangle', [(x1, y1), (x2, y2), (x1, y2)])]
+   elif kind == ENTITY_CIRCLE:
+      return [('disc', (x1, y1), math.hypot(x2 - x1, y2 - y1))]
+   else:
+      return [('segment', [(x1, y1), (x2, y2)])]
+
+def part_contains(part, point):
+   if part[0] == 'triangle':
+      return triangle_contains(part[1], point)
+   elif part[0] == 'disc':
+      return math.hypot(point[0] - part[1][0], point[1] - part[1][1]) <= part[2]
+   return False
+
+def part_overlaps_rect(part, rect):
+   if part[0] == 'disc':
+      (x, y), radius = part[1], part[2]
+      return math.hypot(max(rect[0] - x, x - rect[1], 0), max(rect[2] - y, y - rect[3], 0)) <= radius
+   return shape_overlaps_rect(part[1], rect)
+
+def find_pairs(prims, probes, test):
+   return sorted((probe_ix, prim_ix) for (probe_ix, probe) in enumerate(probes) for (prim_ix, parts) in prims if any(test(part, probe) for part in parts))
+
+#===============================================================================
+
+class BTreeQueryTest(unittest.TestCase):
+
+   def setUp(self):
+      rnd = random.Random(1)
+      self.vertices = [(rnd.uniform(0, 100), rnd.uniform(0, 100)) for _ in range(200)]
+      # Primitives are made of nearby vertices, so that the tree is not one big overlapping mess.
+      by_position = sorted(range(len(self.vertices)), key = lambda ix: self.vertices[ix])
+      near = lambda pos: by_position[(pos + rnd.randint(0, 8)) % len(by_position)]
+      self.polygons = []
+      for _ in range(80):
+         pos = rnd.randrange(len(by_position))
+         self.polygons.append([near(pos) for _ in range(rnd.randint(1, 4) * 3)])
+      self.entities = []
+      for ix in range(60):
+         kind = rnd.choice((ENTITY_POINT, ENTITY_EDGE, ENTITY_RECT, ENTITY_CIRCLE))
+         pos = rnd.randrange(len(by_position))
+         value = [by_position[pos]] if (kind == ENTITY_POINT) else [by_position[pos], near(pos + 1)]
+         self.entities.append([kind, 'e{}'.format(ix)] + value)
+      self.points = [(rnd.uniform(-5, 105), rnd.uniform(-5, 105)) for _ in range(300)] + self.vertices[::7]
+      self.rects = []
+      for _ in range(150):
+         x, y = rnd.uniform(-5, 105), rnd.uniform(-5, 105)
+         self.rects.append((x, x + rnd.uniform(0, 15), y, y + rnd.uniform(0, 15)))
+
+   def create_queries(self):
+      # Yields queries over both kinds of trees in both layouts, after a trip through JSON, and the primitives.
+      for split in BTREE_SPLITS:
+         for layout in BTREE_LAYOUTS:
+            root = create_btree(create_btree_leaves_from_polygons(self.polygons, self.vertices), split)
+            prims = [(ix, get_parts('polygon', poly, self.vertices)) for (ix, poly) in enumerate(self.polygons)]
+            if layout == 'flat':
+               root = flatten_btree(root, ('order', 'value'))
+            yield (BTreeQuery(json.loads(json.dumps(root)), self.vertices), prims)
+            root = create_btree(create_btree_leaves_from_entities(self.entities, self.vertices), split)
+            prims = [(ix, get_parts(ent[0], ent[2] if (len(ent) == 3) else ent[2:], self.vertices)) for (ix, ent) in enumerate(get_entities_from_btree(root))]
+            if layout == 'flat':
+               root = flatten_btree(root, ('kind', 'name', 'value'))
+            yield (BTreeQuery(json.loads(json.dumps(root)), self.vertices), prims)
+
+   def test_find_at_points(self):
+      for query, prims in self.create_queries():
+         point_ix, prim_ix = query.find_at_points(self.points)
+         found = list(zip(point_ix.tolist(), prim_ix.tolist()))
+         self.assertEqual(found, find_pairs(prims, self.points, part_contains))
+         self.assertEqual(query.find_at_point(*self.points[-1]), [ix for (point_ix, ix) in found if point_ix == len(self.points) - 1])
+
+   def test_find_in_rects(self):
+      for query, prims in self.create_queries():
+         rect_ix, prim_ix = query.find_in_rects(self.rects)
+         found = list(zip(rect_ix.tolist(), prim_ix.tolist()))
+         self.assertEqual(found, find_pairs(prims, self.rects, part_overlaps_rect))
+         self.assertEqual(query.find_in_rect(*self.rects[0]), [ix for (rect_ix, ix) in found if rect_ix == 0])
+
+   def test_queries_hitting_nothing(self):
+      far_points = [(1000.0, 1000.0), (-1000.0, 50.0)]
+      far_rects = [(200.0, 300.0, 200.0, 300.0), (-1000.0, -900.0, 0.0, 100.0)]
+      for query, prims in self.create_queries():
+         for found in (query.find_at_points(far_points), query.find_in_rects(far_rects), query.find_at_points([]), query.find_in_rects([])):
+            self.assertEqual([ixs.tolist() for ixs in found], [[], []])
+         self.assertEqual(query.find_at_point(*far_points[0]), [])
+         self.assertEqual(query.find_in_rect(*far_rects[0]), [])
+         self.assertEqual(query.find_nearest(1000.0, 1000.0, 10.0), (-1, np.inf))
+         self.assertEqual(query.raycast(200.0, 200.0, 300.0, 300.0), (-1, np.inf))
+      query = BTreeQuery(None, self.vertices)
+      self.assertEqual([ixs.tolist() for ixs in query.find_at_points(self.points)], [[], []])
+      self.assertEqual([ixs.tolist() for ixs in query.find_in_rects(self.rects)], [[], []])
+      self.assertEqual(query.find_nearest(50.0, 50.0), (-1, np.inf))
+
+if __name__ == '__main__':
+   unittest.main()
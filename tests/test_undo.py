@@ -0,0 +1,71 @@
+
+import copy, os, sys, unittest
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.model import *
+
+class UndoTest(unittest.TestCase):
+
+   def setUp(self):
+      self.model = Model()
+      for position in ((0.0, 0.0), (1.0, 0.0), (0.0, 1.0)):
+         self.model.insert_vertex(-1, position, INIT_COLOR)
+      self.model.reset_entity_or_polygon_creation()
+
+   def get_state(self):
+      return copy.deepcopy((self.model.polygons, self.model.entities, self.model.colors, self.model.selection_groups,
+         self.model.vertices.tolist()))
+
+   def test_reset_creation_is_undone_separately(self):
+      self.model.insert_vertex(-1, (2.0, 2.0), INIT_COLOR)
+      creating = self.get_state()
+      self.model.reset_entity_or_polygon_creation()
+      self.model.undo_or_redo(False)
+      self.assertEqual(self.get_state(), creating)
+
+   def test_reset_creation_after_undo(self):
+      self.model.insert_vertex(-1, (2.0, 2.0), INIT_COLOR)
+      self.model.insert_vertex(-1, (3.0, 2.0), INIT_COLOR)
+      self.model.undo_or_redo(False)
+      creating = self.get_state()
+      self.model.reset_entity_or_polygon_creation()
+      self.model.undo_or_redo(False)
+      self.assertEqual(self.get_state(), creating)
+
+   def test_group_is_undone_separately(self):
+      self.model.selected = Selection([0, 1])
+      self.model.set_selected_color((1.0, 0.0, 0.0, 1.0))
+      colored = self.get_state()
+      self.model.define_or_select_group(1, True)
+      self.assertEqual(self.model.selection_groups[1], [0, 1])
+      self.model.undo_or_redo(False)
+      self.assertEqual(self.get_state(), colored)
+
+   def test_drag_switching_transform_is_undone(self):
+      self.model.selected = Selection([0, 1, 2])
+      before = self.get_state()
+      # Drag starts moving a single vertex, then scales the whole selection.
+      saved = self.model.save_dragged_vertices([1], None)
+      self.model.vertices[1] = (2.0, 2.0)
+      saved = self.model.save_dragged_vertices(self.model.selected.indices(), saved)
+      scale_vertices(self.model.vertices, self.model.selected.indices(), (0.0, 0.0), 2.0)
+      saved = self.model.save_dragged_vertices(self.model.selected.indices(), saved)
+      scale_vertices(self.model.vertices, self.model.selected.indices(), (0.0, 0.0), 2.0)
+      self.model.undo_or_redo(False)
+      self.assertEqual(self.get_state(), before)
+
+   def test_undo_keeps_memory_limit(self):
+      journal = UndoJournal(1000)
+      for ix in range(5):
+         journal.add(ix)
+         journal.record(np.zeros(10))
+      # Each undo or redo makes the transaction bigger.
+      for ix in range(5):
+         journal.undo(lambda change: np.zeros(len(change) * 4), None)
+         journal.redo(lambda change: np.zeros(len(change) * 4), None)
+         self.assertTrue((journal.total_size <= journal.max_size) or (len(journal.history) <= 1))
+
+if __name__ == '__main__':
+   unittest.main()